@@ -0,0 +1,144 @@
+"""Timing and memory of the phases of IMM and TIM builds.
+
+A build is recorded by wrapping it in record(), and the phases within
+it in phase(). Phases are attributed to the build in progress on the
+same thread, phase() does nothing when there is none, so code which is
+also run outside of builds (such as reading a table) can always be
+wrapped.
+
+Example:
+    >>> with build_stats.record('imm') as build:
+    ...     with build_stats.phase('build_parallels'):
+    ...         imm.build_parallels()
+    ...     build.generation = imm.generation
+    >>> build_stats.recent()[-1].to_json()
+    {'name': 'imm', 'generation': ..., 'seconds': ..., 'phases': [...], ...}
+
+The recent builds are shown on the admin page.
+"""
+
+import os
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+# The number of builds remembered
+history_size = 20
+
+_recent = deque(maxlen=history_size)
+_local = threading.local()
+
+
+def get_rss():
+    """ Return the resident memory of this process in bytes, or None if
+    it can't be determined """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+
+class Phase:
+    __slots__ = ('name', 'seconds', 'rss', 'rss_delta', 'depth')
+
+    def __init__(self, name, depth):
+        self.name = name
+        self.depth = depth
+        self.seconds = None
+        self.rss = None
+        self.rss_delta = None
+
+    def to_json(self):
+        return {'name': self.name,
+                'depth': self.depth,
+                'seconds': self.seconds,
+                'rss': self.rss,
+                'rss_delta': self.rss_delta}
+
+
+class Build:
+    """ The phases of one build of a model """
+
+    def __init__(self, name):
+        self.name = name
+        self.generation = None
+        self.started = datetime.now()
+        self.seconds = None
+        self.rss = None
+        self.error = None
+        self.phases = []
+        self._depth = 0
+
+    def to_json(self):
+        return {'name': self.name,
+                'generation': self.generation,
+                'started': self.started.isoformat(),
+                'seconds': self.seconds,
+                'rss': self.rss,
+                'error': self.error,
+                'phases': [phase.to_json() for phase in self.phases]}
+
+
+def _current():
+    return getattr(_local, 'build', None)
+
+
+@contextmanager
+def record(name):
+    """ Record a build of the model name on this thread
+
+    Builds recorded while another is in progress on the same thread
+    (i.e. the TIM being loaded by the IMM build) are recorded as phases
+    of the outer build instead.
+
+    """
+    if _current() is not None:
+        with phase(name):
+            # Not kept, only the phase is
+            yield Build(name)
+        return
+
+    build = Build(name)
+    _local.build = build
+    start = time.perf_counter()
+    try:
+        yield build
+    except Exception as e:
+        build.error = repr(e)
+        raise
+    finally:
+        _local.build = None
+        build.seconds = time.perf_counter() - start
+        build.rss = get_rss()
+        _recent.append(build)
+
+
+@contextmanager
+def phase(name):
+    """ Record a phase of the build in progress on this thread """
+    build = _current()
+    if build is None:
+        yield
+        return
+
+    entry = Phase(name, build._depth)
+    build.phases.append(entry)
+    build._depth += 1
+    rss = get_rss()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        entry.seconds = time.perf_counter() - start
+        build._depth -= 1
+        entry.rss = get_rss()
+        if rss is not None and entry.rss is not None:
+            entry.rss_delta = entry.rss - rss
+
+
+def recent():
+    """ Return the recent builds, oldest first """
+    return list(_recent)
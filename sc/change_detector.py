@@ -0,0 +1,305 @@
+"""Cheap detection of changes to the files under a folder.
+
+Hashing the path and modification time of every file of a large folder
+(as sc.util.get_folder_deep_md5 does) means a stat of every file each
+time the question "has anything changed?" is asked. A ChangeDetector
+keeps a manifest of the files, by directory, in the db folder and only
+stats the directories: adding, removing or renaming a file changes the
+modification time of its directory, and only the files of those
+directories are stat'd again. This is also how git checkouts, rsync and
+most editors write files.
+
+A file which is modified in place doesn't change its directory, such
+changes are found with a full scan, or, when the inotify_simple package
+is installed, by watching the directories with inotify, in which case
+the directories aren't even stat'd.
+
+Example:
+    >>> detector = ChangeDetector('text-en', sc.text_dir / 'en',
+    ...                           include_filter=lambda name: name.endswith('.html'))
+    >>> detector.signature()
+    '...'
+
+The signature only changes when a file is added, removed or modified.
+"""
+
+import os
+import lz4
+import pickle
+import hashlib
+import logging
+import threading
+
+import sc
+
+logger = logging.getLogger(__name__)
+
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
+
+
+class ChangeDetector:
+    """ Detects changes to the files under folder
+
+    include_filter is called with the name of each file, only the files
+    for which it returns True are tracked. If watch is True and inotify
+    is available the folder is watched for changes.
+
+    """
+
+    manifest_tmpl = 'manifest-{name}.pklz'
+    # Increment when the manifest changes.
+    version = 1
+
+    def __init__(self, name, folder, include_filter=None, watch=True):
+        self.name = name
+        self.folder = folder
+        self.include_filter = include_filter
+        # The modification time of each directory, by path relative
+        # to folder.
+        self._dirs = None
+        # The (mtime_ns, size) of each file, by name, by directory.
+        self._files = None
+        self._signature = None
+        self._lock = threading.Lock()
+        self._watcher = None
+        # Whether the watcher has been running since the last scan
+        self._watched = False
+        if watch and inotify_simple is not None:
+            try:
+                self._watcher = _Watcher(folder)
+            except OSError as e:
+                logger.warning('Could not watch {!s}: {}'.format(folder, e))
+
+    @property
+    def manifest_file(self):
+        return sc.db_dir / 'manifests' / self.manifest_tmpl.format(name=self.name)
+
+    def signature(self, full=False):
+        """ Return a hex digest of the paths, sizes and modification
+        times of the files
+
+        Only the directories are checked for changes, unless full is
+        True, in which case every file is checked.
+
+        """
+        with self._lock:
+            if self._dirs is None:
+                self._load_manifest()
+            if self._dirs is None or full:
+                changed = self._full_scan()
+            else:
+                changed = self._quick_scan()
+            if changed or self._signature is None:
+                self._signature = self._compute_signature()
+                self._save_manifest()
+            return self._signature
+
+    def _quick_scan(self):
+        """ Rescan the directories which changed, return True if any
+        file changed """
+        watcher = self._watcher
+        dirty = set()
+        if watcher is not None and watcher.running:
+            dirty = watcher.take_dirty()
+            if dirty is None:
+                # Events were lost
+                return self._full_scan()
+        if self._watched:
+            # Every change since the last scan was reported
+            candidates = dirty
+        else:
+            candidates = self._dirs
+        changed = False
+        for rel_dir in sorted(candidates):
+            if rel_dir not in self._dirs:
+                # Removed, or new and found from its parent.
+                continue
+            try:
+                mtime = os.stat(self._abspath(rel_dir)).st_mtime_ns
+            except OSError:
+                self._remove_dir(rel_dir)
+                changed = True
+                continue
+            if rel_dir in dirty or mtime != self._dirs[rel_dir]:
+                if self._scan_dir(rel_dir):
+                    changed = True
+        self._watched = watcher is not None and watcher.running
+        return changed
+
+    def _full_scan(self):
+        old_files = self._files
+        self._dirs = {}
+        self._files = {}
+        if self._watcher is not None:
+            self._watcher.take_dirty()
+        if os.path.isdir(str(self.folder)):
+            self._scan_dir('')
+        if self._watcher is not None:
+            self._watcher.start()
+            self._watched = True
+        return self._files != old_files
+
+    def _abspath(self, rel_dir):
+        return os.path.join(str(self.folder), rel_dir)
+
+    def _scan_dir(self, rel_dir):
+        """ Scan a directory and any new directories in it, return True
+        if any of its files changed """
+        path = self._abspath(rel_dir)
+        if self._watcher is not None:
+            # Before listing, so no change is missed.
+            self._watcher.add(rel_dir)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+            entries = list(os.scandir(path))
+        except OSError:
+            self._remove_dir(rel_dir)
+            return True
+        include_filter = self.include_filter
+        files = {}
+        subdirs = set()
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.add(os.path.join(rel_dir, entry.name))
+            elif entry.is_file() and (include_filter is None or include_filter(entry.name)):
+                stat = entry.stat()
+                files[entry.name] = (stat.st_mtime_ns, stat.st_size)
+        changed = self._files.get(rel_dir) != files
+        self._dirs[rel_dir] = mtime
+        self._files[rel_dir] = files
+        for child in [d for d in self._dirs if os.path.dirname(d) == rel_dir and d != rel_dir]:
+            if child not in subdirs:
+                self._remove_dir(child)
+                changed = True
+        for child in sorted(subdirs):
+            if child not in self._dirs:
+                if self._scan_dir(child):
+                    changed = True
+        return changed
+
+    def _remove_dir(self, rel_dir):
+        prefix = rel_dir + os.sep if rel_dir else ''
+        for d in [d for d in self._dirs if d == rel_dir or d.startswith(prefix)]:
+            del self._dirs[d]
+            self._files.pop(d, None)
+            if self._watcher is not None:
+                self._watcher.remove(d)
+
+    def _compute_signature(self):
+        md5 = hashlib.md5()
+        for rel_dir in sorted(self._files):
+            for name, (mtime, size) in sorted(self._files[rel_dir].items()):
+                md5.update('{}\0{}\0{}\0{}\n'.format(rel_dir, name, mtime, size).encode('utf-8'))
+        return md5.hexdigest()
+
+    def _load_manifest(self):
+        file = self.manifest_file
+        if not file.exists():
+            return
+        try:
+            with file.open('rb') as f:
+                version, folder, dirs, files, signature = pickle.loads(lz4.uncompress(f.read()))
+        except Exception as e:
+            logger.exception('Failed to load manifest {!s}'.format(file))
+            return
+        if version != self.version or folder != str(self.folder):
+            return
+        self._dirs = dirs
+        self._files = files
+        self._signature = signature
+        if self._watcher is not None:
+            for rel_dir in dirs:
+                self._watcher.add(rel_dir)
+            self._watcher.start()
+
+    def _save_manifest(self):
+        file = self.manifest_file
+        file.parent.mkdir(parents=True, exist_ok=True)
+        data = (self.version, str(self.folder), self._dirs, self._files, self._signature)
+        tmp_file = file.with_suffix('.tmp{}'.format(os.getpid()))
+        try:
+            with tmp_file.open('wb') as f:
+                f.write(lz4.compress(pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)))
+            tmp_file.rename(file)
+        except OSError as e:
+            logger.exception('Failed to save manifest {!s}'.format(file))
+
+
+class _Watcher:
+    """ Records the directories under a folder in which inotify reports
+    changes """
+
+    def __init__(self, folder):
+        flags = inotify_simple.flags
+        self.folder = folder
+        self.mask = (flags.CREATE | flags.DELETE | flags.MODIFY | flags.ATTRIB |
+                     flags.CLOSE_WRITE | flags.MOVED_FROM | flags.MOVED_TO |
+                     flags.DELETE_SELF | flags.MOVE_SELF)
+        self.inotify = inotify_simple.INotify()
+        self.wds = {}
+        self.paths = {}
+        self.dirty = set()
+        self.overflow = False
+        self.running = False
+        self.lock = threading.Lock()
+
+    def add(self, rel_dir):
+        if rel_dir in self.wds:
+            return
+        try:
+            wd = self.inotify.add_watch(os.path.join(str(self.folder), rel_dir), self.mask)
+        except OSError:
+            # Gone, or out of watches: fall back to checking it.
+            with self.lock:
+                self.overflow = True
+            return
+        with self.lock:
+            self.wds[rel_dir] = wd
+            self.paths[wd] = rel_dir
+
+    def remove(self, rel_dir):
+        with self.lock:
+            wd = self.wds.pop(rel_dir, None)
+            if wd is None:
+                return
+            self.paths.pop(wd, None)
+        try:
+            self.inotify.rm_watch(wd)
+        except OSError:
+            pass
+
+    def take_dirty(self):
+        """ Return the directories which changed since the last call, or
+        None if changes may have been missed """
+        with self.lock:
+            dirty, self.dirty = self.dirty, set()
+            overflow, self.overflow = self.overflow, False
+        return None if overflow else dirty
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        thread = threading.Thread(target=self._run, name='inotify {!s}'.format(self.folder))
+        thread.daemon = True
+        thread.start()
+
+    def _run(self):
+        flags = inotify_simple.flags
+        while True:
+            for event in self.inotify.read():
+                with self.lock:
+                    if event.mask & flags.Q_OVERFLOW:
+                        self.overflow = True
+                        continue
+                    rel_dir = self.paths.get(event.wd)
+                    if rel_dir is None:
+                        continue
+                    self.dirty.add(rel_dir)
+                    if event.mask & flags.ISDIR and event.name:
+                        # A new or removed directory is found by
+                        # rescanning its parent.
+                        self.dirty.add(os.path.join(rel_dir, event.name))
@@ -61,9 +61,13 @@ class Collection(ConciseRepr, Serializable, namedtuple('Collection',
 
 class Division(ConciseRepr, Serializable, namedtuple('Division', 
         'uid collection name alt_name acronym subdiv_ind '
-        'menu_seq menu_gwn_ind text_ref subdivisions')):
+        'menu_seq menu_gwn_ind subdivisions imm')):
     __slots__ = ()
 
+    @property
+    def text_ref(self):
+        return self.imm.get_division_text_ref(self.uid)
+
     @staticmethod
     def sort_key(division):
         """Return the canonical sort key."""
@@ -107,11 +111,11 @@ class SuttaCommon(Serializable):
 
     @property
     def text_ref(self):
-        return self.imm.get_text_ref(self.uid, self.lang.uid)
+        return self.imm.get_sutta_text_refs(self.uid, self.lang.uid)[0]
 
     @property
     def translations(self):
-        return self.imm.get_translations(self.uid, self.lang.uid)
+        return self.imm.get_sutta_text_refs(self.uid, self.lang.uid)[1]
 
     @property
     def local_text_refs(self):
@@ -166,21 +170,73 @@ class SuttaCommon(Serializable):
         else:
             return ''
 
-class Sutta(ConciseRepr, namedtuple('Sutta',
-        'uid acronym alt_acronym name vagga_number '
-        'number_in_vagga number lang subdivision vagga '
-        'volpage alt_volpage_info biblio_entry '
-        'parallels, imm'), SuttaCommon):
-    __slots__ = ()
+class Sutta(ConciseRepr, SuttaCommon):
+    """ A view of one sutta in a sc.sutta_store.SuttaStore
+
+    The attributes are read from the columns of the store, so a Sutta is
+    only a reference to the store and an index.
+
+    """
+    __slots__ = ('_store', '_index')
+    _fields = ('uid', 'acronym', 'alt_acronym', 'name', 'vagga_number',
+               'number_in_vagga', 'number', 'lang', 'subdivision', 'vagga',
+               'volpage', 'alt_volpage_info', 'biblio_entry', 'parallels',
+               'imm')
+    
+    def __init__(self, store, index):
+        self._store = store
+        self._index = index
+    
+    uid = property(lambda self: self._store.uid[self._index])
+    acronym = property(lambda self: self._store.acronym[self._index])
+    alt_acronym = property(lambda self: self._store.alt_acronym[self._index])
+    vagga_number = property(lambda self: self._store.vagga_number[self._index])
+    number_in_vagga = property(lambda self: self._store.number_in_vagga[self._index])
+    number = property(lambda self: self._store.number[self._index])
+    volpage = property(lambda self: self._store.volpage[self._index])
+    alt_volpage_info = property(lambda self: self._store.alt_volpage_info[self._index])
+    
+    @property
+    def lang(self):
+        return self._store.languages[self._store.lang[self._index]]
+    
+    @property
+    def subdivision(self):
+        return self._store.subdivisions[self._store.subdivision[self._index]]
+    
+    @property
+    def vagga(self):
+        return self._store.vaggas[self._store.vagga[self._index]]
+    
+    @property
+    def biblio_entry(self):
+        return self._store.biblio_entries.get(self._index)
+    
+    @property
+    def parallels(self):
+        return self._store.get_parallels(self._index)
+    
+    @property
+    def parallels_count(self):
+        return self._store.parallels_count(self._index)
+    
+    @property
+    def imm(self):
+        return self._store.imm
 
     @property
     def name(self):
-        supname = super().name
+        supname = self._store.name[self._index]
         if supname:
             return supname
         ti = self._textinfo
         return self._fixname(ti.name if ti else '')
     
+    def __eq__(self, other):
+        if isinstance(other, Sutta):
+            return self._store is other._store and self._index == other._index
+        return NotImplemented
+    
     def __hash__(self):
         return hash(self.uid)
     
@@ -193,7 +249,7 @@ class GroupedSutta(SuttaCommon):
     """
     
     __slots__ = {'uid', 'ref_uid', 'volpage', '_textinfo',
-                'parallel_group', 'imm'}
+                'parallel_group', 'imm', 'subdivision'}
     
     no_show_parallels = True
     
@@ -205,6 +261,8 @@ class GroupedSutta(SuttaCommon):
         self.uid = uid
         self.volpage = volpage
         self.imm = imm
+        # The subdivision is fixed for the life of the IMM.
+        self.subdivision = imm.subdivisions[self._subdivision_uid]
         self._textinfo = imm.tim.get(uid, self.lang.uid)
     
     @property
@@ -224,15 +282,12 @@ class GroupedSutta(SuttaCommon):
     
     @property
     def _subdivision_uid(self):
-        imm = self.imm
-        uid = self.uid
-        uid = uid.replace('#', '-')
-        # Just keep slicing it until we find something that
-        # matches. It's good enough.
-        while len(uid) > 0:
-            if uid in imm.subdivisions:
-                return uid
-            uid = uid[:-1]
+        uid = self.uid.replace('#', '-')
+        # The longest subdivision uid which is a prefix of the uid.
+        # It's good enough.
+        subdiv_uid = self.imm.guess_subdiv_uid(uid)
+        if subdiv_uid:
+            return subdiv_uid
         raise ValueError("Subdivision for sutta with uid {} could not be determined".format(self.uid))
 
     @property
@@ -243,10 +298,6 @@ class GroupedSutta(SuttaCommon):
             print(self.uid)
             raise
         
-    @property
-    def subdivision(self):
-        return self.imm.subdivisions[self._subdivision_uid]
-    
     @property
     def lang(self):
         return self.subdivision.division.collection.lang
@@ -0,0 +1,140 @@
+"""Compact sets of unicode codepoints.
+
+The TIM records which characters are used by each language, in normal,
+bold and italic text, so that fonts can be subset to them. As Python
+sets of 1-character strings, the sets of the CJK languages (tens of
+thousands of characters each) are slow to pickle, unpickle and merge.
+
+A CodepointSet is a bitmap, held in a Python int in which bit n is set
+if codepoint n is in the set, so union and intersection are single
+operations on machine words, and it pickles as the bytes of the bitmap.
+The set of a Chinese corpus is no more than a few tens of KiB, whatever
+the number of characters in it.
+
+With 15,000 random characters from the CJK Unified Ideographs block:
+
+    ============ ============ ========== ===============
+                 pickled size unpickle   union of 4 sets
+    ============ ============ ========== ===============
+    set of str   62.5 KiB     1.5 ms     1.8 ms
+    CodepointSet 5.0 KiB      0.007 ms   0.002 ms
+    ============ ============ ========== ===============
+
+Making one from a set of characters takes about 2 ms, and getting the
+characters back about 1 ms, both are only done once per text or font.
+
+Example:
+    >>> chars = CodepointSet('abc') | CodepointSet('cde')
+    >>> chars.text()
+    'abcde'
+    >>> chars.ranges()
+    [(97, 101)]
+"""
+
+import regex
+
+# Runs of set bits in the reversed binary representation of a bitmap
+_run_rex = regex.compile(r'1+')
+
+# The offsets of the set bits of each byte value
+_byte_bits = [tuple(i for i in range(8) if byte >> i & 1) for byte in range(256)]
+
+
+class CodepointSet:
+    """ An immutable set of codepoints
+
+    Made from any iterable of characters, such as a string or a set of
+    characters. Iterating over it gives the characters, in order.
+
+    """
+
+    __slots__ = ('_bits',)
+
+    def __init__(self, chars=()):
+        chars = set(chars)
+        if not chars:
+            self._bits = 0
+            return
+        codepoints = [ord(char) for char in chars]
+        bitmap = bytearray(max(codepoints) // 8 + 1)
+        for codepoint in codepoints:
+            bitmap[codepoint >> 3] |= 1 << (codepoint & 7)
+        self._bits = int.from_bytes(bitmap, 'little')
+
+    @classmethod
+    def from_bits(cls, bits):
+        """ Return the set of the bitmap bits """
+        result = cls.__new__(cls)
+        result._bits = bits
+        return result
+
+    @classmethod
+    def from_bytes(cls, data):
+        """ Return the set of the bytes returned by to_bytes """
+        return cls.from_bits(int.from_bytes(data, 'little'))
+
+    @classmethod
+    def union_all(cls, sets):
+        """ Return the union of the sets in the iterable sets """
+        bits = 0
+        for codepoint_set in sets:
+            bits |= codepoint_set._bits
+        return cls.from_bits(bits)
+
+    def to_bytes(self):
+        """ Return the bitmap as bytes, lowest codepoints first """
+        return self._bits.to_bytes((self._bits.bit_length() + 7) // 8, 'little')
+
+    def ranges(self):
+        """ Return the codepoints as sorted (start, end) pairs, end
+        being inclusive """
+        binary = bin(self._bits)[:1:-1]
+        return [(m.start(), m.end() - 1) for m in _run_rex.finditer(binary)]
+
+    def codepoints(self):
+        """ Return the codepoints in order """
+        return [i * 8 + offset for i, byte in enumerate(self.to_bytes()) if byte
+                for offset in _byte_bits[byte]]
+
+    def text(self):
+        """ Return a string of the characters in order """
+        return ''.join(map(chr, self.codepoints()))
+
+    def __iter__(self):
+        return iter(self.text())
+
+    def __len__(self):
+        return bin(self._bits).count('1')
+
+    def __bool__(self):
+        return self._bits != 0
+
+    def __contains__(self, char):
+        return bool(self._bits >> ord(char) & 1)
+
+    def __or__(self, other):
+        return self.from_bits(self._bits | other._bits)
+
+    def __and__(self, other):
+        return self.from_bits(self._bits & other._bits)
+
+    def __sub__(self, other):
+        return self.from_bits(self._bits & ~other._bits)
+
+    def __eq__(self, other):
+        if not isinstance(other, CodepointSet):
+            return NotImplemented
+        return self._bits == other._bits
+
+    def __hash__(self):
+        return hash(self._bits)
+
+    def __repr__(self):
+        return 'CodepointSet({!r})'.format(self.text())
+
+    def __reduce__(self):
+        return (_from_bytes, (self.to_bytes(),))
+
+
+def _from_bytes(data):
+    return CodepointSet.from_bytes(data)
@@ -1,8 +1,32 @@
+""" Loading of the CSV tables
+
+Parsing a table is relatively slow and many tables are read by more
+than one module, so each table is parsed once, for as long as its file
+is unchanged, into a column oriented form which is kept in memory and
+cached in the db folder.
+
+Each column is dictionary encoded, a list of the distinct values and an
+array of indexes into it. This is compact, as most columns contain many
+repeated values, and fast to load.
+
+Example:
+    >>> from sc.csv_loader import table_reader
+    >>> [row.name for row in table_reader('pitaka')]
+    ['Sutta', 'Vinaya', 'Abhidhamma']
+"""
+
+import os
 import csv
+import lz4
+import hashlib
+import pickle
 import logging
-
+import threading
+import multiprocessing
+from array import array
 from collections import namedtuple
 import sc
+from sc import build_stats
 
 logger = logging.getLogger(__name__)
 
@@ -16,25 +40,197 @@ class ScCsvDialect(csv.Dialect):
     lineterminator = '\n'
     strict=True
 
-def table_reader(tablename):
-    """ Like csv.DictReader but returns named tuples (2x faster also) """
-    with (sc.table_dir / (tablename + '.csv')).open('r',
-              encoding='utf-8', newline='') as f:
-        reader = csv.reader(f, dialect=ScCsvDialect)
-        field_names = next(reader)
-        NtName = '_' + tablename.title()
+
+class Table:
+    """ A table stored as dictionary encoded columns """
+
+    db_name_tmpl = 'table-{name}_{hash}.pklz'
+    # Increment when the cached form changes.
+    version = 1
+
+    __slots__ = ('name', 'field_names', 'columns', 'key')
+
+    def __init__(self, name, field_names, columns, key):
+        self.name = name
+        self.field_names = field_names
+        # A (values, indexes) pair for each column
+        self.columns = columns
+        # The (mtime_ns, size) of the file the table was parsed from
+        self.key = key
+
+    def __len__(self):
+        if not self.columns:
+            return 0
+        return len(self.columns[0][1])
+
+    @classmethod
+    def parse(cls, name):
+        """ Parse the table from its CSV file """
+        file = sc.table_dir / (name + '.csv')
+        key = _file_key(file)
+        with file.open('r', encoding='utf-8', newline='') as f:
+            reader = csv.reader(f, dialect=ScCsvDialect)
+            field_names = tuple(next(reader))
+            width = len(field_names)
+            rows = []
+            for lineno, row in enumerate(reader):
+                if not any(row): # Drop entirely blank lines
+                    continue
+                if row[0].startswith('#'):
+                    continue
+                if len(row) != width:
+                    raise TypeError('Error on line {} in table {}, ({})'.format(
+                        lineno, name, 'Expected {} fields, got {}'.format(
+                            width, len(row))))
+                rows.append(row)
+
+        columns = []
+        for column in zip(*rows) if rows else [()] * width:
+            index = {}
+            values = []
+            for value in column:
+                if value not in index:
+                    index[value] = len(values)
+                    values.append(value)
+            typecode = 'B' if len(values) <= 0xff else 'H' if len(values) <= 0xffff else 'L'
+            columns.append((values,
+                            array(typecode, (index[value] for value in column))))
+        return cls(name, field_names, columns, key)
+
+    def row_class(self):
+        return _get_row_class(self.name, self.field_names)
+
+    def rows(self):
+        """ Yield the rows of the table as namedtuples """
+        NT = self.row_class()
+        decoded = [[values[i] for i in indexes]
+                   for values, indexes in self.columns]
+        return map(NT._make, zip(*decoded))
+
+    @classmethod
+    def cache_file(cls, name, key):
+        """ The name of the saved table depends on the state of the CSV
+        file and the version """
+        md5 = hashlib.md5(str((key, cls.version)).encode('ascii'))
+        return sc.db_dir / 'tables' / cls.db_name_tmpl.format(
+            name=name, hash=md5.hexdigest()[:10])
+
+    def save(self):
+        """ Save the table in the db folder
+
+        Saved tables which are no longer current are removed.
+
+        """
+        file = self.cache_file(self.name, self.key)
+        file.parent.mkdir(parents=True, exist_ok=True)
+        data = (self.name, self.field_names, self.columns, self.key)
+        # Write to a temporary file and rename, so other processes
+        # never see a partially written table.
+        tmp_file = file.with_suffix('.tmp{}'.format(os.getpid()))
+        with tmp_file.open('wb') as f:
+            f.write(lz4.compress(pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)))
+        tmp_file.rename(file)
+
+        # Tables whose name has this one as a prefix also match the glob
+        stem = self.db_name_tmpl.format(name=self.name, hash='').rpartition('_')[0]
+        for old_file in file.parent.glob(self.db_name_tmpl.format(name=self.name, hash='*')):
+            if old_file != file and old_file.name.rpartition('_')[0] == stem:
+                old_file.unlink()
+
+    @classmethod
+    def load(cls, name, key):
+        """ Return the table saved in the db folder, or None if there is
+        no saved table for the current file """
+        file = cls.cache_file(name, key)
+        if not file.exists():
+            return None
+        with file.open('rb') as f:
+            name, field_names, columns, key = pickle.loads(
+                lz4.uncompress(f.read()))
+        return cls(name, field_names, columns, key)
+
+
+_row_classes = {}
+
+def _get_row_class(name, field_names):
+    """ Return the namedtuple class for rows of a table
+
+    The class is also made a global of this module, so rows can be
+    pickled.
+
+    """
+    NtName = '_' + name.title()
+    NT = _row_classes.get(NtName)
+    if NT is None or NT._fields != field_names:
         NT = namedtuple(NtName, field_names)
+        _row_classes[NtName] = NT
         globals()[NtName] = NT
-        for lineno, row in enumerate(reader):
-            if not any(row): # Drop entirely blank lines
-                continue
-            if row[0].startswith('#'):
-                continue
+    return NT
+
+def _file_key(file):
+    stat = file.stat()
+    return (stat.st_mtime_ns, stat.st_size)
+
+_tables = {}
+_tables_lock = threading.Lock()
+
+def get_table(tablename):
+    """ Return the Table for tablename, parsing the CSV file only if it
+    has changed since it was last parsed """
+    key = _file_key(sc.table_dir / (tablename + '.csv'))
+    table = _tables.get(tablename)
+    if table is not None and table.key == key:
+        return table
+    with _tables_lock:
+        table = _tables.get(tablename)
+        if table is not None and table.key == key:
+            return table
+        with build_stats.phase('table {}'.format(tablename)):
             try:
-                yield NT._make(row)
-            except TypeError as e:
-                raise TypeError('Error on line {} in table {}, ({})'.format(
-                    lineno, tablename, e))
+                table = Table.load(tablename, key)
+            except Exception as e:
+                logger.exception('Failed to load cached table {}'.format(tablename))
+                table = None
+            if table is None:
+                table = Table.parse(tablename)
+                try:
+                    table.save()
+                except Exception as e:
+                    logger.exception('Failed to save cached table {}'.format(tablename))
+        _tables[tablename] = table
+        return table
+
+def _parse_and_save(tablename):
+    Table.parse(tablename).save()
+    return tablename
+
+def preload_tables(tablenames=None, workers=None):
+    """ Bring the cached tables up to date and load them into memory
+
+    Tables whose cache is out of date are parsed concurrently in a
+    process pool of workers processes (by default one per CPU). The
+    processes are spawned rather than forked, as this runs in a thread
+    of the server, whose locks and connections a fork would inherit.
+
+    """
+    if tablenames is None:
+        tablenames = sorted(file.stem for file in sc.table_dir.glob('*.csv'))
+    stale = []
+    for tablename in tablenames:
+        key = _file_key(sc.table_dir / (tablename + '.csv'))
+        if not Table.cache_file(tablename, key).exists():
+            stale.append(tablename)
+    if len(stale) > 1 and workers != 1:
+        with build_stats.phase('parse {} tables'.format(len(stale))), \
+                multiprocessing.get_context('spawn').Pool(workers) as pool:
+            for tablename in pool.imap_unordered(_parse_and_save, stale):
+                logger.info('Parsed table {}'.format(tablename))
+    for tablename in tablenames:
+        get_table(tablename)
+
+def table_reader(tablename):
+    """ Like csv.DictReader but returns named tuples (2x faster also) """
+    return get_table(tablename).rows()
 
 def load_table(tablename):
     return {row.uid: row for row in table_reader(tablename)}
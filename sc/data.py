@@ -2,16 +2,14 @@ import cherrypy
 
 import sc.scimm
 import sc.search.query
+from sc.generation import GenerationCache
+
+_translation_count_cache = GenerationCache('translation_count', depends='imm')
 
 class Data:
     def translation_count(self, lang, **kwargs):
-        imm = sc.scimm.imm()
-        key = 'trcount_{}'.format(lang)
-        cache = imm._cache
-        if key not in cache:
-            value = sc.search.query.div_translation_count(lang)
-            cache[key] = value
-        return cache[key]
+        return _translation_count_cache.get(lang,
+            lambda: sc.search.query.div_translation_count(lang))
 
     def langs(self, **kwargs):
         imm = sc.scimm.imm()
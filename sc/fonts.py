@@ -7,6 +7,7 @@ from fontTools import subset
 
 import sc
 import sc.textdata
+from sc.codepoints import CodepointSet
 
 import logging
 
@@ -134,7 +135,7 @@ def compile_fonts(flavors=['woff', 'woff2']):
     valid_compiled_fonts = set()
     
     
-    extra_global_subset_glyphs = get_glyphs_from_table_data()
+    extra_global_subset_glyphs = CodepointSet(get_glyphs_from_table_data())
     
     for file in sorted(fonts_dir.glob('**/*')):
         changed = False
@@ -169,11 +170,11 @@ def compile_fonts(flavors=['woff', 'woff2']):
                 weight = 'normal'
             for subset_details in font_details['subset']:
                 subset_languages = subset_details['subset_languages']
-                subset_unicodes = set()
+                subset_unicodes = CodepointSet()
                 
                 if subset_languages == '*': # global subset
-                    subset_unicodes.update(extra_global_subset_glyphs)
-                    subset_unicodes.update(tim.get_codepoints_used(lang_uid=None, weight_or_style=weight))
+                    subset_unicodes = (extra_global_subset_glyphs |
+                                       tim.get_codepoints_used(lang_uid=None, weight_or_style=weight))
                 
                 else:
                     if isinstance(subset_languages, str):
@@ -184,8 +185,8 @@ def compile_fonts(flavors=['woff', 'woff2']):
                         if codepoints is None:
                             logger.error('Error in fonts.json, language uid "{}" not found in TIM'.format(language))
                         else:
-                            subset_unicodes.update(codepoints)
-                subset_text = ''.join(subset_unicodes)
+                            subset_unicodes |= codepoints
+                subset_text = subset_unicodes.text()
                 subset_text = ''.join(sorted(subset_text.lower() + subset_text.upper()))
                 subset_md5 = md5.copy()
                 subset_md5.update(subset_text.encode(encoding='utf8'))
@@ -0,0 +1,111 @@
+"""Generations of the data models, and caches which depend on them.
+
+Each time a new IMM or TIM is published it is given a new generation
+number. Values derived from a model are kept in a GenerationCache which
+declares the model it depends on, the cache discards its contents when
+that model moves to a new generation.
+
+Example:
+    >>> _menu_cache = GenerationCache('menu', depends='imm')
+    >>> def get_menu():
+    ...     return _menu_cache.get('menu', build_menu)
+
+The registered caches can be inspected with caches().
+"""
+
+import itertools
+import threading
+
+_counter = itertools.count(1)
+_counter_lock = threading.Lock()
+
+# The functions returning the current generation of each model.
+_sources = {}
+# The caches, by name.
+_caches = {}
+
+
+def next_generation():
+    """ Return a new generation number, greater than all previous ones """
+    with _counter_lock:
+        return next(_counter)
+
+
+def register_source(name, function):
+    """ Register a function returning the current generation of a model """
+    _sources[name] = function
+
+
+def current(name):
+    """ Return the current generation of a model """
+    return _sources[name]()
+
+
+def caches():
+    """ Return the registered caches, by name """
+    return dict(_caches)
+
+
+class GenerationCache:
+    """ A cache which is emptied when the model it depends on changes
+
+    The generation and the values are swapped together, so no lock is
+    needed: a request still working with an older model at worst
+    computes a value which is then discarded.
+
+    """
+
+    def __init__(self, name, depends='imm', locked=False):
+        self.name = name
+        self.depends = depends
+        self._state = (None, {})
+        # Values which are expensive to compute are only computed once,
+        # by one thread, when the cache is locked. Each key has its own
+        # lock so threads computing different values don't wait on one
+        # another, the cache lock only guards the creation of those.
+        self._lock = threading.Lock() if locked else None
+        self._key_locks = {}
+        _caches[name] = self
+
+    def _values(self):
+        generation = current(self.depends)
+        state = self._state
+        if state[0] != generation:
+            state = (generation, {})
+            self._state = state
+        return state[1]
+
+    def get(self, key, function):
+        """ Return the value for key, calling function() to compute it
+        if it isn't cached for the current generation """
+        values = self._values()
+        try:
+            return values[key]
+        except KeyError:
+            if self._lock is None:
+                value = values[key] = function()
+                return value
+        with self._key_lock(key):
+            try:
+                return values[key]
+            except KeyError:
+                value = values[key] = function()
+                return value
+
+    def _key_lock(self, key):
+        try:
+            return self._key_locks[key]
+        except KeyError:
+            with self._lock:
+                return self._key_locks.setdefault(key, threading.Lock())
+
+    @property
+    def generation(self):
+        """ The generation of the cached values """
+        return self._state[0]
+
+    def __len__(self):
+        return len(self._state[1])
+
+    def clear(self):
+        self._state = (None, {})
@@ -1,11 +1,12 @@
 
-from collections import OrderedDict
+from collections import OrderedDict, namedtuple
 
 
 import sc
 import sc.scimm
 import sc.textdata
 
+from sc.generation import GenerationCache
 from sc.views import ViewBase
 
 available_language_templates = {f.stem for f in (sc.templates_dir / 'language').glob('*.html')
@@ -21,6 +22,9 @@ class LanguageView(ViewBase):
                 self.template_name = 'language/' + lang
         print('Creating Language View for {}/{} with template {}'.format(lang, div_uid, self.template_name))
     
+    def render_cache_key(self):
+        return (self.lang, self.div_uid)
+    
     def setup_context(self, context):
         tree = get_translation_tree(self.lang)
         if self.div_uid:
@@ -36,7 +40,7 @@ class TranslationTreeBuilder:
     def __init__(self, lang):
         self.lang = lang
         self.imm = sc.scimm.imm()
-        self.all_lang_translations = set(sc.textdata.tim().get(lang_uid=lang))
+        self.all_lang_translations = set(self.imm.tim.get(lang_uid=lang))
     
     def prune(self):
         while True:
@@ -134,30 +138,66 @@ class TranslationTreeBuilder:
             "url": text_ref.url
         }
         
+    def freeze(self, node=None):
+        """ Return the tree as TranslationNodes """
+        if node is None:
+            node = self.tree
+        return TranslationNode(
+            node["uid"], node.get("name", ""), node["type"],
+            tuple(self.freeze(child) for child in node.get("children", ())),
+            tuple(Translation(t["name"], t["url"]) for t in node.get("translations", ())),
+            node.get("descendents", 0))
+
+Translation = namedtuple('Translation', 'name url')
+
+class TranslationNode:
+    """ A division, subdivision or sutta of a translation tree """
+    
+    __slots__ = ('uid', 'name', 'type', 'children', 'translations', 'descendents')
+    
+    def __init__(self, uid, name, type, children, translations, descendents):
+        self.uid = uid
+        self.name = name
+        self.type = type
+        self.children = children
+        self.translations = translations
+        self.descendents = descendents
+
+class TranslationTree:
+    """ The divisions, subdivisions and suttas which have translations
+    in a language """
+    
+    def __init__(self, root):
+        self.root = root
+        # The nodes other than suttas by uid, the first in breadth
+        # first order if there are several.
+        self.nodes = {}
+        stack = [root]
+        i = 0
+        while len(stack) > i:
+            node = stack[i]
+            self.nodes.setdefault(node.uid, node)
+            stack.extend(child for child in node.children if child.type != "sutta")
+            i += 1
+    
     def get_node_with_uid(self, uid):
         if uid:
-            stack = [self.tree]
-            i = 0
-            while len(stack) > i:
-                node = stack[i]
-                if node["uid"] == uid:
-                    return node
-                stack.extend(child for child in node.get("children", []) if child["type"] != "sutta")
-                i += 1
+            return self.nodes.get(uid)
         return None
     
     def get_root(self):
-        return self.tree
+        return self.root
+
+# The trees are built once for each IMM, which is rebuilt when the TIM
+# changes.
+_tree_cache = GenerationCache('translation_tree', depends='imm', locked=True)
 
 def get_translation_tree(lang:str):
+    return _tree_cache.get(lang, lambda: build_translation_tree(lang))
+
+def build_translation_tree(lang:str):
     tree_builder = TranslationTreeBuilder(lang)
     tree_builder.build_from_imm()
     tree_builder.prune()
     tree_builder.add_descendent_counts()
-    return tree_builder
-
-                    
-    
-            
-        
-    
+    return TranslationTree(tree_builder.freeze())
@@ -20,6 +20,7 @@ Example:
 from collections import namedtuple
 
 import sc.scimm
+from sc.generation import GenerationCache
 
 
 class Menu(list):
@@ -63,10 +64,7 @@ def build_menu():
     return menu
 
 
-_menu = None
+_menu_cache = GenerationCache('menu', depends='imm')
 def get_menu():
     """Return the cached SuttaCentral menu."""
-    global _menu
-    if _menu is None:
-        _menu = build_menu()
-    return _menu
+    return _menu_cache.get('menu', build_menu)
@@ -0,0 +1,134 @@
+"""The transforms applied to the HTML of every rendered page.
+
+Once a template has been rendered, its whitespace is collapsed
+(massage_whitespace) and table cells containing Chinese or Tibetan are
+given a lang attribute (add_lang_tags). Both are regexes over the whole
+page, and on a text page nearly all of the page is the text itself,
+which only changes when its file does.
+
+So the text can be transformed once, when it is extracted (see
+sc.text_extracts), and spliced into the page after the rest of it has
+been transformed: the template is rendered with a placeholder in its
+place, and the placeholder is replaced with the prepared text.
+
+This gives exactly the same page, provided the text starts with a start
+tag and ends with an end tag, apart from leading and trailing
+whitespace which is left in the page. Neither regex can then match
+across the edges of the text: a run of whitespace can't extend into it,
+and a table cell can't start outside it and end inside it, or the
+reverse, as a cell can't contain a '>' other than those of its own
+tags. prepare_fragment returns None for html which doesn't qualify.
+
+Example:
+    >>> fragment = prepare_fragment(text)
+    >>> page = render_with_fragments(template.render, context, {'text': fragment})
+"""
+
+from collections import namedtuple
+
+import regex
+
+from sc.textfunctions import cjk_regex
+
+# The languages whose texts have the newlines removed by massage_cjk
+cjk_lang_codes = frozenset({'zh', 'lzh', 'ko', 'jp'})
+
+whitespace_rex = regex.compile(r'\n[ \n\t]+')
+
+cjk_tag_rex = regex.compile(r'<(td[^>]*)>([^>]*' + cjk_regex.pattern.strip('()+') + '[^>]*)</(td)>')
+tib_tag_rex = regex.compile(r'<(td[^>]*)>([^>]*' + '[\u0F00-\u0FFF]' + '[^>]*)</(td)>')
+
+# Leading whitespace, a start tag ... an end tag, trailing whitespace
+fragment_rex = regex.compile(r'([ \n\t]*)(<(?!/).*</[^>]*>)([ \n\t]*)', flags=regex.DOTALL)
+
+placeholder_tmpl = '<!--sc-fragment:{}-->'
+
+
+def massage_whitespace(text):
+    """ Collapse whitespace following a newline to the newline """
+    return whitespace_rex.sub('\n', text)
+
+
+def _subfn_cjk(m):
+    if 'lang' in m[1]:
+        return m[0]
+    return r'<{m[1]} lang="lzh">{m[2]}</{m[3]}>'.format(m=m)
+
+
+def _subfn_tib(m):
+    if 'lang' in m[1]:
+        return m[0]
+    return r'<{m[1]} lang="bo">{m[2]}</{m[3]}>'.format(m=m)
+
+
+def add_lang_tags(string):
+    """ Add a lang attribute to table cells of Chinese or Tibetan """
+    string = cjk_tag_rex.sub(_subfn_cjk, string)
+    string = tib_tag_rex.sub(_subfn_tib, string)
+    return string
+
+
+def massage_cjk(text, lang_code='lzh'):
+    """ Remove the newlines of a text in a full-width-glyph language,
+    as they'd be rendered as spaces, and mark the CJK of its metaarea
+    with lang_code """
+    def deline(string):
+        return string.replace('\n', '').replace('<p', '\n<p')
+
+    m = regex.match(r'(?s)(.*?)(<aside[^>]+id="metaarea".*?</aside>)(.*)', text)
+    if m:
+        pre, meta, post = m[1:]
+
+        meta = cjk_regex.sub(r'<span lang="{}">\1</span>'.format(lang_code), meta)
+        return ''.join([deline(pre), meta, deline(post)])
+    return deline(text)
+
+
+def transform(string, fix_whitespace=True, lang_tags=True):
+    """ Apply the transforms to string """
+    if fix_whitespace:
+        string = massage_whitespace(string)
+    if lang_tags:
+        string = add_lang_tags(string)
+    return string
+
+
+Fragment = namedtuple('Fragment', 'lead html trail')
+Fragment.__doc__ = """ HTML prepared by prepare_fragment, html has been
+transformed, lead and trail are its leading and trailing whitespace """
+
+
+def prepare_fragment(html):
+    """ Return the Fragment of html, or None if it can't be spliced into
+    a page """
+    m = fragment_rex.fullmatch(html)
+    if not m:
+        return None
+    return Fragment(m[1], transform(m[2]), m[3])
+
+
+def render_with_fragments(render, context, fragments, fix_whitespace=True, lang_tags=True):
+    """ Return the page rendered by calling render with context, as
+    transformed, with the fragments spliced in
+
+    fragments maps the names of context variables to their Fragment,
+    which must have been prepared from the value of the variable. A
+    page which doesn't contain each placeholder exactly once is
+    rendered and transformed whole.
+
+    """
+    if not (fix_whitespace and lang_tags) or not fragments:
+        return transform(render(context), fix_whitespace, lang_tags)
+    placeholders = {}
+    spliced = dict(context)
+    for name, fragment in fragments.items():
+        placeholder = placeholder_tmpl.format(name)
+        placeholders[placeholder] = fragment.html
+        spliced[name] = fragment.lead + placeholder + fragment.trail
+    string = render(spliced)
+    if any(string.count(placeholder) != 1 for placeholder in placeholders):
+        return transform(render(context))
+    string = transform(string)
+    for placeholder, html in placeholders.items():
+        string = string.replace(placeholder, html, 1)
+    return string
@@ -0,0 +1,233 @@
+"""The graph of parallels between suttas.
+
+The correspondence table defines edges between suttas, which are either
+full or partial parallels. Suttas which are connected through full
+parallels form a cluster, and every member of a cluster is an (indirect)
+parallel of every other member.
+
+Example:
+    >>> graph = ParallelGraph([('dn1', 'da21', False, None),
+    ...                        ('da21', 't21', False, 'Note'),
+    ...                        ('dn1', 'sf8', True, None)])
+    >>> graph.fulls('dn1')
+    [('da21', None)]
+    >>> graph.indirects('dn1')
+    [('t21', 'Note')]
+    >>> graph.partials('dn1')
+    [('sf8', None)]
+    >>> graph.component('t21')
+    ['da21', 'dn1', 't21']
+
+Nodes are identified by integers and the adjacency is stored in
+compressed sparse row (CSR) form in arrays, which is much more compact
+than sets of tuples and lets building and querying take time linear in
+the number of edges involved.
+"""
+
+from array import array
+from collections import deque
+
+
+class UnionFind:
+    """ Disjoint sets over the integers 0..n-1 """
+
+    __slots__ = ('parent', 'size')
+
+    def __init__(self, n):
+        self.parent = array('l', range(n))
+        self.size = array('l', [1]) * n
+
+    def find(self, i):
+        parent = self.parent
+        while parent[i] != i:
+            # Path halving
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(self, a, b):
+        a = self.find(a)
+        b = self.find(b)
+        if a == b:
+            return a
+        if self.size[a] < self.size[b]:
+            a, b = b, a
+        self.parent[b] = a
+        self.size[a] += self.size[b]
+        return a
+
+
+class CSRGraph:
+    """ An undirected graph in compressed sparse row form.
+
+    The neighbours of node i are indices[offsets[i]:offsets[i + 1]], the
+    data associated with each edge is in the same position of data.
+    Neighbours are sorted, and duplicate (neighbour, data) edges removed.
+
+    """
+
+    __slots__ = ('offsets', 'indices', 'data')
+
+    def __init__(self, n, edges):
+        pairs = set()
+        for a, b, value in edges:
+            pairs.add((a, b, value))
+            pairs.add((b, a, value))
+        pairs = sorted(pairs)
+
+        offsets = array('l', [0]) * (n + 1)
+        for a, _, _ in pairs:
+            offsets[a + 1] += 1
+        for i in range(n):
+            offsets[i + 1] += offsets[i]
+
+        self.offsets = offsets
+        self.indices = array('l', (b for _, b, _ in pairs))
+        self.data = array('l', (value for _, _, value in pairs))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def edges(self, node):
+        """ Return the (neighbour, data) pairs of node """
+        start, end = self.offsets[node], self.offsets[node + 1]
+        return list(zip(self.indices[start:end], self.data[start:end]))
+
+    def neighbourhood(self, node, k=None):
+        """ Return nodes within k hops of node, in breadth first order
+
+        Each entry is a (node, data, distance) tuple, data being the data
+        of the edge through which the node was first reached. The node
+        itself is not included. If k is None the entire connected
+        component is returned.
+
+        """
+        offsets, indices, data = self.offsets, self.indices, self.data
+        seen = {node}
+        out = []
+        queue = deque([(node, 0)])
+        while queue:
+            current, distance = queue.popleft()
+            if k is not None and distance >= k:
+                continue
+            for j in range(offsets[current], offsets[current + 1]):
+                neighbour = indices[j]
+                if neighbour in seen:
+                    continue
+                seen.add(neighbour)
+                out.append((neighbour, data[j], distance + 1))
+                queue.append((neighbour, distance + 1))
+        return out
+
+
+class ParallelGraph:
+    """ The parallel relationships defined by the correspondence table
+
+    Rows are (uid, other_uid, partial, footnote) tuples. Queries return
+    lists of (uid, footnote) tuples.
+
+    """
+
+    def __init__(self, rows):
+        self.uids = []
+        self.index = {}
+        self.footnotes = []
+        footnote_index = {}
+
+        def node(uid):
+            try:
+                return self.index[uid]
+            except KeyError:
+                self.index[uid] = i = len(self.uids)
+                self.uids.append(uid)
+                return i
+
+        def footnote_id(footnote):
+            try:
+                return footnote_index[footnote]
+            except KeyError:
+                footnote_index[footnote] = i = len(self.footnotes)
+                self.footnotes.append(footnote)
+                return i
+
+        full_edges = []
+        partial_edges = []
+        for uid, other_uid, partial, footnote in rows:
+            edge = (node(uid), node(other_uid), footnote_id(footnote))
+            if partial:
+                partial_edges.append(edge)
+            else:
+                full_edges.append(edge)
+
+        n = len(self.uids)
+        self.full = CSRGraph(n, full_edges)
+        self.partial = CSRGraph(n, partial_edges)
+
+        union_find = UnionFind(n)
+        for a, b, _ in full_edges:
+            union_find.union(a, b)
+        self.component_ids = array('l', (union_find.find(i) for i in range(n)))
+
+        # Group the members of each component, also in CSR form.
+        members = sorted(range(n), key=lambda i: (self.component_ids[i], self.uids[i]))
+        self.component_members = array('l', members)
+        self.component_offsets = array('l', [0]) * n
+        for position, i in enumerate(members):
+            if position == 0 or self.component_ids[members[position - 1]] != self.component_ids[i]:
+                start = position
+            self.component_offsets[i] = start
+
+    def __contains__(self, uid):
+        return uid in self.index
+
+    def _uid_footnotes(self, pairs):
+        uids, footnotes = self.uids, self.footnotes
+        return [(uids[i], footnotes[f]) for i, f in pairs]
+
+    def fulls(self, uid):
+        """ Return the direct full parallels of uid """
+        if uid not in self.index:
+            return []
+        return self._uid_footnotes(self.full.edges(self.index[uid]))
+
+    def partials(self, uid):
+        """ Return the partial parallels of uid """
+        if uid not in self.index:
+            return []
+        return self._uid_footnotes(self.partial.edges(self.index[uid]))
+
+    def indirects(self, uid, k=None):
+        """ Return the indirect full parallels of uid
+
+        These are the suttas within k hops through full parallels, or the
+        entire cluster if k is None, which are not direct parallels.
+
+        """
+        if uid not in self.index:
+            return []
+        return self._uid_footnotes((i, f) for i, f, distance
+                                   in self.full.neighbourhood(self.index[uid], k)
+                                   if distance > 1)
+
+    def component(self, uid):
+        """ Return the uids in the same cluster of full parallels as uid,
+        including uid itself """
+        if uid not in self.index:
+            return [uid]
+        i = self.index[uid]
+        component_id = self.component_ids[i]
+        members = self.component_members
+        out = []
+        for position in range(self.component_offsets[i], len(members)):
+            member = members[position]
+            if self.component_ids[member] != component_id:
+                break
+            out.append(self.uids[member])
+        return out
+
+    def are_parallel(self, uid1, uid2):
+        """ Return True if uid1 and uid2 are in the same cluster """
+        if uid1 not in self.index or uid2 not in self.index:
+            return False
+        return (self.component_ids[self.index[uid1]] ==
+                self.component_ids[self.index[uid2]])
@@ -0,0 +1,155 @@
+"""Server-side cache of rendered pages, with HTTP validators.
+
+Most requests are for the same popular texts, divisions and parallels,
+which are rendered again each time even though nothing they depend on
+has changed. Views which can be cached give a key identifying what the
+page depends on (see ViewBase.render_cache_key), the generations of the
+IMM and TIM are added to it, and the rendered page is kept with a
+strong ETag (the md5 of the page) and the time it was rendered, which
+is sent as Last-Modified.
+
+A request whose If-None-Match or If-Modified-Since matches the cached
+page is answered with 304 Not Modified without rendering anything.
+
+The parts of a page which change on their own, such as whether the
+forum has discussions of a text and the New Relic timing scripts, are
+never cached: the cached page holds a placeholder for each of them (see
+placeholder), which is filled in each time the page is sent.
+
+Pages are dropped when they are older than render_cache_max_age seconds
+and the least recently used pages are dropped when their html comes to
+more than render_cache_max_chars characters in all.
+
+Example:
+    >>> key = render_cache.full_key(key)
+    >>> page = render_cache.get(key)
+    >>> if page is None:
+    ...     page = render_cache.put(key, view.render_page(cached=True))
+    >>> page.send(live_parts)
+"""
+
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+import cherrypy
+from cherrypy.lib import cptools, httputil
+
+import sc
+import sc.generation
+
+_placeholder_tmpl = '<!--sc-live:{}-->'
+
+
+def placeholder(name):
+    """ The placeholder of the live part name of a cached page """
+    return _placeholder_tmpl.format(name)
+
+
+class CachedPage:
+    """ A rendered page and its validators """
+
+    __slots__ = ('html', 'md5', 'last_modified', 'created')
+
+    def __init__(self, html):
+        self.html = html
+        self.md5 = hashlib.md5(html.encode('utf-8'))
+        self.created = time.time()
+        self.last_modified = httputil.HTTPDate(self.created)
+
+    def send(self, live=None, untagged=None):
+        """ Fill in the live parts of the page, set the validators of the
+        response, answering with 304 Not Modified if they match those of
+        the request, and return the html
+
+        live and untagged map the names of the placeholders of the page
+        to functions returning their html. The html of the live parts is
+        included in the ETag, that of the untagged parts, which don't
+        change what the page shows, such as the New Relic timing
+        scripts, isn't.
+
+        """
+        html = self.html
+        md5 = self.md5
+        parts = {}
+        if live:
+            md5 = md5.copy()
+            for name in sorted(live):
+                parts[name] = live[name]() or ''
+                md5.update(b'\0' + parts[name].encode('utf-8'))
+        if untagged:
+            for name, part in untagged.items():
+                parts[name] = part() or ''
+        for name, part_html in parts.items():
+            html = html.replace(placeholder(name), part_html, 1)
+        headers = cherrypy.response.headers
+        headers['ETag'] = '"{}"'.format(md5.hexdigest())
+        cptools.validate_etags()
+        if not live:
+            # The live parts can change without the page changing
+            headers['Last-Modified'] = self.last_modified
+            cptools.validate_since()
+        return html
+
+
+class RenderCache:
+    """ A least recently used cache of CachedPages, holding at most
+    max_chars characters of html """
+
+    def __init__(self, max_chars, max_age):
+        self.max_chars = max_chars
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.chars = 0
+        self._pages = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def full_key(key):
+        """ The key of a page, including the models it depends on """
+        return (key, sc.generation.current('imm'), sc.generation.current('tim'))
+
+    def get(self, key):
+        """ Return the CachedPage for key, a full_key, or None """
+        with self._lock:
+            page = self._pages.get(key)
+            if page is not None and time.time() - page.created > self.max_age:
+                self._remove(key)
+                page = None
+            if page is None:
+                self.misses += 1
+                return None
+            self._pages.move_to_end(key)
+            self.hits += 1
+            return page
+
+    def put(self, key, html):
+        """ Cache html for key, a full_key, return its CachedPage """
+        page = CachedPage(html)
+        if len(html) > self.max_chars:
+            return page
+        with self._lock:
+            if key in self._pages:
+                self._remove(key)
+            self._pages[key] = page
+            self.chars += len(html)
+            while self.chars > self.max_chars:
+                self._remove(next(iter(self._pages)))
+        return page
+
+    def _remove(self, key):
+        self.chars -= len(self._pages.pop(key).html)
+
+    def clear(self):
+        with self._lock:
+            self._pages.clear()
+            self.chars = 0
+
+    def __len__(self):
+        return len(self._pages)
+
+
+render_cache = RenderCache(max_chars=sc.config.app['render_cache_max_chars'],
+                           max_age=sc.config.app['render_cache_max_age'])
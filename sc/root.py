@@ -111,6 +111,12 @@ class Admin(object):
     def index(self, **kwargs):
         return show.admin_index()
 
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    def build_stats(self, **kwargs):
+        " Timings of the recent IMM and TIM builds "
+        return show.admin_build_stats()
+
     @cherrypy.expose
     def data_notify(self, **kwargs):
         return show.admin_data_notify(kwargs.get('payload'))
@@ -9,12 +9,17 @@ Example:
         ... >
 """
 
+import io
+import os
+import lz4
 import time
 import math
 import regex
+import pickle
 import hashlib
 import logging
 import threading
+from array import array
 from bisect import bisect
 from datetime import datetime
 from itertools import chain
@@ -22,11 +27,16 @@ from collections import OrderedDict, defaultdict, namedtuple
 
 import sc
 import sc.fonts
+import sc.generation
+from sc import build_stats
+import sc.util
 from sc import config, textfunctions, textdata
 from sc.classes import *
 from sc.uid_expansion import uid_to_acro, uid_to_name
 
-from sc.csv_loader import table_reader
+from sc.csv_loader import table_reader, preload_tables
+from sc.parallel_graph import ParallelGraph
+from sc.sutta_store import SuttaStore
 
 import sc.init
 
@@ -49,26 +59,253 @@ def numsortkey(input, index=0):
                    for a in regex.split(r'(\d+)', string)] )
 
 
+class _SnapshotPickler(pickle.Pickler):
+    """ Pickles the IMM without deep recursion.
+
+    The IMM is a dense graph of namedtuples which refer to each other
+    through lists (i.e. sutta.subdivision.suttas[0].parallels[0].sutta...),
+    pickling it naively recurses along these paths until the stack is
+    exhausted. Instead every list is replaced by a reference and its
+    contents are pickled afterwards, one list at a time, which keeps the
+    recursion depth down to the nesting depth of the namedtuples.
+
+    """
+    def __init__(self, file, root):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.root = root
+        self.lists = []
+        self.list_ids = {}
+
+    def persistent_id(self, obj):
+        if obj is self.root:
+            return 'root'
+        if type(obj) is list:
+            key = id(obj)
+            if key not in self.list_ids:
+                self.list_ids[key] = len(self.lists)
+                self.lists.append(obj)
+            return self.list_ids[key]
+        return None
+
+    def dump_graph(self, state):
+        self.dump(state)
+        i = 0
+        # Lists discovered while pickling earlier lists are appended
+        # to self.lists, so this loop continues until all are dumped.
+        while i < len(self.lists):
+            self.dump(tuple(self.lists[i]))
+            i += 1
+        self.dump(None)
+
+
+class _SnapshotUnpickler(pickle.Unpickler):
+    def __init__(self, file, root):
+        super().__init__(file)
+        self.root = root
+        self.lists = []
+
+    def persistent_load(self, pid):
+        if pid == 'root':
+            return self.root
+        while pid >= len(self.lists):
+            self.lists.append([])
+        return self.lists[pid]
+
+    def load_graph(self):
+        state = self.load()
+        i = 0
+        while True:
+            contents = self.load()
+            if contents is None:
+                break
+            self.persistent_load(i).extend(contents)
+            i += 1
+        return state
+
+
 class _Imm:
     _uidlangcache = {}
-    _cache = None
     _instance = None
     _ready = threading.Event()
+    
+    snapshot_name_tmpl = 'imm-snapshot_{hash}.pklz'
+    # Increment when the structure of the IMM classes changes, to
+    # invalidate existing snapshots.
+    snapshot_version = 6
+    # Attributes which are not stored in the snapshot.
+    _transient_attrs = {'tim', 'font_data', 'timestamp', 'build_time',
+                        'table_mtimes', 'generation', '_reading_order'}
+    
+    # The build stages in the order they are run, with the tables each
+    # stage reads and the stages whose results it depends on. When a
+    # table changes only the stages reading it, and the stages depending
+    # on those, need to be run again. 'tim' stands for the TIM, which
+    # changes whenever its signature does.
+    build_stages = OrderedDict([
+        ('build', ({'pitaka', 'sect', 'language', 'external_text',
+                    'collection', 'division', 'subdivision', 'vagga',
+                    'biblio', 'sutta'}, ())),
+        ('build_parallels', ({'correspondence'}, ('build',))),
+        ('build_grouped_suttas', ({'vinaya_rules', 'tim'}, ('build',))),
+        ('build_parallel_groups', ({'vinaya_pm', 'vinaya_kd'},
+                                   ('build_grouped_suttas',))),
+        ('build_text_refs', ({'tim'}, ('build', 'build_grouped_suttas'))),
+        ('load_epigraphs', ({'epigraphs'}, ('build', 'build_grouped_suttas',
+                                            'build_text_refs'))),
+        ('build_reading_order', ({'tim'}, ('build', 'build_grouped_suttas'))),
+    ])
+    
     def __init__(self, timestamp):
-        self._cache = {}
         self.tim = textdata.tim()
-        self.build()
-        self.build_parallels_data()
-        self.build_parallels()
-        self.build_grouped_suttas()
-        self.build_parallel_sutta_group('vinaya_pm')
-        self.build_parallel_sutta_group('vinaya_kd')
-        self.load_epigraphs()
+        self.table_mtimes = self.get_table_mtimes()
+        # Parse any changed tables concurrently before the stages read them
+        with build_stats.phase('load tables'):
+            preload_tables()
+        for stage in self.build_stages:
+            with build_stats.phase(stage):
+                getattr(self, stage)()
+        with build_stats.phase('verify_uid_uniqueness'):
+            self.verify_uid_uniqueness()
+        with build_stats.phase('font data'):
+            self.font_data = sc.fonts.get_fonts_data()
+        self.timestamp = timestamp
+        self.build_time = datetime.now()
+    
+    @staticmethod
+    def get_table_mtimes():
+        return {file.stem: file.stat().st_mtime_ns
+                for file in sc.table_dir.glob('**/*')
+                if file.is_file()}
+    
+    def get_changed_tables(self):
+        """ Return the names of tables which have been modified, added
+        or removed since this IMM was built """
+        old = self.table_mtimes
+        new = self.get_table_mtimes()
+        return {name for name in old.keys() | new.keys()
+                if old.get(name) != new.get(name)}
+    
+    @classmethod
+    def get_stages_to_run(cls, changed_tables):
+        """ Return the build stages affected by changes to tables
+
+        A change to a table which no stage claims affects every stage.
+
+        """
+        claimed = set(chain.from_iterable(tables for tables, _
+                                          in cls.build_stages.values()))
+        if not changed_tables <= claimed:
+            return list(cls.build_stages)
+        
+        stages = []
+        for stage, (tables, depends) in cls.build_stages.items():
+            if tables & changed_tables or any(d in stages for d in depends):
+                stages.append(stage)
+        return stages
+    
+    def update(self, stages, timestamp, tim=None):
+        """ Re-run some build stages in place
+        
+        This is meant for a clone of the published IMM, see build(). The
+        'build' stage can't be re-run because everything refers to the
+        objects it creates, use a new IMM instead.
+        
+        If tim is given it replaces the TIM the IMM was built with.
+
+        """
+        if 'build' in stages:
+            raise ValueError('The IMM structure cannot be updated in place')
+        table_mtimes = self.get_table_mtimes()
+        if tim is not None:
+            self.tim = tim
+        for stage in stages:
+            logger.info('Updating IMM: {}'.format(stage))
+            with build_stats.phase(stage):
+                getattr(self, stage)()
         self.verify_uid_uniqueness()
-        self.font_data = sc.fonts.get_fonts_data()
+        self.table_mtimes = table_mtimes
         self.timestamp = timestamp
         self.build_time = datetime.now()
     
+    @classmethod
+    def get_snapshot_name(cls, tim):
+        """ The snapshot name depends on the contents of the table folder,
+        the TIM and the snapshot version """
+        md5 = sc.util.get_folder_deep_md5(sc.table_dir)
+        md5.update(str(tim.signature).encode('ascii'))
+        md5.update(str(cls.snapshot_version).encode('ascii'))
+        return cls.snapshot_name_tmpl.format(hash=md5.hexdigest()[:10])
+    
+    def save_snapshot(self):
+        """ Save a snapshot of this IMM to the db folder
+
+        Snapshots which are no longer current are removed.
+
+        """
+        snapshot_file = sc.db_dir / self.get_snapshot_name(self.tim)
+        
+        # Write to a temporary file and rename, so other processes
+        # never see a partially written snapshot.
+        tmp_file = snapshot_file.with_suffix('.tmp{}'.format(os.getpid()))
+        with tmp_file.open('wb') as f:
+            f.write(lz4.compress(self._dumps()))
+        tmp_file.rename(snapshot_file)
+        
+        for file in sc.db_dir.glob(self.snapshot_name_tmpl.format(hash='*')):
+            if file != snapshot_file:
+                file.unlink()
+    
+    @classmethod
+    def load_snapshot(cls, timestamp):
+        """ Return an IMM loaded from a snapshot, or None if there is no
+        snapshot matching the current tables and TIM """
+        tim = textdata.tim()
+        snapshot_file = sc.db_dir / cls.get_snapshot_name(tim)
+        if not snapshot_file.exists():
+            return None
+        
+        with snapshot_file.open('rb') as f:
+            imm = cls._loads(lz4.uncompress(f.read()))
+        imm.tim = tim
+        # This refers to the texts of the TIM, so isn't in the snapshot
+        imm.build_reading_order()
+        imm.table_mtimes = cls.get_table_mtimes()
+        imm.font_data = sc.fonts.get_fonts_data()
+        imm.timestamp = timestamp
+        imm.build_time = datetime.now()
+        return imm
+    
+    def _dumps(self):
+        """ Pickle the IMM, without the transient attributes """
+        state = {key: value for key, value in self.__dict__.items()
+                 if key not in self._transient_attrs}
+        buffer = io.BytesIO()
+        _SnapshotPickler(buffer, root=self).dump_graph(state)
+        return buffer.getvalue()
+    
+    @classmethod
+    def _loads(cls, data):
+        imm = cls.__new__(cls)
+        state = _SnapshotUnpickler(io.BytesIO(data), root=imm).load_graph()
+        imm.__dict__.update(state)
+        return imm
+    
+    def clone(self):
+        """ Return a deep copy of this IMM
+        
+        The copy can be updated while requests continue to be served by
+        this one. Caches held by the IMM are not copied.
+        
+        """
+        imm = self._loads(self._dumps())
+        imm.tim = self.tim
+        imm._reading_order = self._reading_order
+        imm.table_mtimes = self.table_mtimes
+        imm.font_data = self.font_data
+        imm.timestamp = self.timestamp
+        imm.build_time = self.build_time
+        return imm
+    
     def __call__(self, uid):
         if uid in self.collections:
             return self.collections[uid]
@@ -192,19 +429,17 @@ class _Imm:
         for i, row in enumerate(table_reader('division')):
             collection = self.collections[row.collection_uid]
             
-            text_ref = self.get_text_ref(uid=row.uid, lang_uid=collection.lang.uid);
-            
             division = Division(
                 uid=row.uid,
                 name=row.name,
                 alt_name=row.alt_name,
-                text_ref=text_ref,
                 acronym=row.acronym or uid_to_acro(row.uid),
                 subdiv_ind=row.subdiv_ind,
                 menu_seq=i,
                 menu_gwn_ind=bool(row.menu_gwn_ind),
                 collection=collection,
                 subdivisions=[], # Populate later
+                imm=self,
             )
             self.divisions[row.uid] = division
             # Populate collections
@@ -248,6 +483,17 @@ class _Imm:
                 division.subdivisions.append(subdivision)
                 self.subdivisions[division.uid] = subdivision
         
+        # Index divisions and subdivisions by uid, for finding the
+        # container of an uid by its longest matching prefix.
+        self.division_index = sc.util.PrefixIndex(self.divisions)
+        self.subdivision_index = sc.util.PrefixIndex(self.subdivisions)
+        self.root_lang_index = sc.util.PrefixIndex()
+        for uid, subdivision in self.subdivisions.items():
+            self.root_lang_index[uid] = subdivision.division.collection.lang.uid
+        # Divisions take precedence over subdivisions with the same uid
+        for uid, division in self.divisions.items():
+            self.root_lang_index[uid] = division.collection.lang.uid
+        
         # Build vaggas
         self.vaggas = OrderedDict()
         for row in table_reader('vagga'):
@@ -278,6 +524,7 @@ class _Imm:
                 text=row.text)
         
         # Build suttas (indexed by uid)
+        self.sutta_store = store = SuttaStore(self)
         suttas = []
         for row in table_reader('sutta'):
             uid = row.uid
@@ -307,7 +554,7 @@ class _Imm:
             if row.biblio_uid:
                 biblio_entry = biblios.get(row.biblio_uid)
             
-            sutta = Sutta(
+            sutta = store.add(
                 uid=row.uid,
                 acronym=acro[0],
                 alt_acronym=acro[1] if len(acro) > 1 else None,
@@ -321,10 +568,9 @@ class _Imm:
                 volpage=volpage[0],
                 alt_volpage_info=volpage[1] if len(volpage) > 1 else None,
                 biblio_entry=biblio_entry,
-                parallels=[],
-                imm=self,
             )
             suttas.append( (uid, sutta) )
+        store.finish()
         
         suttas = sorted(suttas, key=numsortkey)
         
@@ -336,66 +582,41 @@ class _Imm:
             sutta.vagga.suttas.append(sutta)
         
     def build_parallels_data(self):
-        
-        fulls = defaultdict(set)
-        partials = defaultdict(set)
-        indirects = defaultdict(set)
-        # initially we operate purely on ids using id, footnote tuples
-
-        #Populate partial and full parallels
-        for row in table_reader('correspondence'):
-            if row.partial:
-                partials[row.sutta_uid].add( (row.other_sutta_uid, row.footnote) )
-                partials[row.other_sutta_uid].add( (row.sutta_uid, row.footnote) )
-            else:
-                fulls[row.sutta_uid].add( (row.other_sutta_uid, row.footnote) )
-                fulls[row.other_sutta_uid].add( (row.sutta_uid, row.footnote) )
-
-        # Populate indirect full parallels
-        for id, parallels in fulls.items():
-            for pid, footnote in parallels:
-                if pid in fulls:
-                    indirects[id].update(fulls[pid])
-
-        for id, parallels in indirects.items():
-            # Remove self and fulls
-            indirects[id] -= set(a for a in indirects[id] if a[0] == id)
-
-        return {
-            'fulls': fulls.items(),
-            'indirects': indirects.items(),
-            'partials': partials.items(),
-            }
+        """ Build the graph of parallels from the correspondence table """
+        return ParallelGraph((row.sutta_uid, row.other_sutta_uid,
+                              bool(row.partial), row.footnote)
+                             for row in table_reader('correspondence'))
     
     def build_parallels(self):
-        parallels_data = self.build_parallels_data()
-        fulls = parallels_data['fulls']
-        indirects = parallels_data['indirects']
-        partials = parallels_data['partials']
-        
-        for sutta_uid, parallels in fulls:
-            sutta = self.suttas[sutta_uid]
-            for p_uid, note in parallels:
-                p_sutta = self.suttas[p_uid]
-                sutta.parallels.append(Parallel(p_sutta, False, False, note))
-                
-        for sutta_uid, parallels in indirects:
-            sutta = self.suttas[sutta_uid]
-            for p_uid, note in parallels:
-                p_sutta = self.suttas[p_uid]
-                sutta.parallels.append(Parallel(p_sutta, False, True, note))
-
-        for sutta_uid, parallels in partials:
-            sutta = self.suttas[sutta_uid]
-            for p_uid, note in parallels:
-                p_sutta = self.suttas[p_uid]
-                sutta.parallels.append(Parallel(p_sutta, True, False, note))
-
+        graph = self.build_parallels_data()
+        
+        for sutta_uid in graph.uids:
+            if sutta_uid not in self.suttas:
+                raise KeyError(sutta_uid)
+        
+        new_parallels = {}
         for sutta in self.suttas.values():
-            sutta.parallels.sort(key=Parallel.sort_key)
+            # GroupedSutta have no parallels of this kind
+            if not isinstance(sutta, Sutta):
+                continue
+            uid = sutta.uid
+            parallels = []
+            if uid in graph:
+                for p_uid, note in graph.fulls(uid):
+                    parallels.append(Parallel(self.suttas[p_uid], False, False, note))
+                for p_uid, note in graph.indirects(uid):
+                    parallels.append(Parallel(self.suttas[p_uid], False, True, note))
+                for p_uid, note in graph.partials(uid):
+                    parallels.append(Parallel(self.suttas[p_uid], True, False, note))
+            parallels.sort(key=Parallel.sort_key)
+            new_parallels[sutta._index] = parallels
+        
+        # Replaced in one step, when rebuilding
+        self.sutta_store.set_parallels(new_parallels)
+        self.parallel_graph = graph
     
     def build_grouped_suttas(self):
-        vinaya_rules = {}
+        rules_by_subdivision = OrderedDict()
         for i, row in enumerate(table_reader('vinaya_rules')):
             uid = row.uid
             
@@ -405,14 +626,39 @@ class _Imm:
                 imm=self,
             )
             
-            subdivision = rule.subdivision
-            subdivision.suttas.append(rule)
-            
-            subdivision.vaggas[0].suttas.append(rule)
-            
-            self.suttas[uid] = rule
+            subdivision_uid = rule.subdivision.uid
+            if subdivision_uid not in rules_by_subdivision:
+                rules_by_subdivision[subdivision_uid] = []
+            rules_by_subdivision[subdivision_uid].append(rule)
+        
+        # Grouped suttas from a previous build are replaced.
+        suttas = OrderedDict((uid, sutta) for uid, sutta in self.suttas.items()
+                             if not isinstance(sutta, GroupedSutta))
+        for rules in rules_by_subdivision.values():
+            for rule in rules:
+                suttas[rule.uid] = rule
+        
+        for subdivision in self.subdivisions.values():
+            rules = rules_by_subdivision.get(subdivision.uid, [])
+            for sutta_list in (subdivision.suttas, subdivision.vaggas[0].suttas):
+                if rules or any(isinstance(sutta, GroupedSutta) for sutta in sutta_list):
+                    sutta_list[:] = [sutta for sutta in sutta_list
+                                     if not isinstance(sutta, GroupedSutta)] + rules
+        
+        self.suttas = suttas
+    
+    def build_parallel_groups(self):
+        groups = {}
+        self.build_parallel_sutta_group('vinaya_pm', groups)
+        self.build_parallel_sutta_group('vinaya_kd', groups)
+        for sutta in self.suttas.values():
+            if isinstance(sutta, GroupedSutta):
+                if sutta.uid in groups:
+                    sutta.parallel_group = groups[sutta.uid]
+                elif hasattr(sutta, 'parallel_group'):
+                    del sutta.parallel_group
 
-    def build_parallel_sutta_group(self, table_name):
+    def build_parallel_sutta_group(self, table_name, groups):
         """ Generate a cleaned up form of the table data
         
         A parallel group is a different way of defining parallels, in essence
@@ -429,6 +675,8 @@ class _Imm:
         Some of this code is pretty messy but that can't really be helped
         because it's really the underlying logic that is pretty messy.
         
+        The group for each rule is added to groups, keyed by rule uid.
+        
         """
         
         def normalize_uid(uid):
@@ -476,12 +724,12 @@ class _Imm:
             group = ParallelSuttaGroup(row[0], row[1:])
             for rule in row[1:]:
                 if isinstance(rule, GroupedSutta):
-                    if hasattr(rule, 'parallel_group'):
-                        if not isinstance(rule.parallel_group, MultiParallelSuttaGroup):
-                            rule.parallel_group = MultiParallelSuttaGroup(rule.parallel_group)
-                        rule.parallel_group.add_group(group)
+                    if rule.uid in groups:
+                        if not isinstance(groups[rule.uid], MultiParallelSuttaGroup):
+                            groups[rule.uid] = MultiParallelSuttaGroup(groups[rule.uid])
+                        groups[rule.uid].add_group(group)
                     else:
-                        rule.parallel_group = group
+                        groups[rule.uid] = group
 
     def build_search_data(self):
         """ Build useful search data.
@@ -552,6 +800,36 @@ class _Imm:
             searchdata['md5'] = hashlib.md5(str(searchdata).encode()).hexdigest()[0:5]
             yield searchdata
     
+    def build_text_refs(self):
+        """ Resolve the text_ref and translations of every sutta, and
+        the text_ref of every division
+
+        These only change when the tables or the TIM change, so they are
+        looked up once here instead of on every access.
+
+        """
+        text_refs = {}
+        for uid, sutta in self.suttas.items():
+            lang_uid = sutta.lang.uid
+            text_refs[uid] = (self.get_text_ref(uid, lang_uid),
+                              self.get_translations(uid, lang_uid))
+        self._sutta_text_refs = text_refs
+        self._division_text_refs = {
+            uid: self.get_text_ref(uid, division.collection.lang.uid)
+            for uid, division in self.divisions.items()}
+    
+    def get_sutta_text_refs(self, uid, lang_uid):
+        """ Return the (text_ref, translations) of a sutta """
+        try:
+            return self._sutta_text_refs[uid]
+        except KeyError:
+            return (self.get_text_ref(uid, lang_uid),
+                    self.get_translations(uid, lang_uid))
+    
+    def get_division_text_ref(self, uid):
+        """ Return the text_ref of a division """
+        return self._division_text_refs.get(uid)
+    
     def get_text_ref(self, uid, lang_uid):
         textinfo = self.tim.get(uid=uid, lang_uid=lang_uid)
         if textinfo:
@@ -571,13 +849,9 @@ class _Imm:
         if uid in self.suttas:
             return self.suttas[uid].lang.uid
         else:
-            div_uid = uid
-            while div_uid:
-                if div_uid in self.divisions:
-                    return self.divisions[div_uid].collection.lang.uid
-                if div_uid in self.subdivisions:
-                    return self.subdivisions[div_uid].division.collection.lang.uid
-                div_uid = div_uid[:-1]
+            lang_uid = self.root_lang_index.get(uid)
+            if lang_uid:
+                return lang_uid
         if uid[0] == 't':
             return 'zh'
         if uid[:3] == 'skt':
@@ -656,18 +930,16 @@ class _Imm:
         return self.tim.get(uid, language_code)
         
     def guess_subdiv_uid(self, uid):
-        # Just keep slicing it until we find something that
-        # matches. It's good enough.
-        while len(uid) > 0:
-            if uid in self.subdivisions:
-                return uid
-            uid = uid[:-1]
+        # The longest subdivision uid which is a prefix of uid.
+        # It's good enough.
+        found = self.subdivision_index.longest_prefix(uid)
+        if found:
+            return found[0]
 
     def guess_div_uid(self, uid):
-        while len(uid) > 0:
-            if uid in self.divisions:
-                return uid
-            uid = uid[:-1]
+        found = self.division_index.longest_prefix(uid)
+        if found:
+            return found[0]
     
     @staticmethod
     def get_text_author(filepath):
@@ -696,7 +968,7 @@ class _Imm:
     def load_epigraphs(self):
         import lxml.etree
         file = sc.data_dir / 'table' / 'epigraphs.xml'
-        self.epigraphs = []
+        epigraphs = []
         
         doc = lxml.etree.parse(str(file))
         valid = 0
@@ -722,60 +994,105 @@ class _Imm:
                     logger.warning('{}:{} - Sutta "{}" has no english translation. Using details page instead.'.format(file.name, element.sourceline, uid))
                     href = '/{}'.format(uid)
                 else:
-                    self.epigraphs.append({'sutta': self.suttas[uid], 'content': content, 'href': href})
+                    epigraphs.append({'sutta': self.suttas[uid], 'content': content, 'href': href})
                     valid += 1
         logger.info('Loaded {} epigraphs, {} are valid, {} are invalid'.format(count + 1, valid, count - valid))
+        self.epigraphs = epigraphs
 
     def get_random_epigraph(self):
         import random
         return random.choice(self.epigraphs)
 
-    def get_next_prev(self, uid, lang_uid):
-        if not hasattr(self, 'sutta_order_cache'):
-            self.sutta_order_cache = soc = defaultdict(dict)
-            for division in self.divisions.values():
-                suttas = list(chain(*(sd.suttas for sd in division.subdivisions)))
-                
-                prev = None
-                for sutta in suttas:
-                    if prev:
-                        soc[sutta.uid]['prev'] = prev.uid
-                        soc[prev.uid]['next'] = sutta.uid
-                    prev = sutta
-        soc = self.sutta_order_cache
+    # Markers in the reading order arrays, other values are positions.
+    _NO_TEXT = -1    # No next/prev text is known (None)
+    _END = -2        # Start or end of a division (False)
+    
+    def build_reading_order(self):
+        """ Find the next and previous text of every text in the TIM
+
+        The order of the suttas in their division takes precedence, the
+        prev_uid and next_uid of the text are used for texts which are
+        not in a division of several suttas. Each text is given a
+        position, and the positions of the next and previous texts are
+        stored in arrays.
+
+        """
+        # The previous and next sutta uid, within each division
+        sutta_order = defaultdict(dict)
+        for division in self.divisions.values():
+            suttas = list(chain(*(sd.suttas for sd in division.subdivisions)))
+            prev = None
+            for sutta in suttas:
+                if prev:
+                    sutta_order[sutta.uid]['prev'] = prev.uid
+                    sutta_order[prev.uid]['next'] = sutta.uid
+                prev = sutta
+        
         tim = self.tim
+        # The (lang_uid, uid) of each text, the text infos themselves
+        # are only needed while building.
+        texts = []
+        textinfos = []
+        positions = {}
+        for lang_uid in tim.languages():
+            lang_positions = positions[lang_uid] = {}
+            for uid, textinfo in tim.get(lang_uid=lang_uid).items():
+                lang_positions[uid] = len(texts)
+                texts.append((lang_uid, uid))
+                textinfos.append(textinfo)
         
-        nextdata = None
-        prevdata = None
+        next_positions = array('l', [self._NO_TEXT]) * len(texts)
+        prev_positions = array('l', [self._NO_TEXT]) * len(texts)
         
-        textdata = tim.get(uid=uid, lang_uid=lang_uid)
+        def find(uid, lang_positions, textdata):
+            """ The position of the text uid, unless it is in the same
+            file as textdata """
+            position = lang_positions.get(uid)
+            if position is None or textinfos[position].path == textdata.path:
+                return self._NO_TEXT
+            return position
         
-        nextprev = soc.get(uid)
-        if nextprev:
-            # if the sutta data says that a sutta is the start/end of a 
-            # division, we will trust it, hence we use 'False', for there
-            # is no next/prev sutta, rather than 'None' for unknown.
-            if 'next' in nextprev:
-                nextdata = tim.get(uid=nextprev.get('next'), lang_uid=lang_uid)
-                if nextdata and textdata and nextdata.path == textdata.path:
-                    nextdata = None
-            else:
-                nextdata = False
-            if 'prev' in nextprev:
-                prevdata = tim.get(uid=nextprev.get('prev'), lang_uid=lang_uid)
-                if prevdata and textdata and prevdata.path == textdata.path:
-                    prevdata = None
-            else:
-                prevdata = False
+        for lang_uid, lang_positions in positions.items():
+            for uid, position in lang_positions.items():
+                textdata = textinfos[position]
+                nextpos = prevpos = self._NO_TEXT
+                nextprev = sutta_order.get(uid)
+                if nextprev:
+                    # if the sutta data says that a sutta is the start/end of a 
+                    # division, we will trust it, hence we use 'False', for there
+                    # is no next/prev sutta, rather than 'None' for unknown.
+                    if 'next' in nextprev:
+                        nextpos = find(nextprev['next'], lang_positions, textdata)
+                    else:
+                        nextpos = self._END
+                    if 'prev' in nextprev:
+                        prevpos = find(nextprev['prev'], lang_positions, textdata)
+                    else:
+                        prevpos = self._END
+                if nextpos == self._NO_TEXT and textdata.next_uid:
+                    nextpos = lang_positions.get(textdata.next_uid, self._NO_TEXT)
+                if prevpos == self._NO_TEXT and textdata.prev_uid:
+                    prevpos = lang_positions.get(textdata.prev_uid, self._NO_TEXT)
+                next_positions[position] = nextpos
+                prev_positions[position] = prevpos
+        
+        self._reading_order = (positions, texts, next_positions, prev_positions)
     
+    def get_next_prev(self, uid, lang_uid):
+        positions, texts, next_positions, prev_positions = self._reading_order
+        try:
+            position = positions[lang_uid][uid]
+        except KeyError:
+            return {'next': None, 'prev': None}
+        
+        def text(position):
+            if position >= 0:
+                text_lang_uid, text_uid = texts[position]
+                return self.tim.get(text_uid, text_lang_uid)
+            return None if position == self._NO_TEXT else False
         
-        if textdata:
-            if nextdata is None and textdata.next_uid:
-                nextdata = tim.get(uid=textdata.next_uid, lang_uid=lang_uid)
-            if prevdata is None and textdata.prev_uid:
-                prevdata = tim.get(uid=textdata.prev_uid, lang_uid=lang_uid)
-        return {'next': nextdata,
-                'prev': prevdata}
+        return {'next': text(next_positions[position]),
+                'prev': text(prev_positions[position])}
         
 def imm(wait=True):
     """ Get an instance of the DBR.
@@ -799,15 +1116,83 @@ def imm(wait=True):
                 raise SystemExit("IMM Build Failed, unable to proceed")
     return _Imm._instance
 
+def _publish(instance):
+    """ Make instance the IMM returned by imm()
+
+    The instance is fully built before it is published, requests which
+    already hold the previous instance finish using it. Caches depending
+    on the IMM see the new generation and discard their contents.
+
+    """
+    instance.generation = sc.generation.next_generation()
+    _Imm._instance = instance
+    _Imm._ready.set()
+
+def generation():
+    """ Return the generation of the current IMM """
+    return imm().generation
+
+sc.generation.register_source('imm', generation)
+
 def build():
+    with build_stats.record('imm') as stats:
+        _build()
+        if _Imm._instance:
+            stats.generation = _Imm._instance.generation
+
+def _build():
     timestamp = max(int(file.stat().st_mtime) for file in sc.table_dir.glob('**/*'))
-    if not _Imm._instance or _Imm._instance.timestamp != timestamp:
-        logger.info('Building IMM')
+    tim = textdata.tim()
+    instance = _Imm._instance
+    if (instance and (instance.timestamp != timestamp
+            or instance.tim.signature != tim.signature)):
+        changed_tables = instance.get_changed_tables()
+        if instance.tim.signature != tim.signature:
+            changed_tables.add('tim')
+        stages = _Imm.get_stages_to_run(changed_tables)
+        if 'build' not in stages:
+            logger.info('Updating IMM for changes to: {}'.format(', '.join(sorted(changed_tables))))
+            start = time.time()
+            try:
+                # The update is applied to a copy, the current instance
+                # continues to serve requests until the copy is ready.
+                with build_stats.phase('clone'):
+                    new_instance = instance.clone()
+                new_instance.update(stages, timestamp, tim)
+            except Exception as e:
+                logger.exception('IMM update failed, rebuilding')
+            else:
+                logger.info('imm update took {} seconds'.format(time.time() - start))
+                _publish(new_instance)
+                try:
+                    with build_stats.phase('save snapshot'):
+                        new_instance.save_snapshot()
+                except Exception as e:
+                    logger.exception('Failed to save IMM snapshot')
+                return
+    if (not instance or instance.timestamp != timestamp
+            or instance.tim.signature != tim.signature):
         try:
             start = time.time()
-            _Imm._instance = _Imm(timestamp)
-            logger.info('imm build took {} seconds'.format(time.time() - start))
-            _Imm._ready.set()
+            try:
+                with build_stats.phase('load snapshot'):
+                    new_instance = _Imm.load_snapshot(timestamp)
+            except Exception as e:
+                logger.exception('Failed to load IMM snapshot')
+                new_instance = None
+            if new_instance:
+                logger.info('imm snapshot load took {} seconds'.format(time.time() - start))
+                _publish(new_instance)
+            else:
+                logger.info('Building IMM')
+                new_instance = _Imm(timestamp)
+                logger.info('imm build took {} seconds'.format(time.time() - start))
+                _publish(new_instance)
+                try:
+                    with build_stats.phase('save snapshot'):
+                        new_instance.save_snapshot()
+                except Exception as e:
+                    logger.exception('Failed to save IMM snapshot')
         except Exception as e:
             logger.error("Critical Error: IMM buid failed.", e)
             _Imm._ready.set()
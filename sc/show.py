@@ -3,6 +3,7 @@ import json
 import logging
 
 from sc import classes, data_repo, dictsearch, scimm, suttasearch, textsearch
+import sc.build_stats
 import sc.data
 from sc.scm import data_scm
 from sc.util import filelock
@@ -260,6 +261,9 @@ def define(term):
 def admin_index():
     return AdminIndexView().render()
 
+def admin_build_stats():
+    return [build.to_json() for build in sc.build_stats.recent()]
+
 def admin_data_notify(json_payload):
     if json_payload:
         logger.info('Data update request')
@@ -0,0 +1,183 @@
+"""Columnar storage for the suttas of the IMM.
+
+There are tens of thousands of suttas, and every web worker holds its
+own IMM, so rather than each sutta being a tuple of references with its
+own list of parallels, the attributes of all suttas are stored in
+columns: strings are interned, references to languages, subdivisions
+and vaggas are integer indexes into lists of those objects, and
+parallels are stored in arrays.
+
+sc.classes.Sutta is a lightweight view of one row of the store and
+provides the same attributes as before.
+
+Example:
+    >>> store = imm.sutta_store
+    >>> store.memory_report()
+    {'suttas': ..., 'parallels': ..., 'columns': ..., ...}
+"""
+
+import sys
+from array import array
+
+from sc.classes import Parallel, Sutta
+
+
+class SuttaStore:
+    """ The attributes of suttas, stored by column """
+
+    # Columns of interned strings (or None)
+    string_columns = ('uid', 'acronym', 'alt_acronym', 'name',
+                      'number_in_vagga', 'volpage', 'alt_volpage_info')
+    # Columns of integers
+    int_columns = ('vagga_number', 'number')
+    # Columns referring to other IMM objects, and the list of those
+    # objects they index into.
+    ref_columns = {'lang': 'languages',
+                   'subdivision': 'subdivisions',
+                   'vagga': 'vaggas'}
+
+    def __init__(self, imm):
+        self.imm = imm
+        for column in self.string_columns:
+            setattr(self, column, [])
+        for column in self.int_columns:
+            setattr(self, column, array('l'))
+        for column, target in self.ref_columns.items():
+            setattr(self, column, array('l'))
+            setattr(self, target, [])
+        # Most suttas don't have a biblio entry
+        self.biblio_entries = {}
+        # The view of each sutta
+        self.suttas = []
+        self._ref_index = {target: {} for target in self.ref_columns.values()}
+        self.set_parallels({})
+
+    def __len__(self):
+        return len(self.uid)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # The lists of parallels are made again when they are read
+        state['_parallels'] = self._parallels[:-1] + ({},)
+        return state
+
+    def _intern(self, value):
+        if value is None:
+            return None
+        return sys.intern(value)
+
+    def _ref(self, target, obj):
+        index = self._ref_index[target]
+        key = id(obj)
+        try:
+            return index[key]
+        except KeyError:
+            objects = getattr(self, target)
+            index[key] = i = len(objects)
+            objects.append(obj)
+            return i
+
+    def add(self, **fields):
+        """ Add a sutta to the store and return a view of it """
+        i = len(self)
+        for column in self.string_columns:
+            getattr(self, column).append(self._intern(fields[column]))
+        for column in self.int_columns:
+            getattr(self, column).append(fields[column])
+        for column, target in self.ref_columns.items():
+            getattr(self, column).append(self._ref(target, fields[column]))
+        if fields.get('biblio_entry'):
+            self.biblio_entries[i] = fields['biblio_entry']
+        sutta = Sutta(self, i)
+        self.suttas.append(sutta)
+        return sutta
+
+    def finish(self):
+        """ Discard the data only needed while adding suttas """
+        self._ref_index = None
+
+    def set_parallels(self, parallels):
+        """ Replace all parallels
+
+        parallels maps the index of a sutta to its list of Parallel, in
+        order. They are stored in compressed sparse row form, the
+        parallels of sutta i are in positions offsets[i]:offsets[i + 1]
+        of the arrays. The arrays are swapped in at once, so readers see
+        either the old or the new parallels. The lists made from them
+        are kept with them, in a dict by sutta index, as templates read
+        the parallels of a sutta many times.
+
+        """
+        offsets = array('l', [0])
+        targets = array('l')
+        flags = array('b')
+        footnote_ids = array('l')
+        footnotes = []
+        footnote_index = {}
+        for i in range(len(self)):
+            for parallel in parallels.get(i, ()):
+                targets.append(parallel.sutta._index)
+                flags.append(parallel.partial | parallel.indirect << 1)
+                footnote = parallel.footnote
+                try:
+                    footnote_ids.append(footnote_index[footnote])
+                except KeyError:
+                    footnote_index[footnote] = len(footnotes)
+                    footnote_ids.append(len(footnotes))
+                    footnotes.append(self._intern(footnote))
+            offsets.append(len(targets))
+        self._parallels = (offsets, targets, flags, footnote_ids, footnotes, {})
+
+    def parallels_count(self, i):
+        offsets = self._parallels[0]
+        if i + 1 >= len(offsets):
+            return 0
+        return offsets[i + 1] - offsets[i]
+
+    def get_parallels(self, i):
+        """ Return the list of Parallel of sutta i """
+        offsets, targets, flags, footnote_ids, footnotes, lists = self._parallels
+        try:
+            return lists[i]
+        except KeyError:
+            pass
+        if i + 1 >= len(offsets):
+            return []
+        suttas = self.suttas
+        parallels = [Parallel(sutta=suttas[targets[j]],
+                              partial=bool(flags[j] & 1),
+                              indirect=bool(flags[j] & 2),
+                              footnote=footnotes[footnote_ids[j]])
+                     for j in range(offsets[i], offsets[i + 1])]
+        lists[i] = parallels
+        return parallels
+
+    def memory_report(self):
+        """ Return the approximate memory used by the store in bytes
+
+        Strings are included, even though some are shared with the rest
+        of the IMM. The views and the objects referred to by the store
+        are not included.
+
+        """
+        def size(column):
+            total = sys.getsizeof(column)
+            if isinstance(column, list):
+                total += sum(sys.getsizeof(value) for value in column
+                             if value is not None)
+            return total
+
+        columns = sum(size(getattr(self, column)) for column
+                      in self.string_columns + self.int_columns
+                      + tuple(self.ref_columns))
+        offsets, targets, flags, footnote_ids, footnotes, lists = self._parallels
+        parallels = (sum(map(sys.getsizeof,
+                             (offsets, targets, flags, footnote_ids)))
+                     + size(footnotes))
+        return {
+            'suttas': len(self),
+            'parallels': len(targets),
+            'columns': columns,
+            'parallel_arrays': parallels,
+            'total': columns + parallels,
+        }
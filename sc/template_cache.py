@@ -0,0 +1,115 @@
+"""Caches of the compiled Jinja2 templates.
+
+Jinja2 compiles a template to Python code the first time it's loaded,
+which each server process does again for every template after a
+restart. Two caches avoid this:
+
+The bytecode cache keeps the compiled code of each template in
+db/jinja2/bytecode, with the checksum of the source it was compiled
+from, so a process only compiles a template if it changed since any
+process last compiled it.
+
+The bundle is optional, and is made by the assets.compile_templates
+task (precompile): every template in the templates folder is compiled
+to a Python module in db/jinja2/bundle. These are imported like any
+module, so Python keeps their bytecode and loading one doesn't even
+read the template. A module is only used while it is newer than its
+template, and a template which is modified after being loaded from the
+bundle is reloaded from its source (when auto_reload is on).
+
+Example:
+    >>> env = jinja2.Environment(loader=get_loader(),
+    ...                          bytecode_cache=get_bytecode_cache())
+    >>> precompile(env)
+"""
+
+import os
+import shutil
+import compileall
+import logging
+
+import jinja2
+from jinja2.loaders import split_template_path
+
+import sc
+
+logger = logging.getLogger(__name__)
+
+bytecode_dir = sc.db_dir / 'jinja2' / 'bytecode'
+bundle_dir = sc.db_dir / 'jinja2' / 'bundle'
+
+
+def get_bytecode_cache():
+    """ Return the bytecode cache of the db folder """
+    bytecode_dir.mkdir(parents=True, exist_ok=True)
+    return jinja2.FileSystemBytecodeCache(str(bytecode_dir))
+
+
+class BundleLoader(jinja2.BaseLoader):
+    """ Loads templates from the bundle while it is up to date, else
+    from the templates folder """
+
+    def __init__(self, templates_dir, bundle_dir):
+        self.templates_dir = templates_dir
+        self.bundle_dir = bundle_dir
+        self.fs_loader = jinja2.FileSystemLoader(str(templates_dir))
+        self.module_loader = jinja2.ModuleLoader(str(bundle_dir))
+
+    def get_source(self, environment, template):
+        return self.fs_loader.get_source(environment, template)
+
+    def list_templates(self):
+        return self.fs_loader.list_templates()
+
+    def load(self, environment, name, globals=None):
+        source_path = self.templates_dir.joinpath(*split_template_path(name))
+        module_path = self.bundle_dir / jinja2.ModuleLoader.get_module_filename(name)
+        try:
+            mtime = source_path.stat().st_mtime
+            fresh = module_path.stat().st_mtime >= mtime
+        except OSError:
+            fresh = False
+        if not fresh:
+            return self.fs_loader.load(environment, name, globals)
+        template = self.module_loader.load(environment, name, globals)
+        # Templates from modules are otherwise always up to date.
+        def uptodate():
+            try:
+                return source_path.stat().st_mtime == mtime
+            except OSError:
+                return False
+        template._uptodate = uptodate
+        return template
+
+
+def get_loader():
+    """ Return the loader of the templates folder """
+    return BundleLoader(sc.templates_dir, bundle_dir)
+
+
+def precompile(env):
+    """ Compile every template of env to the bundle, return the number
+    of templates compiled """
+    tmp_dir = bundle_dir.with_name(bundle_dir.name + '.tmp')
+    if tmp_dir.exists():
+        shutil.rmtree(str(tmp_dir))
+    tmp_dir.mkdir(parents=True)
+    count = 0
+    def log_function(message):
+        nonlocal count
+        if message.startswith('Compiled '):
+            count += 1
+        elif message.startswith('Could not compile '):
+            logger.warning(message)
+    env.compile_templates(str(tmp_dir), zip=None, log_function=log_function)
+    compileall.compile_dir(str(tmp_dir), quiet=1)
+    # Swap the bundle in whole, so no process sees modules of both the
+    # new bundle and the old. Templates loaded in between come from the
+    # templates folder.
+    old_dir = bundle_dir.with_name(bundle_dir.name + '.old')
+    if bundle_dir.exists():
+        os.replace(str(bundle_dir), str(old_dir))
+    os.replace(str(tmp_dir), str(bundle_dir))
+    if old_dir.exists():
+        shutil.rmtree(str(old_dir))
+    return count
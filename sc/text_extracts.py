@@ -0,0 +1,265 @@
+"""Pre-extracted texts, snippets and titles.
+
+To show a text, TextView needs the contents of the body of its file,
+found with a regex over the whole file, and a snippet of the start of
+the text for the meta description, which means parsing it with lxml.
+Neither changes until the file does, so they are extracted when the
+TIM is built and kept, with the name of the text, in a SQLite database
+in the db folder, keyed by the path of the text. The body is kept as it
+appears on the page, with the transforms of sc.page_transforms applied
+(a Fragment), which TextView splices into the rendered page and derives
+the text of an embedded page from.
+
+Each row records the md5 of the file it was extracted from (taken from
+the manifest of the language TIM, see TextInfoModel.build), so only
+texts whose content changed are extracted again. It also records the
+modification time and size of the file, a request checks them against
+the file and falls back to reading the file if they differ, so a file
+which changed since the TIM was built is never shown out of date.
+
+Example:
+    >>> extract = get_store().get(sc.text_dir / 'en' / 'dn' / 'dn1.html')
+    >>> extract.title, extract.snippet[:20]
+    ('1. Brahmajāla', 'Thus have I heard...')
+"""
+
+import os
+import sqlite3
+import logging
+import threading
+import multiprocessing
+from collections import namedtuple
+
+import regex
+
+import sc
+from sc import build_stats, page_transforms
+
+logger = logging.getLogger(__name__)
+
+# Extract the contents of the body using regex, DOTALL and non-greedy
+# matching makes this straightforward.
+content_regex = regex.compile(r'''
+    <body[^>]*>
+    (?<content>.*)
+    </body>
+    ''', flags=regex.DOTALL | regex.VERBOSE)
+
+TextExtract = namedtuple('TextExtract', 'snippet title fragment')
+
+
+def get_snippet(html, target_len=500):
+    """ Return about target_len characters of the paragraphs at the
+    start of the article in html """
+    from sc.tools import html as _html
+    root = _html.fromstring(html[:target_len + 2000])
+    for e in root.cssselect('.hgroup'):
+        e.drop_tree()
+    article = root.cssselect('article')[0]
+    parts = []
+    total_len = 0
+    for e in article:
+        if e.tag not in {'p', 'blockquote'}:
+            continue
+        text = e.text_content()
+        parts.append(text)
+        total_len += len(text)
+        if total_len > target_len:
+            break
+
+    text = '   '.join(parts)
+    if len(text) > target_len:
+        text = text[:target_len] + ' …'
+    return text
+
+
+def extract_file(path, lang_uid):
+    """ Return the (snippet, fragment) of the text in the file path,
+    fragment is None if it has no body or it can't be spliced into the
+    page """
+    with open(path, 'r', encoding='utf-8') as f:
+        m = content_regex.search(f.read())
+    if not m:
+        return None, None
+    body = m['content']
+    try:
+        snippet = get_snippet(body)
+    except Exception as e:
+        logger.error('Failed to generate snippet for {} ({})'.format(path, e))
+        snippet = ''
+    # The text as TextView shows it
+    text = body
+    try:
+        if lang_uid in page_transforms.cjk_lang_codes:
+            text = page_transforms.massage_cjk(text)
+        fragment = page_transforms.prepare_fragment(text)
+    except Exception as e:
+        logger.error('Failed to prepare {} ({})'.format(path, e))
+        fragment = None
+    return snippet, fragment
+
+
+class TextExtractStore:
+    """ The extracts of the texts, in a SQLite database """
+
+    db_name_tmpl = 'text-extracts-{version}.sqlite'
+    # Increment when the schema or the extraction changes.
+    version = 3
+    # More files than this are extracted in a process pool
+    pool_threshold = 200
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS extracts (
+            path TEXT PRIMARY KEY,
+            lang TEXT NOT NULL,
+            md5 TEXT NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            size INTEGER NOT NULL,
+            snippet TEXT,
+            title TEXT,
+            fragment_lead TEXT,
+            fragment TEXT,
+            fragment_trail TEXT
+        );
+        CREATE INDEX IF NOT EXISTS extracts_lang ON extracts (lang);
+        CREATE TABLE IF NOT EXISTS languages (
+            lang TEXT PRIMARY KEY,
+            db_file TEXT NOT NULL
+        );
+    """
+
+    def __init__(self, file=None):
+        if file is None:
+            file = sc.db_dir / self.db_name_tmpl.format(version=self.version)
+        self.file = file
+        self._local = threading.local()
+        file.parent.mkdir(parents=True, exist_ok=True)
+        con = sqlite3.connect(str(file))
+        try:
+            # Readers aren't blocked while the store is updated
+            con.execute('PRAGMA journal_mode = WAL')
+            con.executescript(self.schema)
+        finally:
+            con.close()
+
+    @property
+    def _con(self):
+        # Connections can't be shared between threads, or with forked
+        # processes.
+        con = getattr(self._local, 'con', None)
+        if con is None or self._local.pid != os.getpid():
+            con = sqlite3.connect(str(self.file), timeout=60)
+            self._local.con = con
+            self._local.pid = os.getpid()
+        return con
+
+    def get(self, path):
+        """ Return the TextExtract of the text in the file path, or None
+        if it isn't in the store, the file changed since or its text
+        couldn't be prepared """
+        try:
+            key = str(path.relative_to(sc.text_dir))
+            row = self._con.execute('SELECT mtime_ns, size, snippet, title, '
+                                    'fragment_lead, fragment, fragment_trail '
+                                    'FROM extracts WHERE path = ?', (key,)).fetchone()
+            if row is None or row[5] is None:
+                return None
+            stat = path.stat()
+        except (ValueError, OSError, sqlite3.Error) as e:
+            return None
+        if (stat.st_mtime_ns, stat.st_size) != row[:2]:
+            return None
+        snippet, title, lead, fragment, trail = row[2:]
+        return TextExtract(snippet, title, page_transforms.Fragment(lead, fragment, trail))
+
+    def stale_languages(self, db_files):
+        """ Return the uids of the languages of db_files whose extracts
+        were made from a different database, or not made """
+        done = dict(self._con.execute('SELECT lang, db_file FROM languages'))
+        return [lang_uid for lang_uid, db_file in sorted(db_files.items())
+                if done.get(lang_uid) != db_file.name]
+
+    def remove_other_languages(self, lang_uids):
+        """ Remove the extracts of the languages not in lang_uids """
+        con = self._con
+        with con:
+            rows = con.execute('SELECT lang FROM extracts UNION SELECT lang FROM languages')
+            for lang_uid, in rows.fetchall():
+                if lang_uid not in lang_uids:
+                    con.execute('DELETE FROM extracts WHERE lang = ?', (lang_uid,))
+                    con.execute('DELETE FROM languages WHERE lang = ?', (lang_uid,))
+
+    def update_language(self, lang_uid, lang_tim, db_file, workers=None):
+        """ Bring the extracts of a language up to date with its TIM,
+        which was saved in db_file """
+        con = self._con
+        existing = {path: (md5, mtime_ns, size) for path, md5, mtime_ns, size in con.execute(
+            'SELECT path, md5, mtime_ns, size FROM extracts WHERE lang = ?', (lang_uid,))}
+        to_extract = []
+        touched = []
+        for key, (mtime_ns, size, md5) in lang_tim._manifest.items():
+            record = lang_tim._file_records[key]
+            if record.uid == 'metadata':
+                continue
+            previous = existing.get(key)
+            if previous is None or previous[0] != md5:
+                to_extract.append((key, md5, mtime_ns, size, record.name))
+            elif previous[1:] != (mtime_ns, size):
+                touched.append((mtime_ns, size, key))
+        removed = [(key,) for key in existing if key not in lang_tim._manifest]
+
+        paths = [str(sc.text_dir / key) for key, *_ in to_extract]
+        lang_uids = [lang_uid] * len(paths)
+        if len(paths) > self.pool_threshold and workers != 1:
+            # Spawned rather than forked, as the TIM is loaded in a
+            # thread of the server (see TIMManager.build_languages).
+            with multiprocessing.get_context('spawn').Pool(workers) as pool:
+                extracts = pool.starmap(extract_file, zip(paths, lang_uids), chunksize=50)
+        else:
+            extracts = list(map(extract_file, paths, lang_uids))
+
+        with con:
+            con.executemany('DELETE FROM extracts WHERE path = ?', removed)
+            con.executemany('UPDATE extracts SET mtime_ns = ?, size = ? WHERE path = ?', touched)
+            con.executemany('INSERT OR REPLACE INTO extracts '
+                            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                            [(key, lang_uid, md5, mtime_ns, size, snippet, title)
+                             + (tuple(fragment) if fragment else (None, None, None))
+                             for (key, md5, mtime_ns, size, title), (snippet, fragment)
+                             in zip(to_extract, extracts)])
+            con.execute('INSERT OR REPLACE INTO languages VALUES (?, ?)',
+                        (lang_uid, db_file.name))
+        if to_extract or removed:
+            logger.info('Extracted {} text(s) of "{}", {} removed'.format(
+                len(to_extract), lang_uid, len(removed)))
+
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_store():
+    """ Return the TextExtractStore of the db folder """
+    global _store
+    # The lock is only taken until the store is made
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = TextExtractStore()
+    return _store
+
+
+def update(lang_uids, db_files, components, load):
+    """ Update the extracts of the languages whose TIM changed
+
+    components are the TIMs of languages which are already loaded, by
+    language uid, the others are loaded by calling load with the
+    language uid, only if their extracts are out of date.
+
+    """
+    store = get_store()
+    store.remove_other_languages(set(lang_uids))
+    workers = sc.config.app['tim_build_workers'] or os.cpu_count() or 1
+    for lang_uid in store.stale_languages(db_files):
+        with build_stats.phase('extracts {}'.format(lang_uid)):
+            lang_tim = components.get(lang_uid) or load(lang_uid)
+            store.update_language(lang_uid, lang_tim, db_files[lang_uid], workers)
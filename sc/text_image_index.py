@@ -6,6 +6,8 @@ from typing import Mapping
 import sc
 from sc.views import ViewBase
 from sc.util import Timer
+from sc.generation import GenerationCache
+from sc.change_detector import ChangeDetector
 
 
 import pathlib
@@ -23,17 +25,24 @@ def build(n=0):
 
 cache_filename_template = 'text-image-index_{}.pklz'
 
+# Created when first needed, as it watches the images folder
+_images_detector = None
+
 def create_index_and_update_symlinks() -> Mapping[NormalizedId, str]:
     """ Symlinks are used mainly for the ease of serving with Nginx """
     
     def image_filter(filename):
         return filename.endswith('.png') or filename.endswith('.jpg')
     
+    global _images_detector
+    if _images_detector is None:
+        _images_detector = ChangeDetector('text-images', sc.text_image_source_dir, include_filter=image_filter)
+    
     symlink_md5 = sc.util.get_folder_shallow_md5(folder=sc.text_image_symlink_dir, check_mtime=False, include_filter=image_filter)
-    images_md5 = sc.util.get_folder_deep_md5(folder=sc.text_image_source_dir, check_mtime=True, include_filter=image_filter)
+    images_signature = _images_detector.signature()
     
     combined_md5 = symlink_md5
-    combined_md5.update(symlink_md5.digest())
+    combined_md5.update(images_signature.encode('ascii'))
     cache_file = sc.db_dir / cache_filename_template.format(combined_md5.hexdigest()[:10])
     if cache_file.exists():
         try:
@@ -78,23 +87,27 @@ def clear_old_cache_files(newest):
         else:
             file.unlink()
 
-def normalize_id(value, _divs=set()) -> NormalizedId:
+_divs_cache = GenerationCache('normalize_id_divs', depends='imm')
+
+def _get_divs():
+    import sc.scimm
+    imm = sc.scimm.imm()
+    divs = set(imm.divisions)
+    divs.update(subdiv.uid for subdiv in imm.divisions['kn'].subdivisions)
+    divs.add('vi')
+    return divs
+
+def normalize_id(value) -> NormalizedId:
     # Normalize into form:
     # manuscript-book-vol-page
     # pts-mn-1-96
     # vl
     
-    if not _divs:
-        import sc.scimm
-        imm = sc.scimm.imm()
-        _divs.update(imm.divisions)
-        _divs.update(subdiv.uid for subdiv in imm.divisions['kn'].subdivisions)
-        _divs.add('vi')
-    
     if 'pts' in value:
+        divs = _divs_cache.get('divs', _get_divs)
         value = value.replace('-pg.', '-').replace('-vol.', '').replace('.', '-').replace('-pg-', '-').replace('--', '-').replace('-jat', '-ja')
         value = regex.sub(r'\d+', lambda m: str(int(m[0])), value)
-        value = regex.sub(r'[a-z]+(?=\d)', lambda m: m[0] + '-' if m[0] in _divs else m[0], value)
+        value = regex.sub(r'[a-z]+(?=\d)', lambda m: m[0] + '-' if m[0] in divs else m[0], value)
     return NormalizedId(value)
 
 def get(sutta_uid, volpage) -> str:
@@ -1,7 +1,10 @@
 import os
+import sys
 import lz4
 import time
 import regex
+import bisect
+import shutil
 import pickle
 import pathlib
 import hashlib
@@ -10,12 +13,21 @@ import sqlite3
 import datetime
 import functools
 import threading
+import multiprocessing
+import collections.abc
+import urllib.parse
+from array import array
 from itertools import chain
 
 import sc
+import sc.generation
+from sc import build_stats
+from sc.change_detector import ChangeDetector
+from sc.codepoints import CodepointSet
 import sc.util
 import sc.logger
-from sc.tools import html
+from sc.textextract import extract_text
+from sc import text_extracts
 
 logger = logging.getLogger(__name__)
 
@@ -37,7 +49,7 @@ class TextInfo:
     def __init__(self, **kwargs):
         for key in self.__slots__:
             value = kwargs.get(key, None)
-            if key == 'path':
+            if key == 'path' and not isinstance(value, pathlib.Path):
                 value = pathlib.Path(value) if value else None
             setattr(self, key, value)
     
@@ -46,6 +58,16 @@ class TextInfo:
 
     def as_dict(self):
         return {key: getattr(self, key) for key in self.__slots__}
+    
+    def __getstate__(self):
+        # A tuple is much smaller and quicker to unpickle than the
+        # dict of slots. The text infos of a file share its path, which
+        # is only pickled once.
+        return tuple(getattr(self, key) for key in self.__slots__)
+    
+    def __setstate__(self, state):
+        for key, value in zip(self.__slots__, state):
+            setattr(self, key, value)
 
     @property
     def url(self):
@@ -54,17 +76,61 @@ class TextInfo:
             out = out + '#{}'.format(self.bookmark)
         return out
 
+class FileRecord:
+    """ The information gathered from one file of a language folder
+    
+    Records are kept with the model of the language, so that only the
+    files which change need to be parsed again.
+    
+    """
+    __slots__ = ('uid', 'path', 'prev_uid', 'next_uid', 'author',
+                 'metaarea_author', 'name', 'volpage',
+                 'embedded', 'codepoints', 'cdate', 'mdate')
+    
+    def __init__(self, **kwargs):
+        for key in self.__slots__:
+            setattr(self, key, kwargs.get(key, None))
+        if self.embedded is None:
+            self.embedded = []
+    
+    def __getstate__(self):
+        # As TextInfo, the path is shared with the text infos of the file
+        return tuple(getattr(self, key) for key in self.__slots__)
+    
+    def __setstate__(self, state):
+        for key, value in zip(self.__slots__, state):
+            setattr(self, key, value)
+    
+    def set_dates(self, file):
+        fstat = file.stat()
+        self.cdate = TextInfoModel.datestr(fstat.st_ctime)
+        self.mdate = TextInfoModel.datestr(fstat.st_mtime)
+
 class TIMManager:
     db_name_tmpl = 'text-info-model-{lang}_{hash}.pklz'
-    version = 2
+    version = 5
     def __init__(self):
         self.instance = None
         self.load_lock = threading.Lock()
         self.ready = threading.Event()
     
+    _change_detectors = {}
+    
     @classmethod
-    def get_db_name(cls, lang_dir):
-        md5 = sc.util.get_folder_deep_md5(lang_dir, include_filter=lambda file: file.endswith('.html'))
+    def get_db_name(cls, lang_dir, full=False):
+        """ The name of the database depends on the html files of the
+        language folder and the version
+        
+        Changes are found by checking the modification times of the
+        directories, unless full is True (see sc.change_detector).
+        
+        """
+        detector = cls._change_detectors.get(lang_dir)
+        if detector is None:
+            detector = ChangeDetector('text-{}'.format(lang_dir.stem), lang_dir,
+                                      include_filter=lambda file: file.endswith('.html'))
+            cls._change_detectors[lang_dir] = detector
+        md5 = hashlib.md5(detector.signature(full=full).encode('ascii'))
         md5.update(str(cls.version).encode('ascii'))
         
         return cls.db_name_tmpl.format(lang=lang_dir.stem, hash=md5.hexdigest()[:10])
@@ -93,57 +159,164 @@ class TIMManager:
         This generates a database per language folder, if no
         file has changed within a language folder, the cached data is 
         simply unpickled and reused.
-        If any file has changed, the entire data for that language is
-        regenerated and pickled.
+        If any file has changed, the previous database for that language
+        is updated by parsing only the changed files, and pickled.
         The individual databases per language folder are finally spliced
-        into a single database.
+        into a single SQLite database, which is read on demand (see
+        SqliteBackedTIM). Only the languages which changed are spliced,
+        into a copy of the previous SQLite database, and when no
+        language has changed the SQLite database is simply opened.
         
         """
         with self.load_lock:
             self.load_inner(force)
     
-    def load_inner(self, force=False):        
-        components = {}
-        files_used = set()
-        
-        for lang_dir in sorted(sc.text_dir.glob('*')):
-            if lang_dir.is_dir():
-                lang_uid = lang_dir.stem
-                db_filename = self.get_db_name(lang_dir)
-                db_file = sc.db_dir / db_filename
-                lang_tim = None
-                if not force and db_file.exists():
-                    try:
-                        lang_tim = sc.util.lz4_pickle_load(db_file)
-                        build_logger.info('Loading TIM data for "{}" from disk'.format(lang_uid))
-                    except Exception as e:
-                        logging.exception(e)
-                if not lang_tim:
-                    build_logger.info('Building TIM data for "{}"'.format(lang_uid))
-                    lang_tim = TextInfoModel(name=lang_uid)
-                    lang_tim.build(lang_dir, force=True)
-                    sc.util.lz4_pickle_dump(lang_tim, db_file)
-                components[lang_uid] = lang_tim
-                files_used.add(db_file)
-        
-        build_logger.info('Removing unused db files'.format(lang_uid))
+    def load_inner(self, force=False):
+        with build_stats.record('tim') as stats:
+            self._load(force)
+            stats.generation = self.instance.generation
+    
+    def _load(self, force=False):
+        lang_dirs = [lang_dir for lang_dir in sorted(sc.text_dir.glob('*'))
+                     if lang_dir.is_dir()]
+        db_files = {lang_dir.stem: sc.db_dir / self.get_db_name(lang_dir, full=force)
+                    for lang_dir in lang_dirs}
+        files_used = set(db_files.values())
+        
+        # The signature identifies the content of the spliced TIM, it
+        # changes whenever any of the language databases change.
+        signature = hashlib.md5(str(sorted(file.name for file in files_used)).encode()).hexdigest()[:10]
+        tim_file = SqliteBackedTIM.get_file(signature)
+        
+        if force or not tim_file.exists():
+            # Only the languages which changed since the previous TIM
+            # was spliced are loaded and spliced into a copy of it.
+            previous_file = None if force else self.get_previous_tim_file(tim_file)
+            spliced = {}
+            if previous_file:
+                spliced = SqliteBackedTIM.read_languages(previous_file)
+                if spliced is None:
+                    previous_file = None
+                    spliced = {}
+            stale_dirs = [lang_dir for lang_dir in lang_dirs
+                          if spliced.get(lang_dir.stem) != db_files[lang_dir.stem].name]
+            components = self._load_languages(stale_dirs, db_files, force)
+            build_logger.info('Splicing TIM data for {} of {} language(s)'.format(
+                len(stale_dirs), len(lang_dirs)))
+            with build_stats.phase('splice'):
+                SqliteBackedTIM.write(tim_file, components, db_files, signature, previous_file)
+        else:
+            components = {}
+        
+        try:
+            text_extracts.update(list(db_files), db_files, components,
+                                 lambda lang_uid: sc.util.lz4_pickle_load(db_files[lang_uid]))
+        except Exception as e:
+            # Texts are still shown, by reading them.
+            logger.exception('Failed to update text extracts')
+        
+        build_logger.info('Removing unused db files')
         # Delete Unused Files:
         for file in sc.db_dir.glob(self.db_name_tmpl.format(lang='*', hash='*')):
             if file not in files_used:
                 file.unlink()
+        for file in sc.db_dir.glob(SqliteBackedTIM.db_name_tmpl.format(hash='*')):
+            if file != tim_file:
+                # Processes still using it keep it open.
+                file.unlink()
+        
+        self._set_instance(SqliteBackedTIM(tim_file))
+        build_logger.info('TIM is ready')
+    
+    def _load_languages(self, lang_dirs, db_files, force=False):
+        """ Return the TIM of each language, by language uid, loading
+        them from disk or building them as needed """
+        components = {}
+        to_build = []
+        for lang_dir in lang_dirs:
+            lang_uid = lang_dir.stem
+            db_file = db_files[lang_uid]
+            lang_tim = None
+            if not force and db_file.exists():
+                try:
+                    with build_stats.phase('load {}'.format(lang_uid)):
+                        lang_tim = sc.util.lz4_pickle_load(db_file)
+                    build_logger.info('Loading TIM data for "{}" from disk'.format(lang_uid))
+                except Exception as e:
+                    logging.exception(e)
+            if not lang_tim:
+                previous_file = None if force else self.get_previous_db_file(lang_uid)
+                to_build.append((lang_dir, db_file, previous_file))
+            # Filled in below for languages which need building,
+            # so the order of languages doesn't depend on which.
+            components[lang_uid] = lang_tim
         
-        # Now we need to splice the individual languages
-        tim = TextInfoModel('Oneness')
+        if to_build:
+            components.update(self.build_languages(to_build))
+        return components
+    
+    @staticmethod
+    def build_languages(to_build):
+        """ Build the TIMs of several languages, in parallel
+
+        to_build is a list of (lang_dir, db_file, previous_file) tuples.
+        Each language is built in a process of a pool of
+        sc.config.app['tim_build_workers'] processes, by default one per
+        CPU, which saves it to db_file. Returns a dict of the TIMs by
+        language uid. The processes are spawned rather than forked, as
+        this runs in a thread of the server, whose locks and connections
+        a fork would inherit.
+
+        """
+        workers = sc.config.app['tim_build_workers'] or os.cpu_count() or 1
+        workers = min(workers, len(to_build))
+        lang_uids = [lang_dir.stem for lang_dir, _, _ in to_build]
+        build_logger.info('Building TIM data for "{}" with {} worker(s)'.format(
+            '", "'.join(lang_uids), workers))
+        start = time.time()
         
-        build_logger.info('Splicing TIM data'.format(lang_uid))
-        for lang_uid, baby_tim in components.items():
-            sc.util.recursive_merge(tim._by_lang, baby_tim._by_lang)
-            sc.util.recursive_merge(tim._by_uid, baby_tim._by_uid)
-            sc.util.recursive_merge(tim._metadata, baby_tim._metadata)
-            sc.util.recursive_merge(tim._codepoints, baby_tim._codepoints)
+        components = {}
+        if workers == 1:
+            for lang_dir, db_file, previous_file in to_build:
+                with build_stats.phase('build {}'.format(lang_dir.stem)):
+                    components[lang_dir.stem] = build_language(lang_dir, db_file,
+                                                               previous_file=previous_file)
+        else:
+            with build_stats.phase('build {}'.format(', '.join(lang_uids))), \
+                    multiprocessing.get_context('spawn').Pool(workers) as pool:
+                # Returning the TIM from the worker would pickle it a
+                # second time, it is loaded from the saved file instead.
+                results = [pool.apply_async(build_language, (lang_dir, db_file, False, previous_file))
+                           for lang_dir, db_file, previous_file in to_build]
+                for (lang_dir, db_file, _), result in zip(to_build, results):
+                    result.get()
+                    components[lang_dir.stem] = sc.util.lz4_pickle_load(db_file)
         
-        self._set_instance(tim)
-        build_logger.info('TIM is ready'.format(lang_uid))
+        build_logger.info('Built TIM data for {} language(s) in {:.1f} seconds'.format(
+            len(to_build), time.time() - start))
+        return components
+    
+    @classmethod
+    def get_previous_db_file(cls, lang_uid):
+        """ Return the most recent database of the language, which is no
+        longer current, or None """
+        # Languages whose uid has this one as a prefix also match the glob
+        stem = cls.db_name_tmpl.format(lang=lang_uid, hash='').rpartition('_')[0]
+        files = [file for file in sc.db_dir.glob(cls.db_name_tmpl.format(lang=lang_uid, hash='*'))
+                 if file.name.rpartition('_')[0] == stem]
+        if not files:
+            return None
+        return max(files, key=lambda file: file.stat().st_mtime)
+    
+    @staticmethod
+    def get_previous_tim_file(tim_file):
+        """ Return the most recent spliced TIM other than tim_file, or
+        None """
+        files = [file for file in sc.db_dir.glob(SqliteBackedTIM.db_name_tmpl.format(hash='*'))
+                 if file != tim_file]
+        if not files:
+            return None
+        return max(files, key=lambda file: file.stat().st_mtime)
     
     def get(self):
         if self.instance:
@@ -152,11 +325,299 @@ class TIMManager:
         return self.instance
         
     def _set_instance(self, instance):
+        instance.generation = sc.generation.next_generation()
         self.instance = instance
         # Other threads can now use it.
         self.ready.set()
 
 
+class SqliteBackedTIM:
+    """ The spliced TIM of all languages, stored in a SQLite database
+    
+    Text infos are read from the database when they are needed rather
+    than held in memory, the database is memory mapped so its pages
+    are shared by all processes through the page cache. It is only
+    written by write(), and opened read-only.
+    
+    The read methods are the same as those of TextInfoModel, except that
+    get(lang_uid=...) returns a read-only mapping.
+    
+    The authors are shared by many texts, they are stored once in the
+    strings table and referred to by id.
+    
+    """
+    db_name_tmpl = 'text-info-model_{hash}.sqlite'
+    # Increment when the schema changes.
+    version = 4
+    # Bytes of the database to memory map
+    mmap_size = 1 << 30
+    
+    fields = TextInfo.__slots__
+    schema = """
+        CREATE TABLE textinfo (
+            key TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            {},
+            PRIMARY KEY (lang, key)
+        ) WITHOUT ROWID;
+        CREATE INDEX textinfo_key ON textinfo (key, lang);
+        CREATE INDEX textinfo_seq ON textinfo (lang, seq);
+        CREATE TABLE languages (
+            lang TEXT PRIMARY KEY,
+            db_file TEXT NOT NULL
+        );
+        CREATE TABLE strings (
+            id INTEGER PRIMARY KEY,
+            value TEXT NOT NULL
+        );
+        CREATE TABLE codepoints (
+            lang TEXT NOT NULL,
+            style TEXT NOT NULL,
+            bitmap BLOB NOT NULL,
+            PRIMARY KEY (lang, style)
+        );
+        CREATE TABLE info (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+    """.format(', '.join(fields))
+    
+    def __init__(self, file, name='Oneness'):
+        self.file = file
+        self.name = name
+        self.generation = None
+        self._local = threading.local()
+        self.signature = self._execute('SELECT value FROM info WHERE key = ?',
+                                       ('signature',)).fetchone()[0]
+        self._strings = dict(self._execute('SELECT id, value FROM strings'))
+    
+    @classmethod
+    def get_file(cls, signature):
+        md5 = hashlib.md5('{}{}'.format(signature, cls.version).encode('ascii'))
+        return sc.db_dir / cls.db_name_tmpl.format(hash=md5.hexdigest()[:10])
+    
+    @classmethod
+    def write(cls, file, components, db_files, signature, previous_file=None):
+        """ Write the TIM to file
+        
+        db_files are the names of the databases of every language, by
+        language uid, components the TIMs of the languages which need
+        to be written. If previous_file is given it is copied and only
+        the languages in components, or no longer in db_files, are
+        replaced, the others are as they were spliced before.
+        
+        """
+        tmp_file = file.with_suffix('.tmp{}'.format(os.getpid()))
+        if tmp_file.exists():
+            tmp_file.unlink()
+        if previous_file:
+            shutil.copyfile(str(previous_file), str(tmp_file))
+        con = sqlite3.connect(str(tmp_file))
+        try:
+            if previous_file:
+                stale = set(components)
+                stale.update(lang_uid for lang_uid, in con.execute('SELECT lang FROM languages')
+                             if lang_uid not in db_files)
+                for lang_uid in stale:
+                    for table in ('textinfo', 'codepoints', 'languages'):
+                        con.execute('DELETE FROM {} WHERE lang = ?'.format(table), (lang_uid,))
+                strings = {value: i for i, value in con.execute('SELECT id, value FROM strings')}
+            else:
+                con.executescript(cls.schema)
+                strings = {}
+            new_strings = len(strings)
+            
+            insert = 'INSERT INTO textinfo VALUES ({})'.format(
+                ', '.join('?' * (len(cls.fields) + 2)))
+            for component_uid, lang_tim in components.items():
+                for lang_uid, textinfos in lang_tim._by_lang.items():
+                    rows = []
+                    for seq, (key, textinfo) in enumerate(textinfos.items()):
+                        row = [key, seq]
+                        for field in cls.fields:
+                            value = getattr(textinfo, field)
+                            if field == 'lang':
+                                value = lang_uid
+                            elif field == 'path' and value:
+                                value = str(value)
+                            elif field == 'author' and value is not None:
+                                value = strings.setdefault(value, len(strings))
+                            row.append(value)
+                        rows.append(row)
+                    con.executemany(insert, rows)
+                for lang_uid, codepoints in lang_tim._codepoints.items():
+                    con.executemany('INSERT INTO codepoints VALUES (?, ?, ?)',
+                                    [(lang_uid, style, chars.to_bytes())
+                                     for style, chars in codepoints.items()])
+                con.execute('INSERT INTO languages VALUES (?, ?)',
+                            (component_uid, db_files[component_uid].name))
+            con.executemany('INSERT INTO strings VALUES (?, ?)',
+                            [(i, value) for value, i in strings.items() if i >= new_strings])
+            con.execute('INSERT OR REPLACE INTO info VALUES (?, ?)', ('signature', signature))
+            con.execute('INSERT OR REPLACE INTO info VALUES (?, ?)', ('version', str(cls.version)))
+            con.commit()
+        finally:
+            con.close()
+        # Other processes never see a partially written database.
+        tmp_file.rename(file)
+    
+    @classmethod
+    def read_languages(cls, file):
+        """ Return the names of the language databases spliced into
+        file, by language uid, or None if it can't be spliced into """
+        try:
+            uri = 'file:{}?mode=ro'.format(urllib.parse.quote(str(file)))
+            con = sqlite3.connect(uri, uri=True)
+            try:
+                version = con.execute('SELECT value FROM info WHERE key = ?',
+                                      ('version',)).fetchone()
+                if not version or version[0] != str(cls.version):
+                    return None
+                return dict(con.execute('SELECT lang, db_file FROM languages'))
+            finally:
+                con.close()
+        except sqlite3.Error as e:
+            logger.exception('Failed to read {!s}'.format(file))
+            return None
+    
+    @property
+    def _con(self):
+        # Connections can't be shared between threads, or with forked
+        # processes.
+        con = getattr(self._local, 'con', None)
+        if con is None or self._local.pid != os.getpid():
+            uri = 'file:{}?mode=ro'.format(urllib.parse.quote(str(self.file)))
+            con = sqlite3.connect(uri, uri=True)
+            con.execute('PRAGMA mmap_size = {}'.format(self.mmap_size))
+            self._local.con = con
+            self._local.pid = os.getpid()
+        return con
+    
+    def _execute(self, sql, parameters=()):
+        return self._con.execute(sql, parameters)
+    
+    _select = 'SELECT {} FROM textinfo'.format(', '.join(fields))
+    
+    _author_index = fields.index('author')
+    
+    def _textinfo(self, row):
+        textinfo = TextInfo(**dict(zip(self.fields, row)))
+        author = row[self._author_index]
+        if author is not None:
+            textinfo.author = self._strings[author]
+        return textinfo
+    
+    def get(self, uid=None, lang_uid=None):
+        """ Returns TextInfo entries which match arguments, as
+        TextInfoModel.get """
+        if uid and lang_uid:
+            row = self._execute(self._select + ' WHERE lang = ? AND key = ?',
+                                (lang_uid, uid)).fetchone()
+            return self._textinfo(row) if row else None
+        elif uid:
+            rows = self._execute(self._select + ' WHERE key = ? ORDER BY lang',
+                                 (uid,))
+            textinfos = map(self._textinfo, rows)
+            return {textinfo.lang: textinfo for textinfo in textinfos}
+        elif lang_uid:
+            return LanguageTextInfos(self, lang_uid)
+        else:
+            raise ValueError('At least one of uid or lang_uid must be set')
+    
+    def exists(self, uid=None, lang_uid=None):
+        if uid is None and lang_uid is None:
+            raise ValueError
+        conditions = []
+        parameters = []
+        if uid:
+            conditions.append('key = ?')
+            parameters.append(uid)
+        if lang_uid:
+            conditions.append('lang = ?')
+            parameters.append(lang_uid)
+        if not conditions:
+            return False
+        return self._execute('SELECT 1 FROM textinfo WHERE {} LIMIT 1'.format(
+            ' AND '.join(conditions)), parameters).fetchone() is not None
+    
+    def languages(self):
+        """ Return the uids of the languages which have texts """
+        return [row[0] for row in self._execute(
+            'SELECT DISTINCT lang FROM textinfo ORDER BY lang')]
+    
+    def get_codepoints_used(self, lang_uid=None, weight_or_style='normal'):
+        if lang_uid:
+            row = self._execute('SELECT bitmap FROM codepoints WHERE lang = ? AND style = ?',
+                                (lang_uid, weight_or_style)).fetchone()
+            if not row:
+                return None
+            return CodepointSet.from_bytes(row[0])
+        
+        rows = self._execute('SELECT bitmap FROM codepoints WHERE style = ?',
+                             (weight_or_style,))
+        return CodepointSet.union_all(CodepointSet.from_bytes(row[0]) for row in rows)
+
+
+class LanguageTextInfos(collections.abc.Mapping):
+    """ The text infos of one language of a SqliteBackedTIM, by uid, in
+    the order of the texts """
+    
+    def __init__(self, tim, lang_uid):
+        self.tim = tim
+        self.lang_uid = lang_uid
+    
+    def __getitem__(self, uid):
+        textinfo = self.tim.get(uid, self.lang_uid)
+        if textinfo is None:
+            raise KeyError(uid)
+        return textinfo
+    
+    def __contains__(self, uid):
+        return self.tim.exists(uid, self.lang_uid)
+    
+    def __iter__(self):
+        rows = self.tim._execute('SELECT key FROM textinfo WHERE lang = ? ORDER BY seq',
+                                 (self.lang_uid,)).fetchall()
+        return (row[0] for row in rows)
+    
+    def __len__(self):
+        return self.tim._execute('SELECT COUNT(*) FROM textinfo WHERE lang = ?',
+                                 (self.lang_uid,)).fetchone()[0]
+    
+    def items(self):
+        rows = self.tim._execute('SELECT key, {} FROM textinfo WHERE lang = ? ORDER BY seq'.format(
+            ', '.join(self.tim.fields)), (self.lang_uid,)).fetchall()
+        return [(row[0], self.tim._textinfo(row[1:])) for row in rows]
+    
+    def values(self):
+        return [textinfo for _, textinfo in self.items()]
+
+
+def build_language(lang_dir, db_file, return_tim=True, previous_file=None):
+    """ Build the TIM of one language and save it to db_file
+
+    If previous_file is given the TIM saved in it is updated, which
+    only parses the files which changed, otherwise it is built from
+    scratch. This is run in worker processes, so it is a module level
+    function.
+
+    """
+    lang_tim = None
+    if previous_file is not None:
+        try:
+            lang_tim = sc.util.lz4_pickle_load(previous_file)
+        except Exception as e:
+            logger.exception('Failed to load previous TIM data from {}'.format(previous_file))
+    if lang_tim is None:
+        lang_tim = TextInfoModel(name=lang_dir.stem)
+        lang_tim.build(lang_dir, force=True)
+    else:
+        lang_tim.build(lang_dir)
+    sc.util.lz4_pickle_dump(lang_tim, db_file)
+    if return_tim:
+        return lang_tim
+
+
 class TextInfoModel:
     """ The TextInfoModel is responsible for scanning the entire contents
     of the text folders and building a model containing information not
@@ -178,6 +639,7 @@ class TextInfoModel:
         self._metadata = {}
         self._codepoints = {}
         self.name = name
+        self.signature = None
     
     def to_json(self):
         def default(obj):
@@ -204,7 +666,8 @@ class TextInfoModel:
     def repair(self):
         return
         
-    def datestr(self, timestamp):
+    @staticmethod
+    def datestr(timestamp):
         return datetime.datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d')
     
     def get_codepoints_used(self, lang_uid=None, weight_or_style='normal'):
@@ -214,9 +677,8 @@ class TextInfoModel:
                 return None
             return unicodes_by_weight[weight_or_style]
         
-        result = set()
-        result.update(*(unicodes[weight_or_style] for unicodes in self._codepoints.values()))
-        return result
+        return CodepointSet.union_all(unicodes[weight_or_style]
+                                      for unicodes in self._codepoints.values())
 
     def get(self, uid=None, lang_uid=None):
         """ Returns TextInfo entries which match arguments
@@ -249,6 +711,10 @@ class TextInfoModel:
             raise ValueError
         return bool(self.get(uid, lang_uid))
 
+    def languages(self):
+        """ Return the uids of the languages which have texts """
+        return sorted(self._by_lang)
+
     def add_text_info(self, lang_uid, uid, textinfo):
         if lang_uid not in self._by_lang:
             self._by_lang[lang_uid] = {}
@@ -258,30 +724,21 @@ class TextInfoModel:
         self._by_uid[uid][lang_uid] = textinfo
 
     def get_palipagenumbinator(self):
-        if not self._ppn:
-            self._ppn = PaliPageNumbinator()
-        return self._ppn
-        
-    def add_metadata(self, filepath, author, metadata):
-        target = self._metadata
-        for part in filepath.parent.parts:
-            if part not in target:
-                target[part] = {}
-            target = target[part]
-        target['author'] = author
-        with (sc.text_dir / filepath).open('r') as f:
-            target['string'] = f.read()
+        return get_palipagenumbinator()
+        
+    def add_metadata(self, filepath, author):
+        """ Set the author of the texts in the folder of the metadata
+        file filepath, which is relative to the text dir """
+        self._metadata[str(filepath.parent)] = sys.intern(author)
             
-    def get_metadata(self, filepath):
-        target = self._metadata
-        for part in filepath.parent.parts:
-            if part in target:
-                target = target[part]
-            else:
-                break
-        if target == self._metadata:
-            return None
-        return target
+    def get_metadata_author(self, filepath):
+        """ Return the author given by the metadata file of the nearest
+        folder of filepath which has one, or None """
+        for folder in filepath.parents:
+            author = self._metadata.get(str(folder))
+            if author is not None:
+                return author
+        return None
     
     @staticmethod
     def uids_are_related(uid1, uid2, _rex=regex.compile(r'\p{alpha}*(?:-\d+)?')):
@@ -311,47 +768,144 @@ class TextInfoModel:
         return False    
     
     def build(self, lang_dir, force=False):
-        # The pagenumbinator should be scoped because it uses
-        # a large chunk of memory which should be gc'd.
-        # But it shouldn't be created at all if we don't need it.
-        # So we use a getter, and delete it when we are done.
-        self._ppn = None
-        
-        codepoints = set()
-        bold_codepoints = set()
-        italic_codepoints = set()        
+        """ Build or update the model of the language in lang_dir
 
+        The information gathered from each file is kept, along with a
+        manifest of the files, so when the model is built again only
+        the files which were added or changed since are parsed. The
+        model is then assembled from the information of every file, as
+        guessed neighbours, inherited metadata and ranges depend on
+        other files. With force every file is parsed.
+
+        """
+        if force or not hasattr(self, '_file_records'):
+            self._manifest = {}
+            self._file_records = {}
+        
         lang_uid = lang_dir.stem
         all_files = sorted(lang_dir.glob('**/*.html'), key=lambda f: sc.util.numericsortkey(f.stem))
         files = [f for f in all_files if f.stem == 'metadata'] + [f for f in all_files if f.stem != 'metadata']
+        
+        manifest = {}
+        records = {}
+        parsed = 0
+        for htmlfile in files:
+            key = str(htmlfile.relative_to(sc.text_dir))
+            manifest[key] = entry = self._manifest_entry(htmlfile, self._manifest.get(key))
+            record = self._file_records.get(key)
+            if record is None or self._should_process_file(htmlfile, force, entry):
+                try:
+                    record = self._parse_file(htmlfile, lang_uid)
+                except Exception as e:
+                    print('An exception occured: {!s}'.format(htmlfile))
+                    raise
+                parsed += 1
+            elif self._manifest[key][:2] != entry[:2]:
+                # Only touched, the content is the same
+                record.set_dates(htmlfile)
+            records[key] = record
+        
+        if self._manifest:
+            build_logger.info('Parsed {} of {} files for "{}", {} removed'.format(
+                parsed, len(files), lang_uid, len(set(self._manifest) - set(manifest))))
+        self._manifest = manifest
+        self._file_records = records
+        self._assemble(lang_uid, files, records)
+
+    @staticmethod
+    def _manifest_entry(file, previous=None):
+        """ Return the (mtime_ns, size, md5) of file
+        
+        The content is only hashed when the modification time or size
+        differs from the previous entry.
+        
+        """
+        stat = file.stat()
+        if previous and previous[:2] == (stat.st_mtime_ns, stat.st_size):
+            return previous
+        with file.open('rb') as f:
+            md5 = hashlib.md5(f.read()).hexdigest()
+        return (stat.st_mtime_ns, stat.st_size, md5)
+    
+    def _parse_file(self, htmlfile, lang_uid):
+        """ Gather the information of one file, as a FileRecord
+        
+        The file is read in one streaming pass (see sc.textextract).
+        
+        """
+        logger.info('Adding file: {!s}'.format(htmlfile))
+        uid = htmlfile.stem
+        extract = extract_text(str(htmlfile), lang_uid, uid, self.is_bold, self.is_italic)
+        record = FileRecord(uid=uid, path=htmlfile.relative_to(sc.text_dir))
+        record.codepoints = extract.codepoints
+        record.prev_uid = extract.prev_uid
+        record.next_uid = extract.next_uid
+        record.author = extract.author
+        
+        if uid == 'metadata':
+            return self._metadata_record(record, htmlfile)
+        
+        if extract.metaarea_text is not None:
+            record.metaarea_author = self._guess_author(extract.metaarea_text)
+        
+        if extract.name_text is None:
+            logger.warn('Could not determine name for {}/{}'.format(lang_uid, uid))
+            record.name = ''
+        else:
+            record.name = self._clean_name(extract.name_text)
+        embedded = extract.embedded
+        volpages = self._format_volpages(lang_uid, [extract.volpage_id] +
+                                         [volpage_id for _, _, _, volpage_id in embedded])
+        record.volpage = volpages[0]
+        record.embedded = [(child_uid, bookmark, name, volpage)
+                           for (child_uid, bookmark, name, _), volpage
+                           in zip(embedded, volpages[1:])]
+        record.set_dates(htmlfile)
+        return record
+    
+    def _metadata_record(self, record, htmlfile):
+        # Only the author of a metadata file is used
+        if record.author is None:
+            raise ValueError('Metadata file {} does not define author'.format(record.path))
+        return record
+    
+    @staticmethod
+    def _guess_author(metadata_text):
+        """ Guess the author from the first sentence of the metaarea """
+        m = regex.match(r'.{,80}\.', metadata_text)
+        if not m:
+            m = regex.match(r'.{,80}(?=\s)', metadata_text)
+        if m:
+            return m[0]
+        return None
+    
+    def _assemble(self, lang_uid, files, records):
+        """ (Re)create the model of the language from the records of
+        files, in order """
+        self._by_lang = {}
+        self._by_uid = {}
+        self._metadata = {}
+        
+        codepoints = CodepointSet()
+        bold_codepoints = CodepointSet()
+        italic_codepoints = CodepointSet()
+        
         for i, htmlfile in enumerate(files):
-         try:
-            if not self._should_process_file(htmlfile, force):
-                continue
-            logger.info('Adding file: {!s}'.format(htmlfile))
-            uid = htmlfile.stem
-            root = html.parse(str(htmlfile)).getroot()
-            
-            #Set codepoint data
-            
-            _stack = [root]
-            while _stack:
-                e = _stack.pop()
-                if self.is_bold(lang_uid, e):
-                    bold_codepoints.update(e.text_content())
-                elif self.is_italic(lang_uid, e):
-                    italic_codepoints.update(e.text_content())
-                else:
-                    _stack.extend(e)
-            codepoints.update(root.text_content())                
+            record = records[str(htmlfile.relative_to(sc.text_dir))]
+            uid = record.uid
+            path = record.path
+            normal, bold, italic = record.codepoints
+            codepoints |= normal
+            bold_codepoints |= bold
+            italic_codepoints |= italic
             
             # Set the previous and next uids, using explicit data
             # if available, otherwise making a safe guess.
             # The safe guess relies on comparing uids, and will not
             # capture relationships such as the order of patimokha
             # rules.
-            prev_uid = root.get('data-prev')
-            next_uid = root.get('data-next')
+            prev_uid = record.prev_uid
+            next_uid = record.next_uid
             if not (prev_uid or next_uid):
                 if i > 0:
                     prev_uid = files[i - 1].stem
@@ -362,56 +916,42 @@ class TextInfoModel:
                     if not self.uids_are_related(uid, next_uid):
                         next_uid = None
             
-            path = htmlfile.relative_to(sc.text_dir)
-            author = self._get_author(root, lang_uid, uid)
+            author = record.author
             
             if uid == 'metadata':
-                if author is None:
-                    raise ValueError('Metadata file {} does not define author'.format(path))
-                self.add_metadata(path, author, root)
+                self.add_metadata(path, author)
                 continue
             
             if author is None:
-                metadata = self.get_metadata(path)
-                if metadata:
-                    author = metadata['author']
+                author = self.get_metadata_author(path)
             
             if author is None:
-                metadata = root.select_one('#metaarea')
-                if metadata:
-                    metadata_text = metadata.text_content()
-                    m = regex.match(r'.{,80}\.', metadata_text)
-                    if not m:
-                        m = regex.match(r'.{,80}(?=\s)', metadata_text)
-                    if m:
-                        author = m[0]
+                author = record.metaarea_author
                         
             if author is None:
                 logger.warn('Could not determine author for {}/{}'.format(lang_uid, uid))
                 author = ''
+            # The authors are shared by many texts
+            author = sys.intern(author)
             
-            name = self._get_name(root, lang_uid, uid)
-            volpage = self._get_volpage(root, lang_uid, uid)
-            embedded = self._get_embedded_uids(root, lang_uid, uid)
-            
-            fstat = htmlfile.stat()
-            cdate = self.datestr(fstat.st_ctime)
-            mdate = self.datestr(fstat.st_mtime)
+            name = record.name
+            volpage = record.volpage
 
             textinfo = TextInfo(uid=uid, lang=lang_uid, path=path, 
                                 name=name, author=author,
                                 volpage=volpage, prev_uid=prev_uid,
                                 next_uid=next_uid,
-                                cdate=cdate,
-                                mdate=mdate,
+                                cdate=record.cdate,
+                                mdate=record.mdate,
                                 file_uid=uid)
             self.add_text_info(lang_uid, uid, textinfo)
 
-            for child in embedded:
-                child.path = path
-                child.author = author
-                child.file_uid = uid
-                self.add_text_info(lang_uid, child.uid, child)
+            for child_uid, bookmark, child_name, child_volpage in record.embedded:
+                child = TextInfo(uid=child_uid, lang=lang_uid, path=path,
+                                 bookmark=bookmark, name=child_name,
+                                 author=author, volpage=child_volpage,
+                                 file_uid=uid)
+                self.add_text_info(lang_uid, child_uid, child)
 
             m = regex.match(r'(.*?)(\d+)-(\d+)$', uid)
             if m:
@@ -431,131 +971,55 @@ class TextInfoModel:
 
                     self.add_text_info(lang_uid, iuid, range_textinfo)
         
-         except Exception as e:
-             print('An exception occured: {!s}'.format(htmlfile))
-             raise
-        
-        self._codepoints[lang_uid] = {
+        self._codepoints = {lang_uid: {
             'normal': codepoints,
             'bold': bold_codepoints,
             'italic': italic_codepoints
-        }
-        
-        del self._ppn
+        }}
 
     def _on_n_files(self):
         return
-    def _should_process_file(self, file, force):
-        return True
+    def _should_process_file(self, file, force, entry=None):
+        """ Return True if file was added or changed since the model was
+        last built, according to the manifest """
+        if force:
+            return True
+        previous = self._manifest.get(str(file.relative_to(sc.text_dir)))
+        if previous is None:
+            return True
+        if entry is None:
+            entry = self._manifest_entry(file, previous)
+        return previous[2] != entry[2]
     
     # Class Variables
     _build_lock = threading.Lock()
     _build_ready = threading.Event()
     _instance = None
     
-    def _get_author(self, root, lang_uid, uid):
-        e = root.select_one('meta[author]')
-        if e:
-            return e.attrib['author']
-        
-        e = root.select_one('meta[data-author]')
-        if e:
-            return e.attrib['data-author']
-        e = root.select_one('meta[name=description]')
-        
-        if e:
-            return e.attrib['content']
-        
-        e = root.select_one('#metaarea > .author')
-        if e:
-            return e.text
-        return None
-
-    
-    def _get_name(self, root, lang_uid, uid):
-        try:
-            hgroup = root.select_one('.hgroup')
-            h1 = hgroup.select_one('h1')
-            return regex.sub(r'^\P{alpha}*', '', h1.text_content())
-        except Exception as e:
-            logger.warn('Could not determine name for {}/{}'.format(lang_uid, uid))
-            return ''
+    @staticmethod
+    def _clean_name(text):
+        return regex.sub(r'^\P{alpha}*', '', text)
     
-    def _get_volpage(self, element, lang_uid, uid):
+    def _format_volpage(self, lang_uid, anchor_id):
+        """ The volpage given by the id of a volpage anchor """
+        if anchor_id is None:
+            return None
         if lang_uid == 'zh':
-            e = element.next_in_order()
-            while e is not None:
-                if e.tag =='a' and e.select_one('.t, .t-linehead'):
-                    break
-                e = e.next_in_order()
-            else:
-                return
-            return 'T {}'.format(e.attrib['id'])
+            return 'T {}'.format(anchor_id)
         elif lang_uid == 'pi':
-            ppn = self.get_palipagenumbinator()
-            e = element.next_in_order()
-            while e:
-                if e.tag == 'a' and e.select_one('.ms'):
-                    return ppn.get_pts_ref_from_pid(e.attrib['id'])
-                e = e.next_in_order()
-
+            return self.get_palipagenumbinator().get_pts_ref_from_pid(anchor_id)
         return None
     
-    def _get_embedded_uids(self, root, lang_uid, uid):
-        # Generates possible uids that might be contained
-        # within this text.
-        out = []
-        
-        if '-pm' in uid:
-            # This is a patimokkha text
-            for h4 in root.select('h4'):
-                a = h4.select_one('a[id]')
-                if not a:
-                    continue
-                
-                volpage = self._get_volpage(h4, lang_uid, uid)
-                out.append(TextInfo(
-                    uid='{}#{}'.format(uid, a.attrib['id']),
-                    bookmark=a.attrib['id'],
-                    name=None,
-                    volpage=volpage))
-
-        data_uid_seen = set()
-        for e in root.select('[data-uid]'):
-            if e.tag in {'h1','h2','h3','h4','h5','h6'}:
-                heading = e.text_content()
-                add = e.select_one('.add')
-                if add and add.text_content() == heading:
-                    heading = '[' + heading + ']'
-            else:
-                heading = None
-            out.append(TextInfo(uid=e.get('data-uid'), name=heading, bookmark=e.get('id')))
-            data_uid_seen.add(e)
-        
-        for e in root.select('.embeddedparallel'):
-            if 'data-uid' in e.attrib:
-                if e in data_uid_seen:
-                    continue
-                # Explicit
-                new_uid = e.attrib['data-uid']
-            else:
-                # Implicit
-                new_uid = '{}#{}'.format(uid, e.attrib['id'])
-            out.append(TextInfo(
-                uid=new_uid,
-                bookmark = e.attrib['id']))
-
-        sections = root.select('section.sutta')
-        if len(sections) > 1:
-            for section in sections:
-                data_uid = section.attrib.get('data-uid')
-                id = section.attrib.get('id')
-                if data_uid:
-                    out.append(TextInfo(
-                        uid=data_uid,
-                        bookmark=id))
-        return out
-
+    def _format_volpages(self, lang_uid, anchor_ids):
+        """ The volpages given by the ids of volpage anchors, in order,
+        the pts refs of a Pali text are looked up together """
+        if lang_uid == 'pi':
+            pids = [anchor_id for anchor_id in anchor_ids if anchor_id is not None]
+            refs = iter(self.get_palipagenumbinator().get_pts_refs_from_pids(pids))
+            return [None if anchor_id is None else next(refs)
+                    for anchor_id in anchor_ids]
+        return [self._format_volpage(lang_uid, anchor_id) for anchor_id in anchor_ids]
+    
     @classmethod
     def build_once(cls, force_build):
         if cls._build_lock.acquire(blocking=False):
@@ -583,6 +1047,12 @@ class TextInfoModel:
 tim_manager = TIMManager()
 
 tim = tim_manager.get
+
+def generation():
+    """ Return the generation of the current TIM """
+    return tim().generation
+
+sc.generation.register_source('tim', generation)
     
 def build():
     tim_manager.load()
@@ -590,6 +1060,24 @@ def build():
 def ensure_up_to_date():
     tim_manager.load()
 
+_ppn = None
+_ppn_lock = threading.Lock()
+
+def get_palipagenumbinator():
+    """ Return the PaliPageNumbinator of the current pali_concord table
+    
+    It is shared, by TIM builds and requests, and only loaded again
+    when the table changes.
+    
+    """
+    global _ppn
+    from sc.csv_loader import get_table
+    key = get_table('pali_concord').key
+    with _ppn_lock:
+        if _ppn is None or _ppn.key != key:
+            _ppn = PaliPageNumbinator()
+        return _ppn
+
 class PaliPageNumbinator:
     msbook_to_ptsbook_mapping = {
         'a': 'AN',
@@ -625,17 +1113,95 @@ class PaliPageNumbinator:
         'y': 'Ya'}
 
     default_attempts = [0,-1,-2,-3,-4,-5,-6,-7,-8,-9,-10,-11,-12,-13,-14,-15,1,2,3,4,5]
+    
+    db_name_tmpl = 'pali-page-numbers_{hash}.pklz'
+    # Increment when the saved form changes.
+    version = 1
+    
     def __init__(self):
         self.load()
 
     def load(self):
-        from sc.csv_loader import table_reader
-
-        reader = table_reader('pali_concord')
-
-        mapping = {(msbook, int(msnum), edition): (book, page)
-                for msbook, msnum, edition, book, page in reader}
-        self.mapping = mapping
+        """ Load the index of the concordance, from the db folder if it
+        was saved there for the current table, otherwise from the table
+        
+        For each msbook the index is a sorted array of the msnums which
+        have a pts1 or pts2 page and parallel arrays of indexes into
+        the lists of book and page values, rather than a dict entry per
+        row, so it is small and quick to load.
+        
+        """
+        from sc.csv_loader import get_table
+        
+        table = get_table('pali_concord')
+        file = self.get_file(table.key)
+        data = None
+        if file.exists():
+            try:
+                data = sc.util.lz4_pickle_load(file)
+            except Exception as e:
+                logger.exception('Failed to load {!s}'.format(file))
+        if data is None:
+            data = self.build_index(table.rows())
+            try:
+                self.save(file, data)
+            except OSError as e:
+                logger.exception('Failed to save {!s}'.format(file))
+        self.key = table.key
+        self.books, self.pages, self.index = data
+    
+    @classmethod
+    def get_file(cls, key):
+        md5 = hashlib.md5(str((key, cls.version)).encode('ascii'))
+        return sc.db_dir / cls.db_name_tmpl.format(hash=md5.hexdigest()[:10])
+    
+    @classmethod
+    def save(cls, file, data):
+        """ Save the index in file, removing any index saved for an
+        earlier table """
+        file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = file.with_suffix('.tmp{}'.format(os.getpid()))
+        sc.util.lz4_pickle_dump(data, tmp_file)
+        tmp_file.rename(file)
+        for old_file in file.parent.glob(cls.db_name_tmpl.format(hash='*')):
+            if old_file != file:
+                old_file.unlink()
+    
+    @staticmethod
+    def build_index(rows):
+        """ Return the (books, pages, index) of the rows of the table
+        
+        index is a dict of msbook: (msnums, book indexes, page indexes),
+        when an msnum has both a pts1 and a pts2 page pts1 is used.
+        
+        """
+        books = []
+        pages = []
+        book_index = {}
+        page_index = {}
+        entries = {}
+        for msbook, msnum, edition, book, page in rows:
+            if edition not in {'pts1', 'pts2'}:
+                continue
+            by_num = entries.setdefault(msbook, {})
+            msnum = int(msnum)
+            if edition == 'pts2' and by_num.get(msnum, ('',))[0] == 'pts1':
+                continue
+            if book not in book_index:
+                book_index[book] = len(books)
+                books.append(book)
+            if page not in page_index:
+                page_index[page] = len(pages)
+                pages.append(page)
+            by_num[msnum] = (edition, book_index[book], page_index[page])
+        
+        index = {}
+        for msbook, by_num in entries.items():
+            msnums = sorted(by_num)
+            index[msbook] = (array('L', msnums),
+                             array('L', (by_num[n][1] for n in msnums)),
+                             array('L', (by_num[n][2] for n in msnums)))
+        return books, pages, index
 
     def msbook_to_ptsbook(self, msbook):
         m = regex.match(r'\d+([A-Za-z]+(?:(?<=th)[12])?)', msbook)
@@ -647,26 +1213,60 @@ class PaliPageNumbinator:
         msbook = m[1].lower()
         msnum = int(m[2])
         return self.get_pts_ref(msbook, msnum)
+    
+    def get_pts_refs_from_pids(self, pids):
+        """ Return the pts refs of the paragraph ids pids, in order
         
+        The entries of each msbook are only looked up once, so this is
+        quicker than calling get_pts_ref_from_pid for each of the
+        paragraph ids of a file.
+        
+        """
+        entries = {}
+        refs = []
+        for pid in pids:
+            m = regex.match(r'p_(\w+)_(\d+)', pid)
+            msbook = m[1].lower()
+            if msbook not in entries:
+                entries[msbook] = self.index.get(msbook)
+            refs.append(self._lookup(msbook, entries[msbook], int(m[2])))
+        return refs
         
     def get_pts_ref(self, msbook, msnum, attempts=None):
-        if not attempts:
-            attempts = self.default_attempts
+        entry = self.index.get(msbook)
+        if not attempts or attempts == self.default_attempts:
+            return self._lookup(msbook, entry, msnum)
+        if entry is None:
+            return None
+        msnums = entry[0]
         for i in attempts:
             n = msnum + i
             if n < 1:
                 continue
-            key1 = (msbook, n, 'pts1')
-            key2 = (msbook, n, 'pts2')
-            key = None
-            if key1 in self.mapping:
-                key = key1
-            elif key2 in self.mapping:
-                key = key2
-            if key:
-                book, num = self.mapping[key]
-                ptsbook = self.msbook_to_ptsbook(msbook)
-                return self.format_book(ptsbook, book, num)
+            pos = bisect.bisect_left(msnums, n)
+            if pos < len(msnums) and msnums[pos] == n:
+                return self._format_entry(msbook, entry, pos)
+    
+    def _lookup(self, msbook, entry, msnum):
+        """ The default attempts, which try msnum, then the nearest
+        msnum up to 15 before it, then the nearest up to 5 after it """
+        if entry is None:
+            return None
+        msnums = entry[0]
+        pos = bisect.bisect_right(msnums, msnum)
+        if pos > 0 and msnums[pos - 1] >= max(msnum - 15, 1):
+            return self._format_entry(msbook, entry, pos - 1)
+        # msnums below 1 are never tried
+        pos = max(pos, bisect.bisect_left(msnums, 1))
+        if pos < len(msnums) and msnums[pos] <= msnum + 5:
+            return self._format_entry(msbook, entry, pos)
+        return None
+    
+    def _format_entry(self, msbook, entry, pos):
+        _, book_indexes, page_indexes = entry
+        ptsbook = self.msbook_to_ptsbook(msbook)
+        return self.format_book(ptsbook, self.books[book_indexes[pos]],
+                                self.pages[page_indexes[pos]])
 
     def format_book(self, ptsbook, book, num):
         if not book:
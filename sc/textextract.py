@@ -0,0 +1,321 @@
+"""Streaming extraction of the information the TIM needs from a text.
+
+Parsing a text into a full element tree and then searching it with CSS
+selectors is the slowest part of building the TIM. Almost everything
+needed is in the head, the metaarea and a few headings and anchors, so
+here the file is read in one pass by lxml's HTML parser with a parser
+target, which is given the start and end of each element and the text
+as they are parsed, so no tree is built at all. The text of the few
+elements whose text content is needed is captured as it streams by, as
+are the codepoints.
+
+Example:
+    >>> extract = extract_text('text/en/dn/dn1.html', 'en', 'dn1',
+    ...                        tim.is_bold, tim.is_italic)
+    >>> extract.name_text, extract.author
+    ('1. Brahmajāla: ...', ...)
+
+The result is the same as that of parsing the whole document, which
+tasks/textdata.py benchmark_extraction compares it with.
+"""
+
+from collections import namedtuple
+
+from lxml import etree
+
+from sc.codepoints import CodepointSet
+
+# The classes of the anchors which give the volpage of a text
+volpage_classes = {
+    'zh': {'t', 't-linehead'},
+    'pi': {'ms'},
+}
+
+_headings = frozenset({'h1', 'h2', 'h3', 'h4', 'h5', 'h6'})
+
+# What is_bold and is_italic are given, they only look at the tag.
+_Tag = namedtuple('_Tag', 'tag')
+
+# Distinguishes "not found" from a value of None
+_missing = object()
+
+
+class TextExtract:
+    """ The information extracted from one text """
+
+    __slots__ = ('prev_uid', 'next_uid', 'meta_author', 'meta_data_author',
+                 'meta_description', 'metaarea_author', 'metaarea_text',
+                 'name_text', 'volpage_id', 'pm_headings', 'data_uids',
+                 'embedded_parallels', 'sections', 'section_count',
+                 'codepoints')
+
+    def __init__(self):
+        self.prev_uid = None
+        self.next_uid = None
+        self.meta_author = _missing
+        self.meta_data_author = _missing
+        self.meta_description = _missing
+        self.metaarea_author = _missing
+        self.metaarea_text = None
+        self.name_text = None
+        self.volpage_id = None
+        # Lists of [uid, bookmark, name, volpage_id]
+        self.pm_headings = []
+        self.data_uids = []
+        self.embedded_parallels = []
+        self.sections = []
+        self.section_count = 0
+        # The normal, bold and italic CodepointSets
+        self.codepoints = None
+
+    @property
+    def author(self):
+        """ The author, as TextInfoModel._get_author """
+        for author in (self.meta_author, self.meta_data_author,
+                       self.meta_description, self.metaarea_author):
+            if author is not _missing:
+                return author
+        return None
+
+    @property
+    def embedded(self):
+        """ The (uid, bookmark, name, volpage_id) of the texts embedded
+        in this text, as TextInfoModel._get_embedded_uids """
+        out = [entry for entry in self.pm_headings if entry[0] is not None]
+        out.extend(self.data_uids)
+        out.extend(self.embedded_parallels)
+        if self.section_count > 1:
+            out.extend(self.sections)
+        return [tuple(entry) for entry in out]
+
+
+class _Capture:
+    """ Captures the text content of an element """
+
+    __slots__ = ('depth', 'parts', 'callback')
+
+    def __init__(self, depth, callback):
+        self.depth = depth
+        self.parts = []
+        self.callback = callback
+
+
+class _ExtractTarget:
+    """ The parser target which fills in a TextExtract """
+
+    def __init__(self, lang_uid, uid, is_bold, is_italic):
+        self.out = TextExtract()
+        self.lang_uid = lang_uid
+        self.uid = uid
+        self.is_bold = is_bold
+        self.is_italic = is_italic
+        self.anchor_classes = volpage_classes.get(lang_uid)
+        self.patimokkha = '-pm' in uid
+        # The entries waiting for the next volpage anchor, the first is
+        # that of the text itself.
+        self.text_entry = [uid, None, None, None]
+        self.pending_volpage = [self.text_entry] if self.anchor_classes else []
+        # The (style, id) of each open element
+        self.stack = []
+        self.styles = {}
+        # The text of each style, joined when done
+        self.parts = {None: [], 'bold': [], 'italic': []}
+        # The open captures, innermost last
+        self.captures = []
+        # The capture of the text of a metaarea author, which ends when
+        # its first child starts
+        self.author_capture = None
+        self.seen_metaarea = False
+        self.seen_hgroup = False
+        # The depth of the first hgroup while it is open
+        self.hgroup_depth = None
+        # The (depth, state) of the open data-uid headings
+        self.headings = []
+        # The depth, id and whether it is a volpage anchor of the open
+        # anchor
+        self.anchor_depth = None
+        self.anchor_id = None
+        self.anchor_matches = False
+        # The depth and entry of the open patimokkha heading
+        self.pm_depth = None
+        self.pm_entry = None
+
+    def _style(self, tag):
+        try:
+            return self.styles[tag]
+        except KeyError:
+            element = _Tag(tag)
+            if self.is_bold(self.lang_uid, element):
+                style = 'bold'
+            elif self.is_italic(self.lang_uid, element):
+                style = 'italic'
+            else:
+                style = None
+            self.styles[tag] = style
+            return style
+
+    def _capture(self, callback):
+        capture = _Capture(len(self.stack) - 1, callback)
+        self.captures.append(capture)
+        return capture
+
+    def _end_author_capture(self):
+        capture = self.author_capture
+        self.author_capture = None
+        self.captures.remove(capture)
+        self.out.metaarea_author = ''.join(capture.parts) or None
+
+    def start(self, tag, attrib):
+        out = self.out
+        stack = self.stack
+        if stack:
+            parent_style, parent_id = stack[-1]
+        else:
+            parent_style = parent_id = None
+            out.prev_uid = attrib.get('data-prev')
+            out.next_uid = attrib.get('data-next')
+        # Most elements have no attributes, the (empty) mapping given
+        # for them is slow to query.
+        element_id = attrib.get('id') if attrib else None
+        stack.append((parent_style or self._style(tag), element_id))
+        depth = len(stack) - 1
+
+        if self.author_capture is not None:
+            # Only the text before the first child is wanted
+            self._end_author_capture()
+
+        if tag == 'a':
+            self.anchor_depth = depth
+            self.anchor_id = element_id
+            self.anchor_matches = False
+            pm_entry = self.pm_entry
+            if pm_entry is not None and pm_entry[0] is None and element_id is not None:
+                pm_entry[0] = '{}#{}'.format(self.uid, element_id)
+                pm_entry[1] = element_id
+        elif tag == 'h1':
+            if self.hgroup_depth is not None and out.name_text is None:
+                def set_name(capture):
+                    if out.name_text is None:
+                        out.name_text = ''.join(capture.parts)
+                self._capture(set_name)
+        elif tag == 'h4':
+            if self.patimokkha:
+                entry = [None, None, None, None]
+                out.pm_headings.append(entry)
+                if self.anchor_classes:
+                    self.pending_volpage.append(entry)
+                self.pm_depth = depth
+                self.pm_entry = entry
+
+        if attrib:
+            self._start_attributes(tag, attrib, element_id, parent_id, depth)
+
+    def _start_attributes(self, tag, attrib, element_id, parent_id, depth):
+        out = self.out
+        classes = attrib['class'].split() if 'class' in attrib else ()
+        if tag == 'meta':
+            if 'author' in attrib and out.meta_author is _missing:
+                out.meta_author = attrib['author']
+            if 'data-author' in attrib and out.meta_data_author is _missing:
+                out.meta_data_author = attrib['data-author']
+            if attrib.get('name') == 'description' and out.meta_description is _missing:
+                out.meta_description = attrib['content']
+        if (self.anchor_depth is not None and self.anchor_classes
+                and self.anchor_classes.intersection(classes)):
+            self.anchor_matches = True
+
+        if element_id == 'metaarea' and not self.seen_metaarea:
+            self.seen_metaarea = True
+            self._capture(lambda capture: setattr(out, 'metaarea_text', ''.join(capture.parts)))
+        if classes:
+            if 'author' in classes and parent_id == 'metaarea' and out.metaarea_author is _missing:
+                self.author_capture = self._capture(None)
+            if 'hgroup' in classes and not self.seen_hgroup:
+                self.seen_hgroup = True
+                self.hgroup_depth = depth
+
+        if 'data-uid' in attrib:
+            entry = [attrib['data-uid'], element_id, None, None]
+            out.data_uids.append(entry)
+            if tag in _headings:
+                self._capture_heading(entry)
+        elif 'embeddedparallel' in classes:
+            entry_uid = '{}#{}'.format(self.uid, attrib['id'])
+            out.embedded_parallels.append([entry_uid, attrib['id'], None, None])
+        if 'add' in classes:
+            for _, state in self.headings:
+                if not state['add_started']:
+                    state['add_started'] = True
+                    self._capture(lambda capture, state=state:
+                                  state.__setitem__('add', ''.join(capture.parts)))
+        if tag == 'section' and 'sutta' in classes:
+            out.section_count += 1
+            data_uid = attrib.get('data-uid')
+            if data_uid:
+                out.sections.append([data_uid, element_id, None, None])
+
+    def _capture_heading(self, entry):
+        """ The name of a heading is its text, in brackets if all of it
+        is in its first .add element """
+        state = {'add': None, 'add_started': False}
+
+        def set_name(capture):
+            name = ''.join(capture.parts)
+            if state['add'] == name:
+                name = '[' + name + ']'
+            entry[2] = name
+        self._capture(set_name)
+        self.headings.append((len(self.stack) - 1, state))
+
+    def data(self, text):
+        self.parts[self.stack[-1][0] if self.stack else None].append(text)
+        for capture in self.captures:
+            capture.parts.append(text)
+
+    def end(self, tag):
+        depth = len(self.stack) - 1
+        self.stack.pop()
+        if self.author_capture is not None and self.author_capture.depth == depth:
+            self._end_author_capture()
+        # Inner captures end first, so the .add of a heading is known
+        # when the heading ends.
+        while self.captures and self.captures[-1].depth == depth:
+            capture = self.captures.pop()
+            capture.callback(capture)
+        if self.headings and self.headings[-1][0] == depth:
+            self.headings.pop()
+        if depth == self.hgroup_depth:
+            self.hgroup_depth = None
+        if depth == self.anchor_depth:
+            if self.anchor_matches and self.pending_volpage:
+                if self.anchor_id is None:
+                    raise KeyError('id')
+                for entry in self.pending_volpage:
+                    entry[3] = self.anchor_id
+                self.pending_volpage.clear()
+            self.anchor_depth = None
+        if depth == self.pm_depth:
+            self.pm_depth = None
+            self.pm_entry = None
+
+    def close(self):
+        out = self.out
+        out.volpage_id = self.text_entry[3]
+        bold = CodepointSet(''.join(self.parts['bold']))
+        italic = CodepointSet(''.join(self.parts['italic']))
+        normal = CodepointSet(''.join(self.parts[None])) | bold | italic
+        out.codepoints = (normal, bold, italic)
+        return out
+
+
+def extract_text(filename, lang_uid, uid, is_bold, is_italic):
+    """ Extract the information the TIM needs from the text in filename
+
+    is_bold and is_italic are called with lang_uid and an object with
+    the tag of each element, when they return True the text of the
+    element (and its descendants) is counted as bold or italic.
+
+    """
+    target = _ExtractTarget(lang_uid, uid, is_bold, is_italic)
+    parser = etree.HTMLParser(target=target, encoding='utf-8')
+    return etree.parse(filename, parser)
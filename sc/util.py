@@ -207,6 +207,60 @@ class ConciseRepr:
         return '{}({} {})'.format(
             type(value).__qualname__, len(value), typestring)
 
+class PrefixIndex:
+    """ A trie for finding the longest key which is a prefix of a string
+
+    Used to find the container an uid belongs to, i.e. the subdivision
+    'dn' for the sutta 'dn1', without repeatedly slicing the uid and
+    probing dicts.
+
+    >>> index = PrefixIndex({'sn': 'SN', 'sn1': 'SN 1'})
+    >>> index.longest_prefix('sn12')
+    ('sn1', 'SN 1')
+    >>> index.get('sn22')
+    'SN'
+    >>> index.get('an1') is None
+    True
+
+    """
+
+    __slots__ = ('_root',)
+    # The key for values in trie nodes, can't collide with a character.
+    _value_key = None
+
+    def __init__(self, mapping=None):
+        self._root = {}
+        if mapping:
+            for key, value in mapping.items():
+                self[key] = value
+
+    def __setitem__(self, key, value):
+        node = self._root
+        for char in key:
+            node = node.setdefault(char, {})
+        node[self._value_key] = (key, value)
+
+    def longest_prefix(self, string):
+        """ Return (key, value) for the longest key which is a prefix of
+        string, or None if there is no such key """
+        node = self._root
+        found = node.get(self._value_key)
+        for char in string:
+            try:
+                node = node[char]
+            except KeyError:
+                break
+            found = node.get(self._value_key, found)
+        return found
+
+    def get(self, string, default=None):
+        """ Return the value for the longest key which is a prefix of
+        string """
+        found = self.longest_prefix(string)
+        if found is None:
+            return default
+        return found[1]
+
 def recursive_merge(dict1, dict2):
     """ Merge dict2 into dict1
 
@@ -15,11 +15,13 @@ from uuid import uuid4
 from webassets.ext.jinja2 import AssetsExtension
 
 import sc
-from sc import assets, config, data_repo, scimm, util
+from sc import (assets, build_stats, config, data_repo, page_transforms, scimm,
+                template_cache, text_extracts, util)
 from sc.menu import get_menu
 from sc.scm import scm, data_scm
 from sc.classes import Parallel, Sutta
-from sc.textfunctions import cjk_regex
+from sc.generation import GenerationCache
+from sc.render_cache import render_cache, placeholder
 import sc.search.query
 import sc.search.discourse
 import sc.search.autocomplete
@@ -46,7 +48,8 @@ def jinja2_environment(rebuild=False):
 
 def build_jinja2_environment():
     env = jinja2.Environment(
-        loader=jinja2.FileSystemLoader(str(sc.templates_dir)),
+        loader=template_cache.get_loader(),
+        bytecode_cache=template_cache.get_bytecode_cache(),
         extensions=[AssetsExtension],
         trim_blocks=True,
         lstrip_blocks=True,
@@ -111,6 +114,13 @@ class NewRelicBrowserTimingProxy:
         else:
             return ''
 
+class NewRelicBrowserTimingPlaceholders:
+    """The placeholders of the New Relic scripts in a cached page, they
+    are filled in each time it is sent (see sc.render_cache)."""
+    
+    header = placeholder('newrelic_header')
+    footer = placeholder('newrelic_footer')
+
 class ViewContext(dict):
     """A dictionary with easy object-style setters/getters.
 
@@ -205,33 +215,73 @@ class ViewBase:
         return ViewContext(params)
 
     def massage_whitespace(self, text):
-        return regex.sub(r'\n[ \n\t]+', r'\n', text)
-    
-    cjk_tag_rex = regex.compile(r'<(td[^>]*)>([^>]*' + cjk_regex.pattern.strip('()+') + '[^>]*)</(td)>')
-    tib_tag_rex = regex.compile(r'<(td[^>]*)>([^>]*' + '[\u0F00-\u0FFF]' + '[^>]*)</(td)>')
+        return page_transforms.massage_whitespace(text)
     
     def add_lang_tags(self, string):
-        def subfn_cjk(m):
-            if 'lang' in m[1]:
-                return m[0]
-            return r'<{m[1]} lang="lzh">{m[2]}</{m[3]}>'.format(m=m)
+        return page_transforms.add_lang_tags(string)
+    
+    def get_fragments(self, context):
+        """Return the prepared fragments of the context (see
+        sc.page_transforms), by the name of their context variable.
+        
+        Views whose pages are mostly some static HTML, such as a text,
+        override this so that it isn't transformed again on every
+        render.
+        """
+        return {}
+    
+    _panel_cache = GenerationCache('panel_html', depends='imm')
+    
+    def panel_html(self):
+        return self._panel_cache.get('panel',
+            lambda: GenericView('panel', {}).render())
+    
+    def render_cache_key(self):
+        """Return a key identifying the page, or None if it isn't cached.
         
-        def subfn_tib(m):
-          if 'lang' in m[1]:
-            return m[0]
-          return r'<{m[1]} lang="bo">{m[2]}</{m[3]}>'.format(m=m)
+        Views whose page only depends on the key, the IMM and the TIM
+        override this so that their pages are cached (see
+        sc.render_cache) and can be revalidated with ETag and
+        Last-Modified.
+        """
+        return None
+    
+    def live_parts(self):
+        """Return the parts of the page which change on their own, by the
+        name of their context variable, as functions returning their html.
         
-        string = self.cjk_tag_rex.sub(subfn_cjk, string)
-        string = self.tib_tag_rex.sub(subfn_tib, string)
-        return string
+        A cached page holds a placeholder for each of them instead, which
+        is filled in each time it is sent.
+        """
+        return {}
     
-    def panel_html(self, _cache=[]):
-        if not _cache:
-            _cache.append(GenericView('panel', {}).render())
-        return _cache[0]
+    def _render_cache_key(self):
+        key = self.render_cache_key()
+        if key is None:
+            return None
+        params = cherrypy.request.params
+        offline = getattr(cherrypy.request, 'offline', True)
+        return (type(self).__name__, key, 'embed' in params, 'ajax' in params, offline)
     
     def render(self):
         """Return the HTML for this view."""
+        key = self._render_cache_key()
+        if key is None:
+            return self.render_page()
+        # The generations of the models are those the page is rendered
+        # with, even if they change while it is.
+        key = render_cache.full_key(key)
+        page = render_cache.get(key)
+        if page is None:
+            page = render_cache.put(key, self.render_page(cached=True))
+        timing = NewRelicBrowserTimingProxy()
+        return page.send(self.live_parts(),
+                         {'newrelic_header': lambda: timing.header,
+                          'newrelic_footer': lambda: timing.footer})
+    
+    def render_page(self, cached=False):
+        """Render the template of this view, with placeholders for the
+        live parts if it is to be cached."""
         try:
             template = self.get_template()
         except jinja2.exceptions.TemplateSyntaxError as e:
@@ -246,12 +296,14 @@ class ViewBase:
             raise cherrypy.HTTPError(500, message)
         context = self.get_global_context()
         self.setup_context(context)
-        string = template.render(dict(context))
-        if self.should_fix_whitespace:
-            string = self.massage_whitespace(string)
-        if self.should_add_lang_tags:
-          string = self.add_lang_tags(string)
-        return string
+        for name, part in self.live_parts().items():
+            context[name] = placeholder(name) if cached else part()
+        if cached:
+            context.newrelic_browser_timing = NewRelicBrowserTimingPlaceholders
+        return page_transforms.render_with_fragments(template.render,
+            dict(context), self.get_fragments(context),
+            fix_whitespace=self.should_fix_whitespace,
+            lang_tags=self.should_add_lang_tags)
 """
 ['__cause__', '__class__', '__context__', '__delattr__', '__dict__',
 '__dir__', '__doc__', '__eq__', '__format__', '__ge__', '__getattribute__',
@@ -340,6 +392,9 @@ class ParallelView(ViewBase):
     def __init__(self, sutta):
         self.sutta = sutta
 
+    def render_cache_key(self):
+        return self.sutta.uid
+
     def setup_context(self, context):
         context.title = "{}: {}".format(
             self.sutta.acronym, self.sutta.name)
@@ -398,26 +453,43 @@ class TextView(ViewBase):
 
     template_name = 'text'
 
-    # Extract the (non-nestable) hgroup element using regex, DOTALL
-    # and non-greedy matching makes this straightforward.
-    content_regex = regex.compile(r'''
-        <body[^>]*>
-        (?<content>.*)
-        </body>
-        ''', flags=regex.DOTALL | regex.VERBOSE)
+    # Extract the contents of the body using regex
+    content_regex = text_extracts.content_regex
     
     # Note: Links come after section
     links_regex = regex.compile(r'class="(?:next|previous)"')
     
+    # The extract of the text, set by setup_context
+    extract = None
+    
     def __init__(self, uid, lang_code, canonical=True):
         self.uid = uid
         self.lang_code = lang_code
         self.canonical = canonical
 
+    def render_cache_key(self):
+        path = self.path
+        if not path:
+            return None
+        try:
+            mtime = path.stat().st_mtime_ns
+        except OSError:
+            return None
+        return (self.uid, self.lang_code, self.canonical, str(path), mtime)
+
     def setup_context(self, context):
         from sc.tools import html
-        m = self.content_regex.search(self.get_html())
-        m.detach_string() # Free up memory now.
+        # The text and snippet are extracted when the TIM is built,
+        # the file is only read if they aren't up to date.
+        extract = text_extracts.get_store().get(self.path) if self.path else None
+        self.extract = extract
+        if extract:
+            # The text as it is shown, which an embedded page is cut from
+            text = ''.join(extract.fragment)
+        else:
+            m = self.content_regex.search(self.get_html())
+            m.detach_string() # Free up memory now.
+            text = m['content']
         imm = scimm.imm()
 
         context.uid = self.uid
@@ -427,38 +499,31 @@ class TextView(ViewBase):
         context.canonical = self.canonical
         
         context.textdata = textdata = imm.get_text_data(self.uid, self.lang_code)
-        context.title = textdata.name if textdata else '?'
-        context.text = m['content']
+        if textdata:
+            context.title = textdata.name
+        else:
+            context.title = extract.title if extract else '?'
+        context.text = text
         
         if self.lang_code in imm.font_data['css_font_class']:
             context.font_class = imm.font_data['css_font_class'][self.lang_code]
         
-        context.discourse_link = None
-        context.discourse_results = None
-        if (self.uid in imm.suttas and 
-                sc.config.discourse['forum_url'] and
-                self.lang_code == 'en' or imm.languages[self.lang_code].isroot):
-            sutta = imm.suttas
-            query = '%22{}%22|{}'.format(uid_to_acro(self.uid).replace(' ', ' '), self.uid)
-            context.discourse_link = '{}?search={}'.format(sc.config.discourse['forum_url'], query)
-            context.discourse_url = sc.config.discourse['forum_url']
-            try:
-                context.discourse_results = sc.search.discourse.search(self.uid)
-            except:
-                logger.exception('Failed to retrieve discourse_results')
-                
         if context.embed:
             context.text = self.shorter_text(context.text)
         context.has_quotes = '‘' in context.text or '“' in context.text
-        try:
-            context.snippet = self.get_snippet(context.text)
-        except Exception as e:
-            logger.error('Failed to generated snippet for {} ({})'.format(self.uid, str(e)))
-            context.snippet = ''
+        if extract and not context.embed:
+            context.snippet = extract.snippet
+        else:
+            try:
+                context.snippet = self.get_snippet(context.text)
+            except Exception as e:
+                logger.error('Failed to generated snippet for {} ({})'.format(self.uid, str(e)))
+                context.snippet = ''
         # Eliminate newlines from Full-width-glyph languages like Chinese
         # because they convert into spaces when rendered.
         # TODO: This check should use 'language' table
-        if self.lang_code in {'zh', 'lzh', 'ko', 'jp'}:
+        # The text of an extract was when it was prepared.
+        if self.lang_code in page_transforms.cjk_lang_codes and not extract:
             context.text = self.massage_cjk(context.text)
         context.lang_code = self.lang_code
         
@@ -477,6 +542,30 @@ class TextView(ViewBase):
         context.prev_data = nextprev['prev']
         context.exports['uid'] = self.uid
         context.exports['lang'] = self.lang_code
+    
+    def live_parts(self):
+        return {'discourse_wrapper': self.discourse_wrapper}
+    
+    def discourse_wrapper(self):
+        """The element the sidebar loads the discussions of the text on
+        the forum into, if there are any."""
+        imm = scimm.imm()
+        if (self.uid in imm.suttas and
+                sc.config.discourse['forum_url'] and
+                (self.lang_code == 'en' or imm.languages[self.lang_code].isroot)):
+            try:
+                if sc.search.discourse.search(self.uid):
+                    return '<div id="discourse-results-wrapper">\n</div>'
+            except:
+                logger.exception('Failed to retrieve discourse_results')
+        return ''
+    
+    def get_fragments(self, context):
+        # The fragment is prepared from the text as it is shown when
+        # it isn't embedded.
+        if self.extract and not context.embed:
+            return {'text': self.extract.fragment}
+        return {}
         
     def shorter_text(self, html, target_len=2500):
         # Don't bother cutting off excessively short amount of text
@@ -505,25 +594,7 @@ class TextView(ViewBase):
         return sc.tools.html.tostring(root, encoding='unicode')
     
     def get_snippet(self, html, target_len=500):
-        root = sc.tools.html.fromstring(html[:target_len + 2000])
-        for e in root.cssselect('.hgroup'):
-            e.drop_tree()
-        article = root.cssselect('article')[0]
-        parts = []
-        total_len = 0
-        for e in article:
-            if e.tag not in {'p', 'blockquote'}:
-                continue
-            text = e.text_content()
-            parts.append(text)
-            total_len += len(text)
-            if total_len > target_len:
-                break
-
-        text = '   '.join(parts)
-        if len(text) > target_len:
-            text = text[:target_len] + ' …'
-        return text
+        return text_extracts.get_snippet(html, target_len)
         
     @property
     def path(self):
@@ -540,18 +611,7 @@ class TextView(ViewBase):
         else:
             raise cherrypy.NotFound()
     
-    @staticmethod
-    def massage_cjk(text, lang_code='lzh'):
-        def deline(string):
-            return string.replace('\n', '').replace('<p', '\n<p')
-        
-        m = regex.match(r'(?s)(.*?)(<aside[^>]+id="metaarea".*?</aside>)(.*)', text)
-        if m or not m:
-            pre, meta, post = m[1:]
-            
-            meta = cjk_regex.sub(r'<span lang="{}">\1</span>'.format(lang_code), meta)
-            return ''.join([deline(pre), meta, deline(post)])
-        return deline(text)
+    massage_cjk = staticmethod(page_transforms.massage_cjk)
 
 class TextRawView(TextView):
     def setup_context(self):
@@ -561,6 +621,10 @@ class TextRawView(TextView):
 
 class EditView(TextView):
     template_name = 'editor'
+    def render_cache_key(self):
+        return None
+    def live_parts(self):
+        return {}
     def setup_context(self, context):
         context.filename = self.path
         return
@@ -573,6 +637,12 @@ class TextSelectionView(TextView):
         self.lang_code = lang_code
         self.targets = targets
 
+    def render_cache_key(self):
+        return None
+
+    def live_parts(self):
+        return {}
+
     def setup_context(self, context):
         context.selection = self.extract_selection()
     
@@ -667,6 +737,9 @@ class DivisionView(ViewBase):
     def __init__(self, division):
         self.division = division
 
+    def render_cache_key(self):
+        return self.division.uid
+
     def setup_context(self, context):
         context.title = "{}: {}".format(self.division.acronym,
             self.division.name)
@@ -692,6 +765,9 @@ class SubdivisionView(ViewBase):
 
     template_name = 'subdivision'
 
+    def render_cache_key(self):
+        return self.subdivision.uid
+
     def setup_context(self, context):
         context.title = "{} {}: {} - {}".format(
             self.subdivision.division.acronym, self.subdivision.acronym,
@@ -950,6 +1026,7 @@ class AdminIndexView(InfoView):
         context.data_last_update_request = data_repo.last_update()
         context.data_scm = data_scm
         context.imm_build_time = scimm.imm().build_time
+        context.builds = list(reversed(build_stats.recent()))
 
 class UidsView(InfoView):
     
@@ -22,3 +22,52 @@ def compile(precompress=False):
     assets.compile()
     if precompress:
         assets.compress_static()
+
+
+@task
+def compile_templates():
+    """Precompile the Jinja2 templates to the template bundle."""
+    blurb(compile_templates)
+    from sc import template_cache
+    from sc.views import jinja2_environment
+    count = template_cache.precompile(jinja2_environment())
+    notice('{} templates compiled to {}'.format(count, template_cache.bundle_dir))
+
+
+@task
+def benchmark_templates():
+    """Time loading every template in a new process.
+    
+    Without caches, with the bytecode cache (once it has been filled)
+    and from the template bundle, which is compiled first.
+    """
+    blurb(benchmark_templates)
+    from sc import template_cache
+    from sc.views import jinja2_environment
+    template_cache.precompile(jinja2_environment())
+    run_benchmark = ('from tasks.assets import _benchmark_templates; '
+                     '_benchmark_templates({!r})')
+    for mode in ('source', 'bytecode', 'bytecode', 'bundle'):
+        run('python -c "{}"'.format(run_benchmark.format(mode)), fg=True)
+
+def _benchmark_templates(mode):
+    import time
+    import jinja2
+    import sc
+    from sc.views import build_jinja2_environment
+    env = build_jinja2_environment()
+    if mode != 'bundle':
+        env.loader = jinja2.FileSystemLoader(str(sc.templates_dir))
+    if mode == 'source':
+        env.bytecode_cache = None
+    names = [name for name in env.list_templates()
+             if name.endswith(('.html', '.txt'))]
+    start = time.perf_counter()
+    for name in names:
+        try:
+            env.get_template(name)
+        except jinja2.TemplateError:
+            pass
+    seconds = time.perf_counter() - start
+    notice('{}: {} templates loaded in {:.0f} ms'.format(
+        mode, len(names), seconds * 1000))
@@ -15,20 +15,23 @@ def clean(older=False):
 
 
 @task
-def create(host='localhost:8800', basestem='sc-offline', force=False, quiet=False, wait=None, omit=None):
-    """Create an offline SuttaCentral export."""
+def create(basestem='sc-offline', force=False, quiet=False, omit=None, processes=None):
+    """Create an offline SuttaCentral export.
+    
+    The pages are rendered in process, no server needs to be running.
+    """
     blurb(create)
     command = 'utility/export/offline.py'
     if force:
         command += ' --force'
     if quiet:
         command += ' --quiet'
-    if wait:
-        command += ' --wait={}'.format(wait)
     if omit:
         command += ' --omit={}'.format(omit)
+    if processes:
+        command += ' --processes={}'.format(processes)
     
-    command += ' {} {}'.format(host, basestem)
+    command += ' {}'.format(basestem)
     run(command)
 
 
@@ -41,6 +44,5 @@ def create_dev():
 @task
 def create_production():
     """Create an offline SuttaCentral export for the production environment."""
-    create(host='suttacentral.net', quiet=True, wait=0.15)
-    #create(host='suttacentral.net', quiet=True, wait=0.15,
-        #basestem='sc-offline-en', omit='de,es,fr,it,ko,ru,my,vn')
+    create(quiet=True)
+    #create(quiet=True, basestem='sc-offline-en', omit='de,es,fr,it,ko,ru,my,vn')
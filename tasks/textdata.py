@@ -24,3 +24,186 @@ def ensure_loads():
     "Updating creation and modification dates database"
     from sc import textdata
     textdata.ensure_up_to_date()
+
+@task
+def benchmark_extraction(langs='pi,en', limit=None):
+    """Compare the streaming and full parse extraction of TIM data.
+    
+    Times both on every text of the given languages, reports the peak
+    resident memory of each in a separate process, and the texts for
+    which their results differ.
+    """
+    blurb(benchmark_extraction)
+    run_benchmark = ('from tasks.textdata import _benchmark_extraction; '
+                     '_benchmark_extraction({!r}, {!r}, {!r})')
+    for method in ('_parse_file', '_parse_file_tree'):
+        run('python -c "{}"'.format(run_benchmark.format(method, langs, limit)),
+            fg=True)
+    notice('Comparing results')
+    from sc.textdata import TextInfoModel, FileRecord
+    tim = TextInfoModel()
+    differ = 0
+    for htmlfile, lang_uid in _benchmark_files(langs, limit):
+        a = tim._parse_file(htmlfile, lang_uid)
+        b = _parse_file_tree(tim, htmlfile, lang_uid)
+        fields = [field for field in FileRecord.__slots__
+                  if getattr(a, field) != getattr(b, field)]
+        if fields:
+            differ += 1
+            warning('{!s} differs in {}'.format(htmlfile, ', '.join(fields)))
+    notice('{} text(s) differ'.format(differ))
+
+def _benchmark_files(langs, limit):
+    import sc
+    for lang_uid in langs.split(','):
+        files = sorted((sc.text_dir / lang_uid).glob('**/*.html'))
+        if limit:
+            files = files[:int(limit)]
+        for htmlfile in files:
+            yield htmlfile, lang_uid
+
+def _benchmark_extraction(method, langs, limit):
+    import time
+    import resource
+    from sc.textdata import TextInfoModel
+    tim = TextInfoModel()
+    if method == '_parse_file_tree':
+        parse = lambda htmlfile, lang_uid: _parse_file_tree(tim, htmlfile, lang_uid)
+    else:
+        parse = tim._parse_file
+    count = 0
+    start = time.perf_counter()
+    for htmlfile, lang_uid in _benchmark_files(langs, limit):
+        parse(htmlfile, lang_uid)
+        count += 1
+    seconds = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    notice('{}: {} texts in {:.1f} seconds, peak memory {:.0f} MiB'.format(
+        method, count, seconds, peak))
+
+def _parse_file_tree(tim, htmlfile, lang_uid):
+    """Gather the information of one file by parsing the whole document,
+    as TextInfoModel._parse_file did before it streamed the file."""
+    import sc
+    from sc.codepoints import CodepointSet
+    from sc.textdata import FileRecord
+    from sc.tools import html
+    uid = htmlfile.stem
+    root = html.parse(str(htmlfile)).getroot()
+    record = FileRecord(uid=uid, path=htmlfile.relative_to(sc.text_dir))
+    
+    #Set codepoint data
+    codepoints = set()
+    bold_codepoints = set()
+    italic_codepoints = set()
+    _stack = [root]
+    while _stack:
+        e = _stack.pop()
+        if tim.is_bold(lang_uid, e):
+            bold_codepoints.update(e.text_content())
+        elif tim.is_italic(lang_uid, e):
+            italic_codepoints.update(e.text_content())
+        else:
+            _stack.extend(e)
+    codepoints.update(root.text_content())
+    record.codepoints = tuple(CodepointSet(chars) for chars
+                              in (codepoints, bold_codepoints, italic_codepoints))
+    
+    record.prev_uid = root.get('data-prev')
+    record.next_uid = root.get('data-next')
+    record.author = _get_author(root)
+    
+    if uid == 'metadata':
+        return tim._metadata_record(record, htmlfile)
+    
+    metadata = root.select_one('#metaarea')
+    if metadata:
+        record.metaarea_author = tim._guess_author(metadata.text_content())
+    
+    record.name = _get_name(tim, root)
+    record.volpage = _get_volpage(tim, root, lang_uid)
+    record.embedded = [(child.uid, child.bookmark, child.name, child.volpage)
+                       for child in _get_embedded_uids(tim, root, lang_uid, uid)]
+    record.set_dates(htmlfile)
+    return record
+
+def _get_author(root):
+    for selector, attr in (('meta[author]', 'author'),
+                           ('meta[data-author]', 'data-author'),
+                           ('meta[name=description]', 'content')):
+        e = root.select_one(selector)
+        if e:
+            return e.attrib[attr]
+    e = root.select_one('#metaarea > .author')
+    if e:
+        return e.text
+    return None
+
+def _get_name(tim, root):
+    try:
+        h1 = root.select_one('.hgroup').select_one('h1')
+        return tim._clean_name(h1.text_content())
+    except Exception:
+        return ''
+
+def _get_volpage(tim, element, lang_uid):
+    if lang_uid == 'zh':
+        e = element.next_in_order()
+        while e is not None:
+            if e.tag == 'a' and e.select_one('.t, .t-linehead'):
+                return tim._format_volpage(lang_uid, e.attrib['id'])
+            e = e.next_in_order()
+    elif lang_uid == 'pi':
+        e = element.next_in_order()
+        while e:
+            if e.tag == 'a' and e.select_one('.ms'):
+                return tim._format_volpage(lang_uid, e.attrib['id'])
+            e = e.next_in_order()
+    return None
+
+def _get_embedded_uids(tim, root, lang_uid, uid):
+    from sc.textdata import TextInfo
+    out = []
+    
+    if '-pm' in uid:
+        # This is a patimokkha text
+        for h4 in root.select('h4'):
+            a = h4.select_one('a[id]')
+            if not a:
+                continue
+            out.append(TextInfo(
+                uid='{}#{}'.format(uid, a.attrib['id']),
+                bookmark=a.attrib['id'],
+                name=None,
+                volpage=_get_volpage(tim, h4, lang_uid)))
+    
+    data_uid_seen = set()
+    for e in root.select('[data-uid]'):
+        if e.tag in {'h1', 'h2', 'h3', 'h4', 'h5', 'h6'}:
+            heading = e.text_content()
+            add = e.select_one('.add')
+            if add and add.text_content() == heading:
+                heading = '[' + heading + ']'
+        else:
+            heading = None
+        out.append(TextInfo(uid=e.get('data-uid'), name=heading, bookmark=e.get('id')))
+        data_uid_seen.add(e)
+    
+    for e in root.select('.embeddedparallel'):
+        if 'data-uid' in e.attrib:
+            if e in data_uid_seen:
+                continue
+            # Explicit
+            new_uid = e.attrib['data-uid']
+        else:
+            # Implicit
+            new_uid = '{}#{}'.format(uid, e.attrib['id'])
+        out.append(TextInfo(uid=new_uid, bookmark=e.attrib['id']))
+    
+    sections = root.select('section.sutta')
+    if len(sections) > 1:
+        for section in sections:
+            data_uid = section.attrib.get('data-uid')
+            if data_uid:
+                out.append(TextInfo(uid=data_uid, bookmark=section.attrib.get('id')))
+    return out
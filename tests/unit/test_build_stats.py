@@ -0,0 +1,76 @@
+import json
+import unittest
+from unittest.mock import patch
+
+from sc import build_stats
+
+
+class BuildStatsTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = patch.object(build_stats, '_recent', build_stats.deque(maxlen=3))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_phases(self):
+        with build_stats.record('imm') as build:
+            with build_stats.phase('load tables'):
+                with build_stats.phase('table sutta'):
+                    pass
+            # The TIM loaded by the IMM build is a phase of it
+            with build_stats.record('tim') as tim_build:
+                with build_stats.phase('load'):
+                    pass
+                tim_build.generation = 1
+            with build_stats.phase('build'):
+                pass
+            build.generation = 2
+        self.assertEqual([build], build_stats.recent())
+        self.assertEqual([('load tables', 0), ('table sutta', 1), ('tim', 0), ('load', 1),
+                          ('build', 0)],
+                         [(phase.name, phase.depth) for phase in build.phases])
+        self.assertEqual(2, build.generation)
+        self.assertIsNone(build.error)
+        self.assertGreaterEqual(build.seconds, sum(phase.seconds for phase in build.phases
+                                                   if phase.depth == 0))
+
+    def test_phase_outside_build(self):
+        with build_stats.phase('table sutta'):
+            pass
+        self.assertEqual([], build_stats.recent())
+
+    def test_error(self):
+        with self.assertRaises(KeyError):
+            with build_stats.record('imm') as build:
+                with build_stats.phase('build'):
+                    with build_stats.phase('build_parallels'):
+                        raise KeyError('dn1')
+        self.assertEqual([build], build_stats.recent())
+        self.assertEqual("KeyError('dn1')", build.error)
+        self.assertEqual(['build', 'build_parallels'], [phase.name for phase in build.phases])
+        self.assertTrue(all(phase.seconds is not None for phase in build.phases))
+        # The next build isn't nested in the failed one
+        with build_stats.record('tim'):
+            pass
+        self.assertEqual(['imm', 'tim'], [build.name for build in build_stats.recent()])
+
+    def test_history(self):
+        for name in ['imm', 'tim', 'imm', 'tim']:
+            with build_stats.record(name):
+                pass
+        self.assertEqual(['tim', 'imm', 'tim'], [build.name for build in build_stats.recent()])
+
+    def test_admin(self):
+        from sc.root import Admin
+        with build_stats.record('imm') as build:
+            with build_stats.phase('build'):
+                pass
+            build.generation = 3
+        # Only this build, not those importing sc.root may have started
+        with patch.object(build_stats, 'recent', lambda: [build]):
+            stats = json.loads(json.dumps(Admin().build_stats()))
+        self.assertEqual(1, len(stats))
+        self.assertEqual('imm', stats[0]['name'])
+        self.assertEqual(3, stats[0]['generation'])
+        self.assertEqual(build.started.isoformat(), stats[0]['started'])
+        self.assertEqual(['build'], [phase['name'] for phase in stats[0]['phases']])
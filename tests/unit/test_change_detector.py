@@ -0,0 +1,97 @@
+import os
+import pathlib
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import sc
+from sc.change_detector import ChangeDetector
+
+
+def touch(path, seconds=10):
+    """ Move the mtime of path forward, whatever the mtime resolution """
+    stat = path.stat()
+    os.utime(str(path), ns=(stat.st_atime_ns, stat.st_mtime_ns + seconds * 10**9))
+
+
+class ChangeDetectorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = pathlib.Path(tempfile.mkdtemp())
+        self.folder = self.dir / 'text'
+        (self.folder / 'dn').mkdir(parents=True)
+        (self.folder / 'dn' / 'dn1.html').write_text('dn1')
+        (self.folder / 'dn' / 'dn2.html').write_text('dn2')
+        (self.folder / 'mn').mkdir()
+        (self.folder / 'mn' / 'mn1.html').write_text('mn1')
+        patcher = patch.object(sc, 'db_dir', self.dir / 'db')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.detector = self.new_detector()
+        self.signature = self.detector.signature()
+
+    def tearDown(self):
+        shutil.rmtree(str(self.dir))
+
+    def new_detector(self):
+        return ChangeDetector('test', self.folder, watch=False,
+                              include_filter=lambda name: name.endswith('.html'))
+
+    def assertChanged(self, changed=True, full=False):
+        signature = self.detector.signature(full=full)
+        if changed:
+            self.assertNotEqual(self.signature, signature)
+        else:
+            self.assertEqual(self.signature, signature)
+        self.signature = signature
+
+    def test_unchanged(self):
+        self.assertChanged(False)
+        self.assertChanged(False, full=True)
+
+    def test_added_file(self):
+        (self.folder / 'dn' / 'dn3.html').write_text('dn3')
+        touch(self.folder / 'dn')
+        self.assertChanged()
+
+    def test_removed_file(self):
+        (self.folder / 'mn' / 'mn1.html').unlink()
+        touch(self.folder / 'mn')
+        self.assertChanged()
+
+    def test_new_directory(self):
+        (self.folder / 'sn' / 'sn1').mkdir(parents=True)
+        (self.folder / 'sn' / 'sn1' / 'sn1.1.html').write_text('sn1.1')
+        touch(self.folder)
+        self.assertChanged()
+        # Its own changes are then found
+        (self.folder / 'sn' / 'sn1' / 'sn1.2.html').write_text('sn1.2')
+        touch(self.folder / 'sn' / 'sn1')
+        self.assertChanged()
+
+    def test_removed_directory(self):
+        shutil.rmtree(str(self.folder / 'mn'))
+        touch(self.folder)
+        self.assertChanged()
+
+    def test_filtered(self):
+        (self.folder / 'dn' / 'notes.txt').write_text('Notes')
+        touch(self.folder / 'dn')
+        self.assertChanged(False)
+
+    def test_modified_in_place(self):
+        # Only the directories are stat'd, unless full is given
+        (self.folder / 'dn' / 'dn1.html').write_text('The Brahmajāla')
+        touch(self.folder / 'dn' / 'dn1.html')
+        self.assertChanged(False)
+        self.assertChanged(full=True)
+
+    def test_manifest(self):
+        self.assertTrue(self.detector.manifest_file.exists())
+        self.assertEqual(self.signature, self.new_detector().signature())
+        # Changes made in between are found from the saved manifest
+        (self.folder / 'dn' / 'dn3.html').write_text('dn3')
+        touch(self.folder / 'dn')
+        self.detector = self.new_detector()
+        self.assertChanged()
@@ -0,0 +1,81 @@
+import pickle
+import random
+import unittest
+
+from sc.codepoints import CodepointSet
+
+
+def ranges(chars):
+    """ The (start, end) ranges of a set of characters, end being
+    inclusive """
+    out = []
+    for codepoint in sorted(map(ord, chars)):
+        if out and out[-1][1] == codepoint - 1:
+            out[-1] = (out[-1][0], codepoint)
+        else:
+            out.append((codepoint, codepoint))
+    return out
+
+
+class CodepointSetTest(unittest.TestCase):
+
+    def random_chars(self, rng, n):
+        blocks = [(0x20, 0x7f), (0xa0, 0x250), (0x4e00, 0x9fff), (0x1e00, 0x1eff),
+                  (0x20000, 0x2a6df)]
+        out = set()
+        for i in range(n):
+            start, end = rng.choice(blocks)
+            out.add(chr(rng.randrange(start, end)))
+        return out
+
+    def assertSameSet(self, chars, codepoints):
+        self.assertEqual(''.join(sorted(chars)), codepoints.text())
+        self.assertEqual(sorted(chars), list(codepoints))
+        self.assertEqual(sorted(map(ord, chars)), codepoints.codepoints())
+        self.assertEqual(len(chars), len(codepoints))
+        self.assertEqual(bool(chars), bool(codepoints))
+        self.assertEqual(ranges(chars), codepoints.ranges())
+
+    def test_empty(self):
+        empty = CodepointSet()
+        self.assertSameSet(set(), empty)
+        self.assertEqual(b'', empty.to_bytes())
+        self.assertEqual(empty, CodepointSet(''))
+        self.assertNotIn('a', empty)
+
+    def test_example(self):
+        chars = CodepointSet('abc') | CodepointSet('cde')
+        self.assertEqual('abcde', chars.text())
+        self.assertEqual([(97, 101)], chars.ranges())
+        self.assertIn('c', chars)
+        self.assertNotIn('f', chars)
+        self.assertEqual("CodepointSet('abcde')", repr(chars))
+
+    def test_random(self):
+        rng = random.Random(1)
+        for i in range(50):
+            a = self.random_chars(rng, rng.randrange(200))
+            b = self.random_chars(rng, rng.randrange(200))
+            ca, cb = CodepointSet(a), CodepointSet(b)
+            self.assertSameSet(a, ca)
+            self.assertSameSet(a | b, ca | cb)
+            self.assertSameSet(a & b, ca & cb)
+            self.assertSameSet(a - b, ca - cb)
+            self.assertSameSet(a | b, CodepointSet.union_all([ca, cb]))
+            self.assertEqual(a == b, ca == cb)
+            for char in list(b)[:20]:
+                self.assertEqual(char in a, char in ca)
+
+    def test_bytes_and_pickle(self):
+        rng = random.Random(2)
+        for i in range(20):
+            chars = CodepointSet(self.random_chars(rng, 300))
+            self.assertEqual(chars, CodepointSet.from_bytes(chars.to_bytes()))
+            unpickled = pickle.loads(pickle.dumps(chars))
+            self.assertEqual(chars, unpickled)
+            self.assertEqual(hash(chars), hash(unpickled))
+            self.assertIsInstance(unpickled, CodepointSet)
+
+    def test_not_equal_to_set(self):
+        self.assertNotEqual(CodepointSet('abc'), set('abc'))
+        self.assertEqual(CodepointSet('cba'), CodepointSet(['a', 'b', 'c']))
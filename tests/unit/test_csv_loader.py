@@ -0,0 +1,93 @@
+import os
+import pathlib
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import sc
+from sc import csv_loader
+from sc.csv_loader import Table
+
+
+pitaka_csv = '''uid,name,always_full
+su,Sutta,
+# Comment
+vi,Vinaya,1
+
+ab,Abhidhamma,
+'''
+
+
+class CsvLoaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = pathlib.Path(tempfile.mkdtemp())
+        self.table_dir = self.dir / 'table'
+        self.table_dir.mkdir()
+        self.db_dir = self.dir / 'db'
+        self.db_dir.mkdir()
+        self.file = self.table_dir / 'pitaka.csv'
+        self.file.write_text(pitaka_csv, encoding='utf-8')
+        for name, value in (('table_dir', self.table_dir), ('db_dir', self.db_dir)):
+            patcher = patch.object(sc, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = patch.dict(csv_loader._tables, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(str(self.dir))
+
+    def modify(self, text):
+        stat = self.file.stat()
+        self.file.write_text(text, encoding='utf-8')
+        # Later than the previous version, whatever the mtime resolution
+        os.utime(str(self.file), ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    def test_rows(self):
+        rows = list(csv_loader.table_reader('pitaka'))
+        self.assertEqual(['su', 'vi', 'ab'], [row.uid for row in rows])
+        self.assertEqual(('uid', 'name', 'always_full'), rows[0]._fields)
+        self.assertEqual('Vinaya', rows[1].name)
+        self.assertEqual('1', rows[1].always_full)
+        self.assertEqual({'su', 'vi', 'ab'}, set(csv_loader.load_table('pitaka')))
+
+    def test_wrong_width(self):
+        self.modify('uid,name\nsu,Sutta,\n')
+        with self.assertRaises(TypeError):
+            csv_loader.get_table('pitaka')
+
+    def test_kept_in_memory(self):
+        table = csv_loader.get_table('pitaka')
+        with patch.object(Table, 'load', side_effect=AssertionError):
+            self.assertIs(table, csv_loader.get_table('pitaka'))
+
+    def test_loaded_from_db(self):
+        table = csv_loader.get_table('pitaka')
+        self.assertTrue(Table.cache_file('pitaka', table.key).exists())
+        csv_loader._tables.clear()
+        with patch.object(Table, 'parse', side_effect=AssertionError):
+            loaded = csv_loader.get_table('pitaka')
+        self.assertEqual(table.columns, loaded.columns)
+        self.assertEqual(list(table.rows()), list(loaded.rows()))
+
+    def test_reloaded(self):
+        old_table = csv_loader.get_table('pitaka')
+        self.modify(pitaka_csv + 'xx,Extra,\n')
+        table = csv_loader.get_table('pitaka')
+        self.assertIsNot(old_table, table)
+        self.assertEqual(['su', 'vi', 'ab', 'xx'], [row.uid for row in table.rows()])
+        # The cache of the previous version is removed
+        saved = list((self.db_dir / 'tables').glob('table-pitaka_*'))
+        self.assertEqual([Table.cache_file('pitaka', table.key)], saved)
+
+    def test_preload(self):
+        (self.table_dir / 'sect.csv').write_text('uid,name\nthe,Theravāda\n',
+                                                 encoding='utf-8')
+        csv_loader.preload_tables(workers=1)
+        self.assertEqual({'pitaka', 'sect'}, set(csv_loader._tables))
+        for name in ('pitaka', 'sect'):
+            key = csv_loader._file_key(self.table_dir / (name + '.csv'))
+            self.assertTrue(Table.cache_file(name, key).exists())
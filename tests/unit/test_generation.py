@@ -0,0 +1,91 @@
+import threading
+import unittest
+
+from sc import generation
+from sc.generation import GenerationCache
+
+
+class GenerationCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.generation = generation.next_generation()
+        generation.register_source('test', lambda: self.generation)
+        self.cache = GenerationCache('test', depends='test')
+        self.calls = 0
+
+    def compute(self):
+        self.calls += 1
+        return self.calls
+
+    def test_next_generation(self):
+        self.assertGreater(generation.next_generation(), self.generation)
+
+    def test_cached(self):
+        self.assertEqual(1, self.cache.get('a', self.compute))
+        self.assertEqual(1, self.cache.get('a', self.compute))
+        self.assertEqual(2, self.cache.get('b', self.compute))
+        self.assertEqual(2, len(self.cache))
+        self.assertEqual(self.generation, self.cache.generation)
+
+    def test_new_generation(self):
+        self.cache.get('a', self.compute)
+        self.generation = generation.next_generation()
+        self.assertEqual(0, len(self.cache._values()))
+        self.assertEqual(2, self.cache.get('a', self.compute))
+        self.assertEqual(self.generation, self.cache.generation)
+
+    def test_clear(self):
+        self.cache.get('a', self.compute)
+        self.cache.clear()
+        self.assertEqual(0, len(self.cache))
+        self.assertEqual(2, self.cache.get('a', self.compute))
+
+    def test_registered(self):
+        self.assertIs(self.cache, generation.caches()['test'])
+
+
+class LockedGenerationCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        generation.register_source('test', lambda: 1)
+        self.cache = GenerationCache('test_locked', depends='test', locked=True)
+
+    def test_computed_once(self):
+        calls = []
+        started = threading.Event()
+        release = threading.Event()
+        def compute():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return len(calls)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.cache.get('a', compute)))
+                   for i in range(4)]
+        for thread in threads:
+            thread.start()
+        started.wait(5)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual([1, 1, 1, 1], results)
+        self.assertEqual([1], calls)
+
+    def test_other_keys_not_blocked(self):
+        release = threading.Event()
+        started = threading.Event()
+        def compute_slowly():
+            started.set()
+            release.wait(5)
+            return 'a'
+        thread = threading.Thread(target=self.cache.get, args=('a', compute_slowly))
+        thread.start()
+        try:
+            started.wait(5)
+            # Computed while 'a' is still being computed
+            self.assertEqual('b', self.cache.get('b', lambda: 'b'))
+            self.assertFalse(release.is_set())
+        finally:
+            release.set()
+            thread.join(5)
+        self.assertEqual('a', self.cache.get('a', lambda: 'not cached'))
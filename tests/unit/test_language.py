@@ -0,0 +1,72 @@
+import unittest
+from unittest.mock import patch
+
+from sc import generation, language
+from sc.language import TranslationTree, TranslationTreeBuilder
+
+
+def node(uid, type, children=(), translations=()):
+    return {'uid': uid, 'name': uid.upper(), 'type': type,
+            'children': list(children), 'translations': list(translations)}
+
+
+def translation(uid):
+    return {'name': uid.upper(), 'url': '/en/' + uid}
+
+
+class TranslationTreeBuilderTest(unittest.TestCase):
+
+    def build(self, tree):
+        builder = TranslationTreeBuilder.__new__(TranslationTreeBuilder)
+        builder.lang = 'en'
+        builder.tree = tree
+        builder.prune()
+        builder.add_descendent_counts()
+        return TranslationTree(builder.freeze())
+
+    def test_tree(self):
+        tree = self.build(node('en', 'language', [
+            node('sutta', 'collection', [
+                node('dn', 'division', [
+                    node('dn-all', 'subdivision', [
+                        node('dn1', 'sutta', translations=[translation('dn1')]),
+                        node('dn2', 'sutta', translations=[translation('dn2')])])]),
+                node('mn', 'division', [
+                    node('mn-all', 'subdivision', [node('mn1', 'sutta')])])])]))
+        root = tree.get_root()
+        self.assertEqual(2, root.descendents)
+        # The empty division is pruned
+        self.assertEqual(['dn'], [child.uid for child in root.children[0].children])
+        self.assertIsNone(tree.get_node_with_uid('mn'))
+        self.assertIsNone(tree.get_node_with_uid(None))
+        division = tree.get_node_with_uid('dn')
+        self.assertEqual(2, division.descendents)
+        suttas = division.children[0].children
+        self.assertEqual((language.Translation('DN1', '/en/dn1'),), suttas[0].translations)
+        # Suttas are not indexed
+        self.assertIsNone(tree.get_node_with_uid('dn1'))
+
+
+class GetTranslationTreeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.generations = {'imm': generation.next_generation()}
+        self.built = []
+        def build(lang):
+            self.built.append(lang)
+            return (lang, len(self.built))
+        for patcher in (patch.object(generation, 'current', self.generations.get),
+                        patch.object(language, 'build_translation_tree', build)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        language._tree_cache.clear()
+        self.addCleanup(language._tree_cache.clear)
+
+    def test_built_once_per_generation(self):
+        tree = language.get_translation_tree('en')
+        self.assertIs(tree, language.get_translation_tree('en'))
+        language.get_translation_tree('de')
+        self.assertEqual(['en', 'de'], self.built)
+        self.generations['imm'] = generation.next_generation()
+        self.assertIsNot(tree, language.get_translation_tree('en'))
+        self.assertEqual(['en', 'de', 'en'], self.built)
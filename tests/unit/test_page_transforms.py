@@ -0,0 +1,147 @@
+import random
+import unittest
+
+import regex
+
+from sc import page_transforms
+from sc.page_transforms import prepare_fragment, render_with_fragments
+from sc.textfunctions import cjk_regex
+
+
+# The transforms as ViewBase applied them to the whole page, the pages
+# rendered with fragments must be exactly the same.
+
+def reference_massage_whitespace(text):
+    return regex.sub(r'\n[ \n\t]+', r'\n', text)
+
+reference_cjk_tag_rex = regex.compile(r'<(td[^>]*)>([^>]*' + cjk_regex.pattern.strip('()+') + '[^>]*)</(td)>')
+reference_tib_tag_rex = regex.compile(r'<(td[^>]*)>([^>]*' + '[\u0F00-\u0FFF]' + '[^>]*)</(td)>')
+
+def reference_add_lang_tags(string):
+    def subfn_cjk(m):
+        if 'lang' in m[1]:
+            return m[0]
+        return r'<{m[1]} lang="lzh">{m[2]}</{m[3]}>'.format(m=m)
+
+    def subfn_tib(m):
+        if 'lang' in m[1]:
+            return m[0]
+        return r'<{m[1]} lang="bo">{m[2]}</{m[3]}>'.format(m=m)
+
+    string = reference_cjk_tag_rex.sub(subfn_cjk, string)
+    string = reference_tib_tag_rex.sub(subfn_tib, string)
+    return string
+
+def reference_render(render, context):
+    return reference_add_lang_tags(reference_massage_whitespace(render(context)))
+
+
+page_template = '''<!DOCTYPE html>
+<html>
+    <head>
+        <title>{title}</title>
+    </head>
+    <body>
+        <table><tr><td>大正藏</td><td lang="en">Taishō</td></tr></table>
+        <div id="text">
+            {text}
+        </div>
+        <table>
+            <tr>
+                <td>བཀའ་འགྱུར</td>
+            </tr>
+        </table>
+    </body>
+</html>
+'''
+
+text = '''
+<article>
+    <div class="hgroup">
+        <h1>1. 梵網經</h1>
+    </div>
+    <table>
+        <tr><td>長阿含</td>	<td>DN 1</td></tr>
+        <tr><td class="x">སྡེ་དགེ</td><td lang="bo">ཀ</td></tr>
+    </table>
+    <p>Thus have I heard.
+
+        At one time…</p>
+</article>
+
+    '''
+
+def render(context):
+    return page_template.format(**context)
+
+def render_twice(context):
+    return render(context) + context['text']
+
+
+class PageTransformsTest(unittest.TestCase):
+
+    def assertSamePage(self, render, context, name='text'):
+        fragment = prepare_fragment(context[name])
+        self.assertIsNotNone(fragment)
+        self.assertEqual(reference_render(render, context),
+                         render_with_fragments(render, context, {name: fragment}))
+
+    def test_massage_whitespace(self):
+        self.assertEqual(reference_massage_whitespace(text),
+                         page_transforms.massage_whitespace(text))
+
+    def test_add_lang_tags(self):
+        self.assertEqual(reference_add_lang_tags(text),
+                         page_transforms.add_lang_tags(text))
+
+    def test_text_page(self):
+        self.assertSamePage(render, {'title': 'DN 1', 'text': text})
+
+    def test_cjk_text_page(self):
+        cjk_text = page_transforms.massage_cjk(
+            '<aside id="metaarea">大正藏 1</aside>\n<p>如是我聞</p>\n<p>一時</p>\n')
+        self.assertSamePage(render, {'title': '長阿含', 'text': cjk_text})
+
+    def test_massage_cjk(self):
+        self.assertEqual('\n<p>如是我聞</p>\n<p>一時</p>',
+                         page_transforms.massage_cjk('\n<p>如是\n我聞</p>\n<p>一時</p>\n'))
+        self.assertEqual('\n<p>如是</p><aside id="metaarea"><span lang="lzh">大正藏</span> 1</aside>'
+                         '\n<p>一時</p>',
+                         page_transforms.massage_cjk('<p>如是</p>\n<aside id="metaarea">大正藏 1</aside>'
+                                                     '\n<p>一時</p>\n'))
+
+    def test_placeholder_repeated(self):
+        context = {'title': 'DN 1', 'text': text}
+        fragment = prepare_fragment(text)
+        self.assertEqual(reference_render(render_twice, context),
+                         render_with_fragments(render_twice, context, {'text': fragment}))
+
+    def test_unprepared(self):
+        self.assertIsNone(prepare_fragment('Thus have I heard.'))
+        self.assertIsNone(prepare_fragment('<p>Thus have I heard.'))
+        self.assertIsNone(prepare_fragment('</p><p>Thus have I heard.</p>'))
+
+    def test_no_transforms(self):
+        context = {'title': 'DN 1', 'text': text}
+        fragment = prepare_fragment(text)
+        self.assertEqual(render(context),
+                         render_with_fragments(render, context, {'text': fragment},
+                                               fix_whitespace=False, lang_tags=False))
+
+    def test_random_pages(self):
+        rng = random.Random(1)
+        tokens = ['<td>', '</td>', '<td class="a">', '<td lang="lzh">', '<p>',
+                  '</p>', '<tr>', '</tr>', 'a', '中', '文', 'ཀ', '&gt;', ' ', '\n',
+                  '\t', '\n ', '\n\n']
+        whitespace = [' ', '\n', '\t']
+
+        def random_html(length):
+            return ''.join(rng.choice(tokens) for i in range(length))
+
+        for i in range(500):
+            template = (random_html(rng.randrange(20)).replace('{', '')
+                        + '{text}' + random_html(rng.randrange(20)))
+            body = (''.join(rng.choice(whitespace) for i in range(rng.randrange(4)))
+                    + '<article>' + random_html(rng.randrange(40)) + '</article>'
+                    + ''.join(rng.choice(whitespace) for i in range(rng.randrange(4))))
+            self.assertSamePage(lambda context: template.format(**context), {'text': body})
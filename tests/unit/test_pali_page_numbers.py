@@ -0,0 +1,123 @@
+import pathlib
+import random
+import shutil
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import sc
+import sc.csv_loader
+from sc.textdata import PaliPageNumbinator
+
+
+class LinearPaliPageNumbinator(PaliPageNumbinator):
+    """ The lookup as it was, trying each attempt in a dict of every row """
+
+    def __init__(self, rows):
+        self.mapping = {(msbook, int(msnum), edition): (book, page)
+                        for msbook, msnum, edition, book, page in rows}
+
+    def get_pts_ref(self, msbook, msnum, attempts=None):
+        if not attempts:
+            attempts = self.default_attempts
+        for i in attempts:
+            n = msnum + i
+            if n < 1:
+                continue
+            key1 = (msbook, n, 'pts1')
+            key2 = (msbook, n, 'pts2')
+            key = None
+            if key1 in self.mapping:
+                key = key1
+            elif key2 in self.mapping:
+                key = key2
+            if key:
+                book, num = self.mapping[key]
+                ptsbook = self.msbook_to_ptsbook(msbook)
+                return self.format_book(ptsbook, book, num)
+
+
+def random_rows(rng, n):
+    rows = []
+    for i in range(n):
+        msbook = rng.choice(['1d', '2m', '3s', '4a', '5th1', '6th2', '7v'])
+        rows.append((msbook, str(rng.randrange(0, 200)),
+                     rng.choice(['pts1', 'pts2', 'pts2', 'vri', 'ms']),
+                     rng.choice(['', '1', '2', '3', '4', '5', '6']),
+                     str(rng.randrange(1, 500))))
+    return rows
+
+
+def make_numbinator(rows):
+    ppn = PaliPageNumbinator.__new__(PaliPageNumbinator)
+    ppn.books, ppn.pages, ppn.index = PaliPageNumbinator.build_index(rows)
+    return ppn
+
+
+class PaliPageNumbinatorTest(unittest.TestCase):
+
+    def test_example(self):
+        ppn = make_numbinator([('1d', '10', 'pts1', '2', '5'),
+                               ('1d', '10', 'pts2', '3', '7'),
+                               ('1d', '30', 'pts2', '', '9'),
+                               ('1d', '40', 'vri', '1', '1')])
+        self.assertEqual('DN ii 5', ppn.get_pts_ref('1d', 10))
+        self.assertEqual('DN ii 5', ppn.get_pts_ref('1d', 25))
+        self.assertEqual('DN 9', ppn.get_pts_ref('1d', 26))
+        self.assertEqual('DN 9', ppn.get_pts_ref('1d', 45))
+        self.assertIsNone(ppn.get_pts_ref('1d', 46))
+        self.assertIsNone(ppn.get_pts_ref('2m', 10))
+        self.assertEqual('DN ii 5', ppn.get_pts_ref_from_pid('p_1D_10'))
+        self.assertEqual(['DN ii 5', None, 'DN 9'],
+                         ppn.get_pts_refs_from_pids(['p_1D_11', 'p_2M_1', 'p_1d_31']))
+
+    def test_same_as_linear(self):
+        rng = random.Random(1)
+        for i in range(10):
+            rows = random_rows(rng, 600)
+            ppn = make_numbinator(rows)
+            linear = LinearPaliPageNumbinator(rows)
+            for msbook in ['1d', '2m', '3s', '4a', '5th1', '6th2', '7v', '8kh']:
+                pids = []
+                for msnum in range(-20, 230):
+                    self.assertEqual(linear.get_pts_ref(msbook, msnum),
+                                     ppn.get_pts_ref(msbook, msnum), (msbook, msnum))
+                    attempts = [0, 2, -3]
+                    self.assertEqual(linear.get_pts_ref(msbook, msnum, attempts),
+                                     ppn.get_pts_ref(msbook, msnum, attempts), (msbook, msnum))
+                    if msnum >= 0:
+                        pids.append('p_{}_{}'.format(msbook.upper(), msnum))
+                self.assertEqual([linear.get_pts_ref_from_pid(pid) for pid in pids],
+                                 ppn.get_pts_refs_from_pids(pids))
+
+
+class PaliPageNumbinatorLoadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = pathlib.Path(tempfile.mkdtemp())
+        patcher = patch.object(sc, 'db_dir', self.dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.table = SimpleNamespace(key=(1, 100), rows=lambda: [('1d', '10', 'pts1', '2', '5')])
+        patcher = patch.object(sc.csv_loader, 'get_table', lambda name: self.table)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(str(self.dir))
+
+    def test_saved(self):
+        ppn = PaliPageNumbinator()
+        self.assertEqual('DN ii 5', ppn.get_pts_ref('1d', 10))
+        file = PaliPageNumbinator.get_file(self.table.key)
+        self.assertTrue(file.exists())
+        with patch.object(PaliPageNumbinator, 'build_index', side_effect=AssertionError):
+            self.assertEqual('DN ii 5', PaliPageNumbinator().get_pts_ref('1d', 10))
+
+    def test_table_changed(self):
+        PaliPageNumbinator()
+        old_file = PaliPageNumbinator.get_file(self.table.key)
+        self.table = SimpleNamespace(key=(2, 100), rows=lambda: [('1d', '10', 'pts1', '3', '8')])
+        self.assertEqual('DN iii 8', PaliPageNumbinator().get_pts_ref('1d', 10))
+        self.assertFalse(old_file.exists())
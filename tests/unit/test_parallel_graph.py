@@ -0,0 +1,104 @@
+import random
+import unittest
+from collections import defaultdict
+
+from sc.parallel_graph import ParallelGraph, UnionFind
+
+
+rows = [('dn1', 'da21', False, None),
+        ('da21', 't21', False, 'Note'),
+        ('t21', 't1', False, None),
+        ('dn1', 'sf8', True, None),
+        # Repeated in the other direction
+        ('sf8', 'dn1', True, None),
+        ('mn1', 'ma106', False, None)]
+
+
+def reference_parallels(rows):
+    """ The parallels as build_parallels_data found them, with direct
+    full parallels removed from the indirect ones """
+    fulls = defaultdict(set)
+    partials = defaultdict(set)
+    indirects = defaultdict(set)
+    for uid, other_uid, partial, footnote in rows:
+        target = partials if partial else fulls
+        target[uid].add((other_uid, footnote))
+        target[other_uid].add((uid, footnote))
+    for uid, parallels in fulls.items():
+        for pid, footnote in parallels:
+            indirects[uid].update(fulls[pid])
+    for uid in indirects:
+        direct = {pid for pid, _ in fulls[uid]}
+        indirects[uid] = {pid for pid, _ in indirects[uid]
+                          if pid != uid and pid not in direct}
+    return fulls, partials, indirects
+
+
+class ParallelGraphTest(unittest.TestCase):
+
+    def setUp(self):
+        self.graph = ParallelGraph(rows)
+
+    def test_fulls(self):
+        self.assertEqual([('da21', None)], self.graph.fulls('dn1'))
+        self.assertEqual([('da21', 'Note'), ('t1', None)], self.graph.fulls('t21'))
+
+    def test_partials(self):
+        self.assertEqual([('sf8', None)], self.graph.partials('dn1'))
+        self.assertEqual([('dn1', None)], self.graph.partials('sf8'))
+        self.assertEqual([], self.graph.partials('da21'))
+
+    def test_indirects(self):
+        self.assertEqual([('t21', 'Note'), ('t1', None)], self.graph.indirects('dn1'))
+        self.assertEqual([('t21', 'Note')], self.graph.indirects('dn1', k=2))
+        self.assertEqual([], self.graph.indirects('mn1'))
+
+    def test_component(self):
+        self.assertEqual(['da21', 'dn1', 't1', 't21'], self.graph.component('t1'))
+        self.assertEqual(['ma106', 'mn1'], self.graph.component('mn1'))
+        # Partial parallels don't join clusters
+        self.assertEqual(['sf8'], self.graph.component('sf8'))
+
+    def test_are_parallel(self):
+        self.assertTrue(self.graph.are_parallel('dn1', 't1'))
+        self.assertFalse(self.graph.are_parallel('dn1', 'sf8'))
+        self.assertFalse(self.graph.are_parallel('dn1', 'mn1'))
+
+    def test_unknown_uid(self):
+        self.assertNotIn('sn1.1', self.graph)
+        self.assertEqual([], self.graph.fulls('sn1.1'))
+        self.assertEqual([], self.graph.indirects('sn1.1'))
+        self.assertEqual(['sn1.1'], self.graph.component('sn1.1'))
+        self.assertFalse(self.graph.are_parallel('sn1.1', 'dn1'))
+
+    def test_union_find(self):
+        union_find = UnionFind(5)
+        union_find.union(0, 1)
+        union_find.union(3, 4)
+        union_find.union(1, 4)
+        self.assertEqual(union_find.find(0), union_find.find(3))
+        self.assertNotEqual(union_find.find(0), union_find.find(2))
+
+    def test_random_graphs(self):
+        rng = random.Random(1)
+        uids = ['s{}'.format(i) for i in range(30)]
+        for i in range(50):
+            rows = [(rng.choice(uids), rng.choice(uids), rng.random() < 0.3,
+                     rng.choice([None, 'a', 'b']))
+                    for j in range(rng.randrange(40))]
+            rows = [row for row in rows if row[0] != row[1]]
+            graph = ParallelGraph(rows)
+            fulls, partials, indirects = reference_parallels(rows)
+            for uid in uids:
+                self.assertEqual(fulls[uid], set(graph.fulls(uid)))
+                self.assertEqual(partials[uid], set(graph.partials(uid)))
+                self.assertEqual(indirects[uid],
+                                 {pid for pid, _ in graph.indirects(uid, k=2)})
+                # The closure is the rest of the cluster
+                component = set(graph.component(uid))
+                self.assertIn(uid, component)
+                self.assertEqual(component - {uid} - {pid for pid, _ in fulls[uid]},
+                                 {pid for pid, _ in graph.indirects(uid)})
+                for other in component:
+                    self.assertTrue(graph.are_parallel(uid, other)
+                                    or uid not in graph)
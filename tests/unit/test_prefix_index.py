@@ -0,0 +1,50 @@
+import random
+import unittest
+
+from sc.util import PrefixIndex
+
+
+def linear_longest_prefix(mapping, string):
+    """ The lookup PrefixIndex replaced, slicing the string until it is
+    a key """
+    while len(string) > 0:
+        if string in mapping:
+            return string, mapping[string]
+        string = string[:-1]
+
+
+class PrefixIndexTest(unittest.TestCase):
+
+    def test_example(self):
+        index = PrefixIndex({'sn': 'SN', 'sn1': 'SN 1', 'sn12': 'SN 12'})
+        self.assertEqual(('sn1', 'SN 1'), index.longest_prefix('sn1.1'))
+        self.assertEqual(('sn12', 'SN 12'), index.longest_prefix('sn12.3'))
+        self.assertEqual(('sn', 'SN'), index.longest_prefix('sn22.1'))
+        self.assertEqual(('sn', 'SN'), index.longest_prefix('sn'))
+        self.assertEqual('SN 1', index.get('sn1'))
+        # Missing prefixes
+        self.assertIsNone(index.longest_prefix('s'))
+        self.assertIsNone(index.longest_prefix('an1.1'))
+        self.assertIsNone(index.longest_prefix(''))
+        self.assertIsNone(index.get('an1.1'))
+        self.assertEqual('?', index.get('an1.1', '?'))
+
+    def test_set(self):
+        index = PrefixIndex()
+        self.assertIsNone(index.get('dn1'))
+        index['dn'] = 'pi'
+        index['dn'] = 'lzh'
+        self.assertEqual('lzh', index.get('dn1'))
+
+    def test_same_as_linear(self):
+        rng = random.Random(1)
+        alphabet = 'ads1.2-'
+        def random_uid(length):
+            return ''.join(rng.choice(alphabet) for i in range(rng.randrange(length)))
+        for i in range(20):
+            mapping = {random_uid(5) or 'a': i for i in range(rng.randrange(1, 50))}
+            index = PrefixIndex(mapping)
+            for j in range(500):
+                uid = random_uid(9)
+                self.assertEqual(linear_longest_prefix(mapping, uid),
+                                 index.longest_prefix(uid), uid)
@@ -0,0 +1,155 @@
+import pathlib
+import shutil
+import sys
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import cherrypy
+
+import sc
+import sc.scimm
+
+sys.path.insert(1, str(pathlib.Path(__file__).resolve().parents[2] / 'utility' / 'export'))
+import prerender
+
+
+class FakeTIM:
+
+    def __init__(self, texts):
+        self.texts = texts
+
+    def languages(self):
+        return list(self.texts)
+
+    def get(self, lang_uid):
+        return {uid: SimpleNamespace(file_uid=file_uid)
+                for uid, file_uid in self.texts[lang_uid].items()}
+
+
+def fake_imm():
+    division = lambda subdivisions: SimpleNamespace(has_subdivisions=lambda: subdivisions)
+    return SimpleNamespace(
+        pitakas=['su'],
+        divisions={'dn': division(False), 'sn': division(True)},
+        subdivisions=['sn1'],
+        suttas=['dn1', 'sn1.1'],
+        languages=['en', 'de'],
+        tim=FakeTIM({'en': {'dn1': 'dn1', 'sn1.1': 'sn1.1-10', 'sn1.1-10': 'sn1.1-10'},
+                     'de': {'dn1': 'dn1'}}))
+
+
+class PrerenderTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = pathlib.Path(tempfile.mkdtemp())
+        self.static_dir = self.dir / 'static'
+        for path, text in (('js/zh.js', ''), ('js/sc.js', ''), ('js/lookup/pi-lookup.js', ''), ('js/pi/dict.js', ''),
+                           ('css/sc.css', 'a { background: url("/img/bg.png") }'),
+                           ('img/logo.png', 'PNG')):
+            file = self.static_dir / path
+            file.parent.mkdir(parents=True, exist_ok=True)
+            file.write_text(text)
+        # sc.show can only be imported with the data repository
+        show = SimpleNamespace(STATIC_PAGES=['contacts', 'about'])
+        for patcher in (patch.object(sc, 'static_dir', self.static_dir),
+                        patch.object(sc.scimm, 'imm', fake_imm),
+                        patch.object(sc, 'show', show, create=True),
+                        patch.dict(sys.modules, {'sc.show': show})):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(str(self.dir))
+
+
+class EnumeratePathsTest(PrerenderTestCase):
+
+    def test_paths(self):
+        self.assertEqual(['/', '/downloads', '/about', '/contacts', '/su', '/dn', '/sn',
+                          '/sn/full', '/sn1', '/dn1', '/sn1.1', '/en', '/de',
+                          '/en/dn1', '/en/sn1.1-10', '/de/dn1', '/js/lookup/pi-lookup.js', '/js/zh.js'],
+                         list(prerender.enumerate_paths()))
+
+    def test_omitted(self):
+        paths = list(prerender.enumerate_paths(frozenset({'de'})))
+        self.assertNotIn('/de', paths)
+        self.assertNotIn('/de/dn1', paths)
+        self.assertIn('/en/dn1', paths)
+
+    def test_output_path(self):
+        self.assertEqual('index.html', prerender.output_path('/'))
+        self.assertEqual('en/dn1.html', prerender.output_path('/en/dn1/#p1'))
+        self.assertEqual('sn/full.html', prerender.output_path('/sn/full?x=1'))
+        self.assertEqual('sn1.1.html', prerender.output_path('/sn1.1'))
+        self.assertEqual('css/sc.css', prerender.output_path('/css/sc.css'))
+        self.assertEqual('zh/t1 2.html', prerender.output_path('/zh/t1%202'))
+
+
+class ExportTest(PrerenderTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.output_dir = self.dir / 'out'
+        omit_codes = frozenset({'de'})
+        for name, value in (('output_dir', self.output_dir), ('omit_codes', omit_codes),
+                            ('omit_rex', prerender.get_omit_rex(omit_codes))):
+            patcher = patch.object(prerender, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.pages = {}
+        patcher = patch.object(prerender, 'render', self.render)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def render(self, path):
+        try:
+            page = self.pages[path]
+        except KeyError:
+            raise cherrypy.NotFound()
+        if page.startswith('redirect:'):
+            raise cherrypy.HTTPRedirect(page[len('redirect:'):])
+        return page
+
+    def read(self, path):
+        return (self.output_dir / path).read_text(encoding='utf8')
+
+    def test_page(self):
+        self.pages['/en/dn1'] = (
+            '<html><head><link rel="stylesheet" href="/css/sc.css"></head><body>'
+            '<a href="/dn1#p2">DN 1</a><a href="/de/dn1">DN 1</a><a href="/">Home</a>'
+            '<a href="http://example.com/">Elsewhere</a><img src="/img/logo.png">'
+            '</body></html>')
+        path, links, error = prerender.export_path('/en/dn1')
+        self.assertIsNone(error)
+        self.assertEqual({'/css/sc.css', '/dn1', '/', '/img/logo.png'}, links)
+        page = self.read('en/dn1.html')
+        self.assertTrue(page.startswith('<!DOCTYPE html>\n'))
+        self.assertIn('href="../css/sc.css"', page)
+        self.assertIn('href="../dn1.html#p2"', page)
+        self.assertIn('href="../index.html"', page)
+        self.assertIn('href="http://example.com/"', page)
+        self.assertIn('src="../img/logo.png"', page)
+        # Omitted languages are left on the site
+        self.assertIn('href="http://suttacentral.net/de/dn1"', page)
+
+    def test_redirect(self):
+        self.pages['/sn1.1'] = 'redirect:http://127.0.0.1/sn1.1-10'
+        self.pages['/sn1.1-10'] = '<html><body><p>SN 1.1</p></body></html>'
+        self.assertIsNone(prerender.export_path('/sn1.1')[2])
+        self.assertIn('<p>SN 1.1</p>', self.read('sn1.1.html'))
+        self.pages['/loop'] = 'redirect:http://127.0.0.1/loop'
+        self.assertEqual('ValueError: Too many redirects', prerender.export_path('/loop')[2])
+
+    def test_error(self):
+        path, links, error = prerender.export_path('/missing')
+        self.assertEqual('/missing', path)
+        self.assertTrue(error.startswith('NotFound'))
+
+    def test_assets(self):
+        path, links, error = prerender.export_path('/css/sc.css')
+        self.assertEqual({'/img/bg.png'}, links)
+        self.assertEqual('a { background: url("../img/bg.png") }', self.read('css/sc.css'))
+        prerender.export_path('/img/logo.png')
+        self.assertEqual('PNG', self.read('img/logo.png'))
@@ -0,0 +1,137 @@
+import random
+import unittest
+from collections import defaultdict, namedtuple
+from itertools import chain
+from types import SimpleNamespace
+
+from sc.scimm import _Imm
+
+
+TextInfo = namedtuple('TextInfo', 'uid path next_uid prev_uid')
+
+
+class FakeTIM:
+    def __init__(self, textinfos):
+        self._by_lang = defaultdict(dict)
+        for lang_uid, textinfo in textinfos:
+            self._by_lang[lang_uid][textinfo.uid] = textinfo
+
+    def languages(self):
+        return sorted(self._by_lang)
+
+    def get(self, uid=None, lang_uid=None):
+        if uid is None:
+            return self._by_lang[lang_uid]
+        return self._by_lang.get(lang_uid, {}).get(uid)
+
+
+def reference_get_next_prev(imm, uid, lang_uid):
+    """ get_next_prev as it was before the reading order was built """
+    soc = defaultdict(dict)
+    for division in imm.divisions.values():
+        suttas = list(chain(*(sd.suttas for sd in division.subdivisions)))
+        prev = None
+        for sutta in suttas:
+            if prev:
+                soc[sutta.uid]['prev'] = prev.uid
+                soc[prev.uid]['next'] = sutta.uid
+            prev = sutta
+    tim = imm.tim
+    nextdata = None
+    prevdata = None
+    textdata = tim.get(uid=uid, lang_uid=lang_uid)
+    nextprev = soc.get(uid)
+    if nextprev:
+        if 'next' in nextprev:
+            nextdata = tim.get(uid=nextprev.get('next'), lang_uid=lang_uid)
+            if nextdata and textdata and nextdata.path == textdata.path:
+                nextdata = None
+        else:
+            nextdata = False
+        if 'prev' in nextprev:
+            prevdata = tim.get(uid=nextprev.get('prev'), lang_uid=lang_uid)
+            if prevdata and textdata and prevdata.path == textdata.path:
+                prevdata = None
+        else:
+            prevdata = False
+    if textdata:
+        if nextdata is None and textdata.next_uid:
+            nextdata = tim.get(uid=textdata.next_uid, lang_uid=lang_uid)
+        if prevdata is None and textdata.prev_uid:
+            prevdata = tim.get(uid=textdata.prev_uid, lang_uid=lang_uid)
+    return {'next': nextdata, 'prev': prevdata}
+
+
+def make_imm(divisions, textinfos):
+    imm = _Imm.__new__(_Imm)
+    imm.divisions = {}
+    for division_uid, subdivisions in divisions.items():
+        imm.divisions[division_uid] = SimpleNamespace(subdivisions=[
+            SimpleNamespace(suttas=[SimpleNamespace(uid=uid) for uid in uids])
+            for uids in subdivisions])
+    imm.tim = FakeTIM(textinfos)
+    imm.build_reading_order()
+    return imm
+
+
+class ReadingOrderTest(unittest.TestCase):
+
+    def assertSameOrder(self, imm):
+        for lang_uid in imm.tim.languages():
+            for uid in imm.tim.get(lang_uid=lang_uid):
+                self.assertEqual(reference_get_next_prev(imm, uid, lang_uid),
+                                 imm.get_next_prev(uid, lang_uid),
+                                 (uid, lang_uid))
+
+    def test_division_order(self):
+        imm = make_imm({'dn': [['dn1', 'dn2'], ['dn3']]},
+                       [('pi', TextInfo('dn1', 'dn/dn1.html', None, None)),
+                        ('pi', TextInfo('dn2', 'dn/dn2.html', None, None)),
+                        ('pi', TextInfo('dn3', 'dn/dn3.html', None, None)),
+                        ('en', TextInfo('dn2', 'dn/dn2.html', None, None))])
+        dn2 = imm.get_next_prev('dn2', 'pi')
+        self.assertEqual('dn3', dn2['next'].uid)
+        self.assertEqual('dn1', dn2['prev'].uid)
+        # The start and end of a division
+        self.assertIs(False, imm.get_next_prev('dn1', 'pi')['prev'])
+        self.assertIs(False, imm.get_next_prev('dn3', 'pi')['next'])
+        # No text in the language
+        self.assertEqual({'next': None, 'prev': None}, imm.get_next_prev('dn2', 'en'))
+        self.assertEqual({'next': None, 'prev': None}, imm.get_next_prev('dn9', 'pi'))
+        self.assertSameOrder(imm)
+
+    def test_same_file(self):
+        imm = make_imm({'sn': [['sn1.1', 'sn1.2', 'sn1.3']]},
+                       [('pi', TextInfo('sn1.1', 'sn/sn1.html', None, None)),
+                        ('pi', TextInfo('sn1.2', 'sn/sn1.html', 'sn1.3', None)),
+                        ('pi', TextInfo('sn1.3', 'sn/sn3.html', None, None))])
+        self.assertIsNone(imm.get_next_prev('sn1.1', 'pi')['next'])
+        self.assertEqual('sn1.3', imm.get_next_prev('sn1.2', 'pi')['next'].uid)
+        self.assertSameOrder(imm)
+
+    def test_text_links(self):
+        imm = make_imm({},
+                       [('en', TextInfo('a', 'x/a.html', 'b', None)),
+                        ('en', TextInfo('b', 'x/b.html', 'missing', 'a'))])
+        self.assertEqual('b', imm.get_next_prev('a', 'en')['next'].uid)
+        self.assertIsNone(imm.get_next_prev('b', 'en')['next'])
+        self.assertSameOrder(imm)
+
+    def test_random(self):
+        rng = random.Random(1)
+        uids = ['s{}'.format(i) for i in range(40)]
+        for i in range(20):
+            shuffled = uids[:]
+            rng.shuffle(shuffled)
+            divisions = {}
+            for j in range(4):
+                division = shuffled[j * 8:(j + 1) * 8]
+                divisions['d{}'.format(j)] = [division[:3], division[3:]]
+            textinfos = []
+            for lang_uid in ('pi', 'en'):
+                for uid in rng.sample(uids, 30):
+                    textinfos.append((lang_uid, TextInfo(
+                        uid, 'text/{}.html'.format(rng.randrange(20)),
+                        rng.choice([None, rng.choice(uids)]),
+                        rng.choice([None, rng.choice(uids)]))))
+            self.assertSameOrder(make_imm(divisions, textinfos))
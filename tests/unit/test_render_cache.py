@@ -0,0 +1,192 @@
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import cherrypy
+from cherrypy import _cprequest
+from cherrypy.lib import httputil
+
+from sc import render_cache as render_cache_module
+from sc import views
+from sc.render_cache import CachedPage, RenderCache, placeholder
+
+
+class RequestTestCase(unittest.TestCase):
+
+    def request(self, **headers):
+        request = _cprequest.Request(httputil.Host('127.0.0.1', 80),
+                                     httputil.Host('127.0.0.1', 1111))
+        request.method = 'GET'
+        request.headers = httputil.HeaderMap(headers)
+        response = _cprequest.Response()
+        cherrypy.serving.load(request, response)
+        return response
+
+    def send(self, page, *args, **headers):
+        """ Return the html sent, or None for 304 Not Modified, and the
+        response """
+        response = self.request(**headers)
+        try:
+            return page.send(*args), response
+        except cherrypy.HTTPRedirect as e:
+            self.assertEqual(304, e.status)
+            return None, response
+
+
+class CachedPageTest(RequestTestCase):
+
+    def test_not_modified(self):
+        page = CachedPage('<p>Thus have I heard.</p>')
+        html, response = self.send(page)
+        self.assertEqual('<p>Thus have I heard.</p>', html)
+        etag = response.headers['ETag']
+        last_modified = response.headers['Last-Modified']
+        self.assertIsNone(self.send(page, **{'If-None-Match': etag})[0])
+        self.assertIsNone(self.send(page, **{'If-Modified-Since': last_modified})[0])
+        self.assertIsNotNone(self.send(page, **{'If-None-Match': '"other"'})[0])
+        self.assertNotEqual(etag, self.send(CachedPage('<p>Other</p>'))[1].headers['ETag'])
+
+    def test_live_parts(self):
+        page = CachedPage('<head>{}</head><div>{}</div>'.format(
+            placeholder('timing'), placeholder('discussions')))
+        discussions = ['<b>1</b>']
+        timing = iter(range(100))
+        live = {'discussions': lambda: discussions[0]}
+        untagged = {'timing': lambda: '<script>{}</script>'.format(next(timing))}
+        html, response = self.send(page, live, untagged)
+        self.assertEqual('<head><script>0</script></head><div><b>1</b></div>', html)
+        etag = response.headers['ETag']
+        # The live parts are never revalidated by date
+        self.assertNotIn('Last-Modified', response.headers)
+        # The untagged parts don't change the ETag
+        self.assertIsNone(self.send(page, live, untagged, **{'If-None-Match': etag})[0])
+        discussions[0] = ''
+        html, response = self.send(page, live, untagged, **{'If-None-Match': etag})
+        self.assertEqual('<head><script>2</script></head><div></div>', html)
+        self.assertNotEqual(etag, response.headers['ETag'])
+
+
+class RenderCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = RenderCache(max_chars=100, max_age=3600)
+
+    def test_get(self):
+        self.assertIsNone(self.cache.get('a'))
+        page = self.cache.put('a', 'x' * 10)
+        self.assertIs(page, self.cache.get('a'))
+        self.assertEqual((1, 1), (self.cache.hits, self.cache.misses))
+        self.cache.put('a', 'y' * 20)
+        self.assertEqual('y' * 20, self.cache.get('a').html)
+        self.assertEqual(20, self.cache.chars)
+
+    def test_bounded_by_chars(self):
+        for key in 'abc':
+            self.cache.put(key, key * 30)
+        self.cache.get('a')
+        self.cache.put('d', 'd' * 30)
+        # The least recently used pages are dropped
+        self.assertEqual(['c', 'a', 'd'], list(self.cache._pages))
+        self.assertEqual(90, self.cache.chars)
+        self.cache.put('f', 'f' * 100)
+        self.assertEqual(['f'], list(self.cache._pages))
+        # A page larger than the cache isn't kept
+        page = self.cache.put('g', 'g' * 101)
+        self.assertEqual('g' * 101, page.html)
+        self.assertIsNone(self.cache.get('g'))
+        self.assertEqual(100, self.cache.chars)
+        self.cache.clear()
+        self.assertEqual((0, 0), (len(self.cache), self.cache.chars))
+
+    def test_max_age(self):
+        self.cache.put('a', 'x')
+        with patch.object(render_cache_module.time, 'time', lambda: 10**10):
+            self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(0, self.cache.chars)
+
+    def test_full_key(self):
+        generations = {'imm': 1, 'tim': 1}
+        with patch.object(render_cache_module.sc.generation, 'current', generations.get):
+            key = RenderCache.full_key('dn1')
+            self.assertEqual(key, RenderCache.full_key('dn1'))
+            generations['tim'] = 2
+            self.assertNotEqual(key, RenderCache.full_key('dn1'))
+
+
+class CachedView(views.ViewBase):
+    template_name = 'cached'
+
+    def __init__(self, discussions):
+        self.discussions = discussions
+        self.rendered = []
+
+    def render_cache_key(self):
+        return 'dn1'
+
+    def live_parts(self):
+        return {'discussions': lambda: self.discussions}
+
+    def render_page(self, cached=False):
+        self.rendered.append(cached)
+        return '<div>{}</div>'.format(placeholder('discussions') if cached else self.discussions)
+
+
+class ViewRenderTest(RequestTestCase):
+
+    def setUp(self):
+        generations = {'imm': 1, 'tim': 1}
+        for patcher in (patch.object(views, 'render_cache', RenderCache(max_chars=1000, max_age=3600)),
+                        patch.object(render_cache_module.sc.generation, 'current', generations.get)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_render(self):
+        view = CachedView('<b>1</b>')
+        self.request()
+        with patch.object(RenderCache, 'full_key', wraps=RenderCache.full_key) as full_key:
+            self.assertEqual('<div><b>1</b></div>', view.render())
+        self.assertEqual(1, full_key.call_count)
+        self.assertEqual([True], view.rendered)
+        # The live part is filled in again, the page isn't rendered again
+        view.discussions = ''
+        self.request()
+        self.assertEqual('<div></div>', view.render())
+        self.assertEqual([True], view.rendered)
+
+
+class DiscourseWrapperTest(unittest.TestCase):
+
+    def setUp(self):
+        self.searched = []
+        languages = {'pi': SimpleNamespace(isroot='1'), 'en': SimpleNamespace(isroot=''),
+                     'de': SimpleNamespace(isroot='')}
+        imm = SimpleNamespace(suttas={'dn1': None}, languages=languages)
+        def search(uid):
+            self.searched.append(uid)
+            return True
+        for patcher in (patch.object(views.scimm, 'imm', lambda: imm),
+                        patch.object(views.sc.search.discourse, 'search', search),
+                        patch.dict(views.sc.config.discourse,
+                                   {'forum_url': 'http://discourse.suttacentral.net/'})):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def wrapper(self, uid, lang_code):
+        view = views.TextView.__new__(views.TextView)
+        view.uid = uid
+        view.lang_code = lang_code
+        return view.discourse_wrapper()
+
+    def test_searched(self):
+        self.assertIn('discourse-results-wrapper', self.wrapper('dn1', 'en'))
+        self.assertIn('discourse-results-wrapper', self.wrapper('dn1', 'pi'))
+        self.assertEqual(['dn1', 'dn1'], self.searched)
+
+    def test_not_searched(self):
+        self.assertEqual('', self.wrapper('dn1', 'de'))
+        # Root texts which aren't suttas
+        self.assertEqual('', self.wrapper('dn', 'pi'))
+        with patch.dict(views.sc.config.discourse, {'forum_url': ''}):
+            self.assertEqual('', self.wrapper('dn1', 'pi'))
+            self.assertEqual('', self.wrapper('dn1', 'en'))
+        self.assertEqual([], self.searched)
@@ -0,0 +1,510 @@
+import functools
+import io
+import os
+import pathlib
+import shutil
+import sys
+import tempfile
+import unittest
+from collections import defaultdict
+from unittest.mock import patch
+
+import regex
+
+import sc
+import sc.fonts
+from sc import csv_loader, scimm, textdata
+from sc.classes import TextRef
+from sc.scimm import _Imm, _SnapshotPickler, _SnapshotUnpickler
+from sc.textdata import TextInfo
+
+
+tables = {
+    'pitaka': '''uid,name,always_full
+su,Sutta,
+vi,Vinaya,1
+''',
+    'sect': '''uid,name
+sth,Sthavira
+''',
+    'language': '''uid,name,iso_code,isroot,priority,search_priority
+pi,Pali,pi,1,1,1
+lzh,Chinese,lzh,1,2,1
+en,English,en,,3,1
+de,German,de,,4,1
+''',
+    'external_text': '''sutta_uid,language,abstract,url,priority
+dn2,en,Thanissaro,http://www.accesstoinsight.org/dn2,1
+da1,lzh,CBETA,http://www.cbeta.org/da1,0
+da2,de,Franke,http://example.de/da2,1
+''',
+    'collection': '''uid,name,abbrev_name,language,sect_uid,pitaka_uid
+pi-su,Pali Suttas,Pali,pi,sth,su
+lzh-su,Chinese Suttas,Chinese,lzh,,su
+pi-vi,Pali Vinaya,Pali,pi,sth,vi
+''',
+    'division': '''uid,collection_uid,name,alt_name,acronym,subdiv_ind,menu_gwn_ind
+dn,pi-su,Dīgha Nikāya,,DN,,
+sn,pi-su,Saṃyutta Nikāya,,SN,,
+da,lzh-su,Dīrgha Āgama,,DA,,
+pi-tv-bu-pm,pi-vi,Bhikkhu Pātimokkha,,Bu Pm,,
+''',
+    'subdivision': '''uid,division_uid,name,acronym,vagga_numbering_ind
+sn1,sn,Devatā Saṃyutta,SN 1,
+sn2,sn,Devaputta Saṃyutta,SN 2,
+''',
+    'vagga': '''subdivision_uid,number,name
+''',
+    'biblio': '''uid,name,text
+''',
+    'sutta': '''uid,acronym,name,language,subdivision_uid,vagga_number,number_in_vagga,volpage,biblio_uid
+dn1,DN 1,Brahmajāla,pi,dn,,1,DN i 1,
+dn2,DN 2,Sāmaññaphala,pi,dn,,2,DN i 47,
+dn3,DN 3,Ambaṭṭha,pi,dn,,3,DN i 87,
+sn1.1,SN 1.1,Oghataraṇa,pi,sn1,,1,SN i 1,
+sn1.2,SN 1.2,Nimokkha,pi,sn1,,2,SN i 2,
+sn2.1-2,SN 2.1-2,Kassapa,pi,sn2,,1,SN i 45,
+da1,DA 1,大本經,lzh,da,,1,T i 1,
+da2,DA 2,遊行經,lzh,da,,2,T i 11,
+''',
+    'correspondence': '''sutta_uid,other_sutta_uid,partial,footnote
+dn1,da1,,
+da1,sn1.1,,
+dn2,da2,1,Partial
+''',
+    'vinaya_rules': '''uid,volpage_info
+pi-tv-bu-pm-pj1,Vin iii 1
+pi-tv-bu-pm-pj2,Vin iii 21
+''',
+    'vinaya_pm': '''name,pali
+Division,pi-tv-bu-pm
+Name,Pali
+Pārājika 1,pi-tv-bu-pm-pj1
+Pārājika 2,pi-tv-bu-pm-pj2
+''',
+    'vinaya_kd': '''name,pali
+''',
+}
+
+epigraphs_xml = '''<epigraphs>
+<epigraph id="1"><uid>dn1</uid><href></href><content>Thus have I heard.</content></epigraph>
+<epigraph id="2"><uid>dn3</uid><href></href><content>Not translated.</content></epigraph>
+</epigraphs>
+'''
+
+
+def textinfo(lang_uid, uid, name, path_uid=None, author=None):
+    path = pathlib.Path('/text/{}/{}.html'.format(lang_uid, path_uid or uid))
+    return TextInfo(uid=uid, file_uid=path.stem, lang=lang_uid, path=path,
+                    name=name, author=author)
+
+
+texts = [
+    textinfo('pi', 'dn', 'Dīgha Nikāya'),
+    textinfo('pi', 'dn1', 'Brahmajāla'),
+    textinfo('pi', 'dn2', 'Sāmaññaphala'),
+    textinfo('pi', 'sn1.1', 'Oghataraṇa', 'sn1.1-2'),
+    textinfo('pi', 'sn1.2', 'Nimokkha', 'sn1.1-2'),
+    textinfo('pi', 'pi-tv-bu-pm-pj1', 'Pārājika 1'),
+    textinfo('lzh', 'da2', '遊行經'),
+    textinfo('en', 'dn1', 'The All-embracing Net of Views', author='Bhikkhu Bodhi'),
+    textinfo('en', 'sn1.1', 'Crossing the Flood'),
+    textinfo('en', 'sn2.1', 'Kassapa'),
+    textinfo('en', 'pi-tv-bu-pm-pj1', 'Defeat 1'),
+    textinfo('de', 'dn1', 'Das Netz'),
+]
+
+
+class FakeTIM:
+    """ The texts of a TIM, and its signature """
+
+    def __init__(self, textinfos, signature='aaa'):
+        self.signature = signature
+        self._by_lang = defaultdict(dict)
+        for textinfo in textinfos:
+            self._by_lang[textinfo.lang][textinfo.uid] = textinfo
+
+    def languages(self):
+        return sorted(self._by_lang)
+
+    def get(self, uid=None, lang_uid=None):
+        if uid is None:
+            return self._by_lang[lang_uid]
+        if lang_uid is None:
+            return {lang_uid: texts[uid] for lang_uid, texts in self._by_lang.items()
+                    if uid in texts}
+        return self._by_lang.get(lang_uid, {}).get(uid)
+
+    def exists(self, uid, lang_uid):
+        return self.get(uid, lang_uid) is not None
+
+
+def parallels(imm):
+    return {uid: [(p.sutta.uid, p.partial, p.indirect, p.footnote) for p in sutta.parallels]
+            for uid, sutta in imm.suttas.items()}
+
+
+def text_ref_key(text_ref):
+    if text_ref is not None:
+        return (text_ref.lang.uid, text_ref.name, text_ref.abstract, text_ref.url,
+                text_ref.priority)
+
+
+def text_refs(imm):
+    return {uid: (text_ref_key(sutta.text_ref), [text_ref_key(t) for t in sutta.translations])
+            for uid, sutta in imm.suttas.items()}
+
+
+class ImmTestCase(unittest.TestCase):
+    """ Builds IMMs from the tables above, in a temporary data folder """
+
+    def setUp(self):
+        self.dir = pathlib.Path(tempfile.mkdtemp())
+        self.table_dir = self.dir / 'data' / 'table'
+        self.table_dir.mkdir(parents=True)
+        self.db_dir = self.dir / 'db'
+        self.db_dir.mkdir()
+        for name, text in tables.items():
+            (self.table_dir / (name + '.csv')).write_text(text, encoding='utf-8')
+        (self.table_dir / 'epigraphs.xml').write_text(epigraphs_xml, encoding='utf-8')
+        self.tim = FakeTIM(texts)
+        for patcher in (patch.object(sc, 'data_dir', self.dir / 'data'),
+                        patch.object(sc, 'table_dir', self.table_dir),
+                        patch.object(sc, 'db_dir', self.db_dir),
+                        patch.dict(csv_loader._tables, clear=True),
+                        patch.object(textdata, 'tim', lambda: self.tim),
+                        patch.object(sc.fonts, 'get_fonts_data', lambda: {}),
+                        patch.object(scimm, 'preload_tables',
+                                     functools.partial(csv_loader.preload_tables, workers=1))):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(str(self.dir))
+
+    def modify(self, name, text):
+        file = self.table_dir / (name + '.csv')
+        stat = file.stat()
+        file.write_text(text, encoding='utf-8')
+        # Later than the previous version, whatever the mtime resolution
+        os.utime(str(file), ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    def assertSameImm(self, expected, imm):
+        self.assertEqual(list(expected.suttas), list(imm.suttas))
+        self.assertEqual(parallels(expected), parallels(imm))
+        self.assertEqual(text_refs(expected), text_refs(imm))
+        self.assertEqual({uid: text_ref_key(division.text_ref)
+                          for uid, division in expected.divisions.items()},
+                         {uid: text_ref_key(division.text_ref)
+                          for uid, division in imm.divisions.items()})
+
+
+class Node:
+    def __init__(self, name):
+        self.name = name
+        self.children = []
+
+
+def dumps(state, root):
+    buffer = io.BytesIO()
+    _SnapshotPickler(buffer, root).dump_graph(state)
+    return buffer.getvalue()
+
+
+def loads(data, root):
+    return _SnapshotUnpickler(io.BytesIO(data), root).load_graph()
+
+
+class SnapshotPicklerTest(unittest.TestCase):
+
+    def test_cycles_and_identity(self):
+        a, b = Node('a'), Node('b')
+        a.children.append(b)
+        b.children.append(a)
+        shared = ['shared']
+        looped = []
+        looped.append(looped)
+        state = {'nodes': [a, b], 'x': shared, 'y': shared, 'looped': looped,
+                 'tuple': (shared, a)}
+        loaded = loads(dumps(state, object()), object())
+        a, b = loaded['nodes']
+        self.assertEqual(['a', 'b'], [a.name, b.name])
+        self.assertIs(a, b.children[0])
+        self.assertIs(b, a.children[0])
+        self.assertIs(loaded['x'], loaded['y'])
+        self.assertIs(loaded['x'], loaded['tuple'][0])
+        self.assertIs(a, loaded['tuple'][1])
+        self.assertIs(loaded['looped'], loaded['looped'][0])
+
+    def test_deep_lists(self):
+        length = sys.getrecursionlimit() * 10
+        chain = []
+        for i in range(length):
+            chain = [i, chain]
+        loaded = loads(dumps({'chain': chain}, object()), object())['chain']
+        for i in reversed(range(length)):
+            self.assertEqual(i, loaded[0])
+            loaded = loaded[1]
+        self.assertEqual([], loaded)
+
+    def test_root(self):
+        root, new_root = Node('root'), Node('new root')
+        node = Node('child')
+        node.children.append(root)
+        loaded = loads(dumps({'root': root, 'node': node}, root), new_root)
+        self.assertIs(new_root, loaded['root'])
+        self.assertIs(new_root, loaded['node'].children[0])
+
+
+class SnapshotTest(ImmTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.imm = _Imm(1)
+        self.imm.save_snapshot()
+
+    def test_load(self):
+        with patch.object(_Imm, 'build', side_effect=AssertionError):
+            imm = _Imm.load_snapshot(2)
+        self.assertSameImm(self.imm, imm)
+        self.assertIs(imm, imm.suttas['dn1'].imm)
+        self.assertIs(imm, imm.divisions['dn'].imm)
+        self.assertIs(imm.suttas['dn1'], imm.subdivisions['dn'].suttas[0])
+        self.assertIs(self.tim, imm.tim)
+        self.assertEqual(2, imm.timestamp)
+        self.assertEqual(self.imm.get_next_prev('dn1', 'pi')['next'],
+                         imm.get_next_prev('dn1', 'pi')['next'])
+        self.assertEqual(1, len(list(self.db_dir.glob('imm-snapshot_*'))))
+
+    def test_stale_version(self):
+        with patch.object(_Imm, 'snapshot_version', _Imm.snapshot_version + 1):
+            self.assertIsNone(_Imm.load_snapshot(2))
+
+    def test_changed_table(self):
+        self.modify('sutta', tables['sutta'].replace('Brahmajāla', 'Brahmajāla Sutta'))
+        self.assertIsNone(_Imm.load_snapshot(2))
+
+    def test_changed_tim(self):
+        self.tim = FakeTIM(texts, signature='bbb')
+        self.assertIsNone(_Imm.load_snapshot(2))
+
+    def test_build_falls_back(self):
+        self.modify('sutta', tables['sutta'].replace('Brahmajāla', 'Brahmajāla Sutta'))
+        with patch.object(_Imm, '_instance', None), \
+                patch.object(_Imm, '_ready', scimm.threading.Event()), \
+                patch.object(_Imm, 'load_snapshot', wraps=_Imm.load_snapshot) as load_snapshot, \
+                patch.object(_Imm, 'build', autospec=True, side_effect=_Imm.build) as build:
+            scimm._build()
+            imm = _Imm._instance
+        self.assertEqual(1, load_snapshot.call_count)
+        self.assertEqual(1, build.call_count)
+        self.assertEqual('Brahmajāla Sutta', imm.suttas['dn1'].name)
+        # The new snapshot replaces the old one
+        self.assertEqual([_Imm.get_snapshot_name(self.tim)],
+                         [file.name for file in self.db_dir.glob('imm-snapshot_*')])
+
+
+class StagesTest(unittest.TestCase):
+
+    def test_stages_to_run(self):
+        self.assertEqual(['build_parallels'], _Imm.get_stages_to_run({'correspondence'}))
+        self.assertEqual(['build_grouped_suttas', 'build_parallel_groups', 'build_text_refs',
+                          'load_epigraphs', 'build_reading_order'],
+                         _Imm.get_stages_to_run({'tim'}))
+        self.assertEqual(['build_parallel_groups'], _Imm.get_stages_to_run({'vinaya_kd'}))
+        self.assertEqual(list(_Imm.build_stages), _Imm.get_stages_to_run({'sutta'}))
+        # Tables which no stage claims could affect anything
+        self.assertEqual(list(_Imm.build_stages),
+                         _Imm.get_stages_to_run({'correspondence', 'uid_expansion'}))
+        self.assertEqual([], _Imm.get_stages_to_run(set()))
+
+
+class UpdateTest(ImmTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.imm = _Imm(1)
+        self.parallels = parallels(self.imm)
+        self.text_refs = text_refs(self.imm)
+
+    def assertUnchanged(self):
+        self.assertEqual(self.parallels, parallels(self.imm))
+        self.assertEqual(self.text_refs, text_refs(self.imm))
+
+    def test_correspondence(self):
+        self.modify('correspondence', tables['correspondence'].replace(
+            'dn2,da2,1,Partial\n', 'sn1.2,dn3,,\n'))
+        stages = _Imm.get_stages_to_run(self.imm.get_changed_tables())
+        self.assertEqual(['build_parallels'], stages)
+        clone = self.imm.clone()
+        clone.update(stages, 2)
+        self.assertUnchanged()
+        self.assertSameImm(_Imm(2), clone)
+        self.assertEqual([('dn3', False, False, '')], parallels(clone)['sn1.2'])
+        self.assertEqual(set(), clone.get_changed_tables())
+
+    def test_tim(self):
+        tim = FakeTIM(texts[:-1] + [textinfo('en', 'dn2', 'The Fruits of the Contemplative Life'),
+                                    textinfo('de', 'sn1.2', 'Befreiung'),
+                                    textinfo('pi', 'sn', 'Saṃyutta Nikāya'),
+                                    textinfo('pi', 'pi-tv-bu-pm-pj2', 'Pārājika 2')],
+                      signature='bbb')
+        clone = self.imm.clone()
+        clone.update(_Imm.get_stages_to_run({'tim'}), 2, tim)
+        self.assertUnchanged()
+        self.assertIs(self.tim, self.imm.tim)
+        self.tim = tim
+        expected = _Imm(2)
+        self.assertSameImm(expected, clone)
+        self.assertEqual([(e['sutta'].uid, e['href']) for e in expected.epigraphs],
+                         [(e['sutta'].uid, e['href']) for e in clone.epigraphs])
+        self.assertEqual(expected.get_next_prev('sn1.2', 'de'), clone.get_next_prev('sn1.2', 'de'))
+        self.assertEqual('Pārājika 2', clone.suttas['pi-tv-bu-pm-pj2'].name)
+        self.assertIs(clone.suttas['pi-tv-bu-pm-pj2'], clone.subdivisions['pi-tv-bu-pm'].suttas[-1])
+
+    def test_build_not_updated(self):
+        with self.assertRaises(ValueError):
+            self.imm.clone().update(list(_Imm.build_stages), 2)
+
+
+def reference_get_text_ref(imm, uid, lang_uid):
+    """ get_text_ref as it was computed on every access, before the text
+    refs were resolved at build time """
+    textinfo = imm.tim.get(uid=uid, lang_uid=lang_uid)
+    if textinfo:
+        return TextRef.from_textinfo(textinfo, imm.languages[lang_uid])
+    for textref in imm._external_text_refs.get(uid, []):
+        if textref.lang.uid == lang_uid:
+            return textref
+    m = regex.match(r'(.*?)(\d+)-(\d+)', uid)
+    if m:
+        textinfo = imm.tim.get(uid=m[1]+m[2], lang_uid=lang_uid)
+        if textinfo:
+            return TextRef.from_textinfo(textinfo, imm.languages[lang_uid])
+
+
+def reference_get_translations(imm, uid, root_lang_uid):
+    """ get_translations as it was computed on every access """
+    out = []
+    for textref in imm._external_text_refs.get(uid, []):
+        if textref.lang.uid == root_lang_uid:
+            continue
+        out.append(textref)
+    textinfos = imm.tim.get(uid=uid)
+    seen = set()
+    for lang_uid, textinfo in textinfos.items():
+        if lang_uid == root_lang_uid:
+            continue
+        out.append(TextRef.from_textinfo(textinfo, imm.languages[lang_uid]))
+        seen.add(lang_uid)
+    m = regex.match(r'(.*?)(\d+)-(\d+)', uid)
+    if m:
+        textinfos = imm.tim.get(uid=m[1]+m[2])
+        for lang_uid, textinfo in textinfos.items():
+            if lang_uid == root_lang_uid:
+                continue
+            if lang_uid in seen:
+                continue
+            out.append(TextRef.from_textinfo(textinfo, imm.languages[lang_uid]))
+    out.sort(key=TextRef.sort_key)
+    return out
+
+
+class TextRefsTest(ImmTestCase):
+
+    def assertSameAsReference(self, imm):
+        for uid, sutta in imm.suttas.items():
+            lang_uid = sutta.lang.uid
+            self.assertEqual(text_ref_key(reference_get_text_ref(imm, uid, lang_uid)),
+                             text_ref_key(sutta.text_ref), uid)
+            self.assertEqual([text_ref_key(t) for t in reference_get_translations(imm, uid, lang_uid)],
+                             [text_ref_key(t) for t in sutta.translations], uid)
+        for uid, division in imm.divisions.items():
+            # The text ref of a division was looked up when it was built
+            self.assertEqual(text_ref_key(reference_get_text_ref(imm, uid, division.collection.lang.uid)),
+                             text_ref_key(division.text_ref), uid)
+
+    def test_text_refs(self):
+        imm = _Imm(1)
+        self.assertSameAsReference(imm)
+        # Suttas without texts, grouped suttas and divisions with texts
+        self.assertIsNone(imm.suttas['dn3'].text_ref)
+        self.assertEqual([], imm.suttas['dn3'].translations)
+        self.assertEqual('/pi/pi-tv-bu-pm-pj1', imm.suttas['pi-tv-bu-pm-pj1'].text_ref.url)
+        self.assertEqual(['/en/pi-tv-bu-pm-pj1'],
+                         [t.url for t in imm.suttas['pi-tv-bu-pm-pj1'].translations])
+        self.assertIsNone(imm.suttas['pi-tv-bu-pm-pj2'].text_ref)
+        self.assertEqual('/pi/dn', imm.divisions['dn'].text_ref.url)
+        self.assertIsNone(imm.divisions['sn'].text_ref)
+
+    def test_other_texts(self):
+        # Ranges whose first text is in the TIM, and texts of grouped
+        # suttas and divisions in other languages
+        self.tim = FakeTIM(texts + [textinfo('pi', 'sn2.1', 'Kassapa'),
+                                    textinfo('de', 'sn2.1', 'Kassapa'),
+                                    textinfo('en', 'sn2.1-2', 'Kassapa'),
+                                    textinfo('lzh', 'da', 'Dīrgha Āgama'),
+                                    textinfo('de', 'pi-tv-bu-pm-pj2', 'Niederlage 2'),
+                                    textinfo('en', 'dn', 'The Long Discourses')])
+        imm = _Imm(1)
+        self.assertSameAsReference(imm)
+        self.assertEqual('/pi/sn2.1', imm.suttas['sn2.1-2'].text_ref.url)
+        self.assertEqual('/lzh/da', imm.divisions['da'].text_ref.url)
+        self.assertEqual('/pi/dn', imm.divisions['dn'].text_ref.url)
+
+    def test_not_built(self):
+        imm = _Imm(1)
+        self.assertEqual((None, []), imm.get_sutta_text_refs('dn4', 'pi'))
+        self.assertIsNone(imm.get_division_text_ref('mn'))
+
+
+def reference_guess_uid(mapping, uid):
+    """ guess_subdiv_uid and guess_div_uid as they were """
+    while len(uid) > 0:
+        if uid in mapping:
+            return uid
+        uid = uid[:-1]
+
+
+def reference_get_root_lang_from_uid(imm, uid):
+    """ get_root_lang_from_uid as it was, slicing the uid until it is a
+    division or subdivision """
+    if uid in imm.suttas:
+        return imm.suttas[uid].lang.uid
+    else:
+        div_uid = uid
+        while div_uid:
+            if div_uid in imm.divisions:
+                return imm.divisions[div_uid].collection.lang.uid
+            if div_uid in imm.subdivisions:
+                return imm.subdivisions[div_uid].division.collection.lang.uid
+            div_uid = div_uid[:-1]
+    if uid[0] == 't':
+        return 'zh'
+    if uid[:3] == 'skt':
+        return 'skt'
+    raise ValueError("No root lang could be determined for uid: {}".format(uid))
+
+
+class PrefixLookupTest(ImmTestCase):
+
+    uids = ['dn', 'dn1', 'dn99', 'sn', 'sn1', 'sn1.1', 'sn1.9', 'sn2.1-2', 'sn3.1', 'snp1',
+            'da', 'da2', 'da-2', 'pi-tv-bu-pm-pj1', 'pi-tv-bu-pm-pj99', 'pi-tv-bu', 'pi-vi',
+            't1', 'skt1', 'xyz', 'd']
+
+    def test_same_as_linear(self):
+        imm = _Imm(1)
+        for uid in self.uids:
+            self.assertEqual(reference_guess_uid(imm.subdivisions, uid),
+                             imm.guess_subdiv_uid(uid), uid)
+            self.assertEqual(reference_guess_uid(imm.divisions, uid), imm.guess_div_uid(uid), uid)
+            try:
+                root_lang = reference_get_root_lang_from_uid(imm, uid)
+            except ValueError:
+                with self.assertRaises(ValueError):
+                    imm.get_root_lang_from_uid(uid)
+            else:
+                self.assertEqual(root_lang, imm.get_root_lang_from_uid(uid), uid)
+        self.assertEqual('pi-tv-bu-pm', imm.suttas['pi-tv-bu-pm-pj1'].subdivision.uid)
+        self.assertEqual('sn1', imm.guess_subdiv_uid('sn1.9'))
+        self.assertEqual('lzh', imm.get_root_lang_from_uid('da-2'))
@@ -0,0 +1,110 @@
+import pickle
+import unittest
+from collections import namedtuple
+
+from sc.classes import Language, Parallel, Subdivision, Sutta, Vagga
+from sc.sutta_store import SuttaStore
+
+
+# The fields of the Sutta namedtuple the store replaced
+OldSutta = namedtuple('OldSutta',
+        'uid acronym alt_acronym name vagga_number '
+        'number_in_vagga number lang subdivision vagga '
+        'volpage alt_volpage_info biblio_entry '
+        'parallels imm')
+
+
+class FakeTIM:
+    def get(self, uid=None, lang_uid=None):
+        return None
+
+
+class FakeImm:
+    tim = FakeTIM()
+
+
+pi = Language(uid='pi', name='Pali', isroot=True, iso_code='pi', priority=1,
+              search_priority=1.0, collections=[])
+lzh = Language(uid='lzh', name='Chinese', isroot=True, iso_code='lzh',
+               priority=3, search_priority=1.0, collections=[])
+dn = Subdivision(uid='dn', division=None, name='Dīgha Nikāya', acronym='DN',
+                 vagga_numbering_ind=False, vaggas=[], suttas=[], order=0)
+da = Subdivision(uid='da', division=None, name='Dīrgha Āgama', acronym='DA',
+                 vagga_numbering_ind=False, vaggas=[], suttas=[], order=1)
+dn_vagga = Vagga(subdivision=dn, number=1, name='Sīlakkhandhavagga', suttas=[])
+da_vagga = Vagga(subdivision=da, number=0, name=None, suttas=[])
+
+rows = [
+    dict(uid='dn1', acronym='DN 1', alt_acronym=None, name='Brahmajāla',
+         vagga_number=1, lang=pi, subdivision=dn, vagga=dn_vagga, number=1,
+         number_in_vagga='1', volpage='DN i 1', alt_volpage_info=None,
+         biblio_entry=None),
+    dict(uid='dn2', acronym='DN 2', alt_acronym='D 2', name='Sāmaññaphala',
+         vagga_number=1, lang=pi, subdivision=dn, vagga=dn_vagga, number=2,
+         number_in_vagga='2', volpage='DN i 47', alt_volpage_info='PTS i 47',
+         biblio_entry='Biblio'),
+    dict(uid='da21', acronym='DA 21', alt_acronym=None, name='梵動經',
+         vagga_number=0, lang=lzh, subdivision=da, vagga=da_vagga, number=21,
+         number_in_vagga='', volpage='T i 88b01', alt_volpage_info=None,
+         biblio_entry=None),
+]
+
+
+class SuttaStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.imm = FakeImm()
+        self.store = SuttaStore(self.imm)
+        self.suttas = [self.store.add(**row) for row in rows]
+        self.store.finish()
+        dn1, dn2, da21 = self.suttas
+        self.parallels = {
+            dn1._index: [Parallel(da21, False, False, 'Note'),
+                         Parallel(dn2, True, False, None)],
+            da21._index: [Parallel(dn1, False, False, 'Note')],
+        }
+        self.store.set_parallels(self.parallels)
+
+    def old_sutta(self, i):
+        return OldSutta(parallels=self.parallels.get(i, []), imm=self.imm, **rows[i])
+
+    def test_attributes(self):
+        for i, sutta in enumerate(self.suttas):
+            old = self.old_sutta(i)
+            for field in OldSutta._fields:
+                self.assertEqual(getattr(old, field), getattr(sutta, field), field)
+            self.assertIs(old.lang, sutta.lang)
+            self.assertIs(old.subdivision, sutta.subdivision)
+            self.assertIs(old.vagga, sutta.vagga)
+
+    def test_parallels(self):
+        dn1, dn2, da21 = self.suttas
+        self.assertEqual(2, dn1.parallels_count)
+        self.assertEqual(0, dn2.parallels_count)
+        self.assertEqual([], dn2.parallels)
+        self.assertIs(da21, dn1.parallels[0].sutta)
+        # The list is made once
+        self.assertIs(dn1.parallels, dn1.parallels)
+
+    def test_set_parallels(self):
+        dn1, dn2, da21 = self.suttas
+        old_parallels = dn1.parallels
+        self.store.set_parallels({dn2._index: [Parallel(dn1, True, False, None)]})
+        self.assertEqual(2, len(old_parallels))
+        self.assertEqual([], dn1.parallels)
+        self.assertEqual([Parallel(dn1, True, False, None)], dn2.parallels)
+
+    def test_equality(self):
+        dn1, dn2, da21 = self.suttas
+        self.assertEqual(dn1, self.store.suttas[0])
+        self.assertNotEqual(dn1, dn2)
+        self.assertEqual(hash('dn1'), hash(dn1))
+
+    def test_pickle(self):
+        dn1 = self.suttas[0]
+        dn1.parallels
+        store = pickle.loads(pickle.dumps(self.store))
+        self.assertEqual({}, store._parallels[-1])
+        self.assertEqual(['da21', 'dn2'],
+                         [parallel.sutta.uid for parallel in store.get_parallels(0)])
+        self.assertEqual(['dn1', 'dn2', 'da21'], store.uid)
@@ -0,0 +1,96 @@
+import os
+import pathlib
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import jinja2
+
+from sc import template_cache
+from sc.template_cache import BundleLoader
+
+
+def touch(file, seconds=10):
+    """ Move the mtime of file forward, whatever the mtime resolution """
+    stat = file.stat()
+    os.utime(str(file), ns=(stat.st_atime_ns, stat.st_mtime_ns + seconds * 10**9))
+
+
+class TemplateCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = pathlib.Path(tempfile.mkdtemp())
+        self.templates_dir = self.dir / 'templates'
+        self.templates_dir.mkdir()
+        self.bundle_dir = self.dir / 'jinja2' / 'bundle'
+        for name, value in (('bytecode_dir', self.dir / 'jinja2' / 'bytecode'),
+                            ('bundle_dir', self.bundle_dir)):
+            patcher = patch.object(template_cache, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.write('base.html', '<title>{% block title %}{% endblock %}</title>')
+        self.write('text.html', '{% extends "base.html" %}{% block title %}{{ title }}{% endblock %}')
+        self.compiled = []
+
+    def tearDown(self):
+        shutil.rmtree(str(self.dir))
+
+    def write(self, name, source):
+        file = self.templates_dir / name
+        file.write_text(source, encoding='utf-8')
+        return file
+
+    def new_env(self):
+        """ An environment as a new server process makes one, which
+        records which templates it compiles """
+        env = jinja2.Environment(loader=BundleLoader(self.templates_dir, self.bundle_dir),
+                                 bytecode_cache=template_cache.get_bytecode_cache(),
+                                 auto_reload=True)
+        compile = env.compile
+        def record_compile(source, name=None, *args, **kwargs):
+            self.compiled.append(name)
+            return compile(source, name, *args, **kwargs)
+        env.compile = record_compile
+        return env
+
+    def render(self, env):
+        return env.get_template('text.html').render(title='DN 1')
+
+    def test_bytecode_cache(self):
+        self.assertEqual('<title>DN 1</title>', self.render(self.new_env()))
+        self.assertEqual(['text.html', 'base.html'], self.compiled)
+        self.compiled.clear()
+        # Another process loads the compiled code
+        self.assertEqual('<title>DN 1</title>', self.render(self.new_env()))
+        self.assertEqual([], self.compiled)
+
+    def test_bytecode_invalidated(self):
+        self.render(self.new_env())
+        self.compiled.clear()
+        touch(self.write('base.html', '<h1>{% block title %}{% endblock %}</h1>'))
+        self.assertEqual('<h1>DN 1</h1>', self.render(self.new_env()))
+        self.assertEqual(['base.html'], self.compiled)
+
+    def test_bundle(self):
+        self.assertEqual(2, template_cache.precompile(self.new_env()))
+        self.compiled.clear()
+        env = self.new_env()
+        with patch.object(jinja2.FileSystemLoader, 'get_source', side_effect=AssertionError):
+            self.assertEqual('<title>DN 1</title>', self.render(env))
+        self.assertEqual([], self.compiled)
+        # A template modified since is reloaded from its source
+        touch(self.write('text.html', '{% extends "base.html" %}'
+                                      '{% block title %}{{ title }}!{% endblock %}'))
+        self.assertEqual('<title>DN 1!</title>', self.render(env))
+        self.assertEqual('<title>DN 1!</title>', self.render(self.new_env()))
+
+    def test_bundle_replaced(self):
+        template_cache.precompile(self.new_env())
+        self.write('base.html', '<h1>{% block title %}{% endblock %}</h1>')
+        template_cache.precompile(self.new_env())
+        self.assertEqual(['bundle'], sorted(path.name for path in self.bundle_dir.parent.iterdir()
+                                            if path.name.startswith('bundle')))
+        self.compiled.clear()
+        self.assertEqual('<h1>DN 1</h1>', self.render(self.new_env()))
+        self.assertEqual([], self.compiled)
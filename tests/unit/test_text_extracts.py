@@ -0,0 +1,154 @@
+import hashlib
+import os
+import pathlib
+import shutil
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import sc
+from sc import page_transforms, text_extracts
+from sc.text_extracts import TextExtractStore
+
+
+page_tmpl = '''<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>{uid}</title></head>
+<body>
+<div id="text"><section class="sutta" id="{uid}"><article>
+<div class="hgroup"><h1>{name}</h1></div>
+<p>{body}</p>
+</article></section></div>
+</body></html>
+'''
+
+
+class FakeTIM:
+    """ The manifest and file records of a language TIM """
+
+    def __init__(self):
+        self._manifest = {}
+        self._file_records = {}
+
+    def add(self, file, name):
+        stat = file.stat()
+        key = str(file.relative_to(sc.text_dir))
+        self._manifest[key] = (stat.st_mtime_ns, stat.st_size,
+                               hashlib.md5(file.read_bytes()).hexdigest())
+        self._file_records[key] = SimpleNamespace(uid=file.stem, name=name)
+
+
+class TextExtractStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = pathlib.Path(tempfile.mkdtemp())
+        self.text_dir = self.dir / 'text'
+        for name, value in (('text_dir', self.text_dir), ('db_dir', self.dir / 'db')):
+            patcher = patch.object(sc, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.store = TextExtractStore()
+        self.tim = FakeTIM()
+        self.files = {}
+        for i in (1, 2, 3):
+            self.write('dn{}'.format(i), 'Sutta {}'.format(i), 'Thus have I heard.')
+        self.db_file = self.dir / 'db' / 'text-info-model-en_aaa.pklz'
+        # Record which files are extracted
+        self.extracted = []
+        self.extract_file = extract_file = text_extracts.extract_file
+        def record_extract(path, lang_uid):
+            self.extracted.append(pathlib.Path(path).stem)
+            return extract_file(path, lang_uid)
+        patcher = patch.object(text_extracts, 'extract_file', record_extract)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(str(self.dir))
+
+    def write(self, uid, name, body, seconds=0):
+        file = self.text_dir / 'en' / 'dn' / '{}.html'.format(uid)
+        file.parent.mkdir(parents=True, exist_ok=True)
+        file.write_text(page_tmpl.format(uid=uid, name=name, body=body), encoding='utf-8')
+        # Later than the previous version, whatever the mtime resolution
+        stat = file.stat()
+        os.utime(str(file), ns=(stat.st_atime_ns, stat.st_mtime_ns + seconds * 10**9))
+        self.tim.add(file, name)
+        self.files[uid] = file
+        return file
+
+    def update(self):
+        self.store.update_language('en', self.tim, self.db_file, workers=1)
+
+    def test_extract(self):
+        self.update()
+        self.assertEqual(['dn1', 'dn2', 'dn3'], sorted(self.extracted))
+        extract = self.store.get(self.files['dn1'])
+        self.assertEqual('Sutta 1', extract.title)
+        self.assertEqual('Thus have I heard.', extract.snippet)
+        body = text_extracts.content_regex.search(self.files['dn1'].read_text())['content']
+        self.assertEqual(page_transforms.transform(body), ''.join(extract.fragment))
+        self.assertEqual([], self.store.stale_languages({'en': self.db_file}))
+
+    def test_changed_file(self):
+        self.update()
+        self.extracted.clear()
+        self.write('dn2', 'Sutta 2', 'At one time.', seconds=10)
+        # Until the store is updated, the file is read instead
+        self.assertIsNone(self.store.get(self.files['dn2']))
+        self.update()
+        self.assertEqual(['dn2'], self.extracted)
+        self.assertIn('At one time.', ''.join(self.store.get(self.files['dn2']).fragment))
+
+    def test_touched_file(self):
+        self.update()
+        self.extracted.clear()
+        self.write('dn3', 'Sutta 3', 'Thus have I heard.', seconds=10)
+        self.assertIsNone(self.store.get(self.files['dn3']))
+        self.update()
+        self.assertEqual([], self.extracted)
+        self.assertIsNotNone(self.store.get(self.files['dn3']))
+
+    def test_removed_file(self):
+        self.update()
+        key = str(self.files['dn3'].relative_to(self.text_dir))
+        del self.tim._manifest[key]
+        self.update()
+        self.assertIsNone(self.store.get(self.files['dn3']))
+
+    def test_not_extracted(self):
+        self.assertIsNone(self.store.get(self.files['dn1']))
+        self.assertIsNone(self.store.get(self.dir / 'elsewhere.html'))
+        file = self.text_dir / 'en' / 'dn' / 'dn4.html'
+        file.write_text('<p>No body</p>', encoding='utf-8')
+        self.tim.add(file, 'Sutta 4')
+        self.update()
+        self.assertIsNone(self.store.get(file))
+
+    def test_languages(self):
+        self.update()
+        other_db_file = self.dir / 'db' / 'text-info-model-en_bbb.pklz'
+        self.assertEqual(['de', 'en'], self.store.stale_languages(
+            {'en': other_db_file, 'de': self.db_file}))
+        self.store.remove_other_languages({'de'})
+        self.assertIsNone(self.store.get(self.files['dn1']))
+        self.assertEqual(['en'], self.store.stale_languages({'en': self.db_file}))
+
+    def test_pool(self):
+        # The function given to the pool is pickled by name, so it can't
+        # be the recording one
+        with patch.object(TextExtractStore, 'pool_threshold', 1), \
+                patch.object(text_extracts, 'extract_file', self.extract_file):
+            self.store.update_language('en', self.tim, self.db_file, workers=2)
+        self.assertEqual('Sutta 2', self.store.get(self.files['dn2']).title)
+
+
+class GetStoreTest(unittest.TestCase):
+
+    def test_shared(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        with patch.object(sc, 'db_dir', pathlib.Path(directory)), \
+                patch.object(text_extracts, '_store', None):
+            store = text_extracts.get_store()
+            self.assertIs(store, text_extracts.get_store())
@@ -0,0 +1,301 @@
+import os
+import pathlib
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import sc
+from sc import textdata
+from sc.textdata import SqliteBackedTIM, TextInfoModel, TIMManager
+
+
+text_tmpl = '''<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>{uid}</title>{meta}</head>
+<body><div id="text" lang="en"><section class="sutta" id="{uid}"><article>
+<div class="hgroup"><h1>{name}</h1></div>
+<p>{body}</p>
+</article></section></div></body></html>
+'''
+
+
+def write_text(file, uid, name, body='Thus have I heard.', author='Bhikkhu Bodhi'):
+    meta = '<meta author="{}">'.format(author) if author else ''
+    file.parent.mkdir(parents=True, exist_ok=True)
+    file.write_text(text_tmpl.format(uid=uid, name=name, body=body, meta=meta),
+                    encoding='utf-8')
+
+
+def touch(file, seconds=10):
+    """ Move the mtime of file forward, whatever the mtime resolution """
+    stat = file.stat()
+    os.utime(str(file), ns=(stat.st_atime_ns, stat.st_mtime_ns + seconds * 10**9))
+
+
+class TextDataTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = pathlib.Path(tempfile.mkdtemp())
+        self.text_dir = self.dir / 'text'
+        self.db_dir = self.dir / 'db'
+        self.db_dir.mkdir()
+        for name, value in (('text_dir', self.text_dir), ('db_dir', self.db_dir)):
+            patcher = patch.object(sc, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.lang_dir = self.text_dir / 'en'
+        for i in (1, 2, 3):
+            write_text(self.lang_dir / 'dn' / 'dn{}.html'.format(i),
+                       'dn{}'.format(i), '{}. Sutta {}'.format(i, i))
+        # Record which files are parsed
+        self.parsed = []
+        parse_file = TextInfoModel._parse_file
+        def record_parse(tim, htmlfile, lang_uid):
+            self.parsed.append(htmlfile.stem)
+            return parse_file(tim, htmlfile, lang_uid)
+        patcher = patch.object(TextInfoModel, '_parse_file', record_parse)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(str(self.dir))
+
+
+class PartialUpdateTest(TextDataTestCase):
+
+    def build(self, tim=None):
+        if tim is None:
+            tim = TextInfoModel(name='en')
+            tim.build(self.lang_dir, force=True)
+        else:
+            tim.build(self.lang_dir)
+        return tim
+
+    def test_full_build(self):
+        tim = self.build()
+        self.assertEqual(['dn1', 'dn2', 'dn3'], self.parsed)
+        self.assertEqual('Sutta 2', tim.get('dn2', 'en').name)
+        self.assertEqual('dn3', tim.get('dn2', 'en').next_uid)
+
+    def test_edit_one_file(self):
+        tim = self.build()
+        records = dict(tim._file_records)
+        self.parsed.clear()
+        dn2 = self.lang_dir / 'dn' / 'dn2.html'
+        write_text(dn2, 'dn2', '2. The Fruits')
+        touch(dn2)
+        self.build(tim)
+        self.assertEqual(['dn2'], self.parsed)
+        self.assertEqual('The Fruits', tim.get('dn2', 'en').name)
+        for key in ('en/dn/dn1.html', 'en/dn/dn3.html'):
+            self.assertIs(records[key], tim._file_records[key])
+        # Guessed neighbours still come from the other files
+        self.assertEqual('dn1', tim.get('dn2', 'en').prev_uid)
+
+    def test_touched_file(self):
+        tim = self.build()
+        self.parsed.clear()
+        touch(self.lang_dir / 'dn' / 'dn3.html', seconds=2 * 86400)
+        self.build(tim)
+        self.assertEqual([], self.parsed)
+        self.assertEqual(TextInfoModel.datestr((self.lang_dir / 'dn' / 'dn3.html').stat().st_mtime),
+                         tim.get('dn3', 'en').mdate)
+
+    def test_added_and_removed_files(self):
+        tim = self.build()
+        self.parsed.clear()
+        (self.lang_dir / 'dn' / 'dn3.html').unlink()
+        write_text(self.lang_dir / 'dn' / 'dn4.html', 'dn4', '4. Sutta 4')
+        self.build(tim)
+        self.assertEqual(['dn4'], self.parsed)
+        self.assertIsNone(tim.get('dn3', 'en'))
+        self.assertEqual('Sutta 4', tim.get('dn4', 'en').name)
+        self.assertNotIn('en/dn/dn3.html', tim._manifest)
+
+    def test_metadata_author(self):
+        write_text(self.lang_dir / 'mn' / 'metadata.html', 'metadata', '', author='Ñāṇamoli')
+        write_text(self.lang_dir / 'mn' / 'mn1.html', 'mn1', '1. Mūlapariyāya', author=None)
+        tim = self.build()
+        self.parsed.clear()
+        write_text(self.lang_dir / 'mn' / 'mn1.html', 'mn1', '1. The Root', author=None)
+        touch(self.lang_dir / 'mn' / 'mn1.html')
+        self.build(tim)
+        self.assertEqual(['mn1'], self.parsed)
+        self.assertEqual('Ñāṇamoli', tim.get('mn1', 'en').author)
+
+    def test_build_language_from_previous_file(self):
+        first = self.db_dir / 'first.pklz'
+        textdata.build_language(self.lang_dir, first, return_tim=False)
+        self.parsed.clear()
+        dn1 = self.lang_dir / 'dn' / 'dn1.html'
+        write_text(dn1, 'dn1', '1. The Net')
+        touch(dn1)
+        tim = textdata.build_language(self.lang_dir, self.db_dir / 'second.pklz',
+                                      previous_file=first)
+        self.assertEqual(['dn1'], self.parsed)
+        self.assertEqual('The Net', tim.get('dn1', 'en').name)
+        self.assertEqual('Sutta 3', tim.get('dn3', 'en').name)
+
+    def test_get_previous_db_file(self):
+        self.assertIsNone(TIMManager.get_previous_db_file('en'))
+        names = ['text-info-model-en_aaa.pklz', 'text-info-model-en_bbb.pklz',
+                 'text-info-model-en-gb_ccc.pklz']
+        for name in names:
+            (self.db_dir / name).write_bytes(b'')
+            touch(self.db_dir / name, seconds=names.index(name) + 1)
+        self.assertEqual(self.db_dir / names[1], TIMManager.get_previous_db_file('en'))
+        self.assertEqual(self.db_dir / names[2], TIMManager.get_previous_db_file('en-gb'))
+
+
+class SqliteBackedTIMTest(TextDataTestCase):
+
+    def setUp(self):
+        super().setUp()
+        write_text(self.text_dir / 'de' / 'dn' / 'dn1.html', 'dn1', '1. Das Brahmajāla',
+                   author='Ñāṇadassana')
+        write_text(self.text_dir / 'de' / 'dn' / 'dn2.html', 'dn2', '2. Die Früchte',
+                   body='So habe ich gehört.', author=None)
+        self.components = {lang_uid: self.build_language(lang_uid) for lang_uid in ('en', 'de')}
+        self.db_files = {lang_uid: self.db_dir / '{}.pklz'.format(lang_uid)
+                         for lang_uid in self.components}
+
+    def build_language(self, lang_uid):
+        tim = TextInfoModel(name=lang_uid)
+        tim.build(self.text_dir / lang_uid, force=True)
+        return tim
+
+    def write(self, name, components, previous_file=None):
+        file = self.db_dir / name
+        SqliteBackedTIM.write(file, components, self.db_files, name, previous_file)
+        return SqliteBackedTIM(file)
+
+    def assertSameTIM(self, components, tim):
+        self.assertEqual(sorted(components), tim.languages())
+        for lang_uid, lang_tim in components.items():
+            textinfos = lang_tim.get(lang_uid=lang_uid)
+            spliced = tim.get(lang_uid=lang_uid)
+            self.assertEqual(list(textinfos), list(spliced))
+            self.assertEqual(len(textinfos), len(spliced))
+            for uid, textinfo in textinfos.items():
+                self.assertEqual(textinfo.as_dict(), tim.get(uid, lang_uid).as_dict())
+                self.assertEqual(textinfo.as_dict(), spliced[uid].as_dict())
+                self.assertIn(lang_uid, tim.get(uid))
+                self.assertTrue(tim.exists(uid, lang_uid))
+            for style in ('normal', 'bold', 'italic'):
+                self.assertEqual(set(lang_tim.get_codepoints_used(lang_uid, style)),
+                                 set(tim.get_codepoints_used(lang_uid, style)))
+
+    def test_get(self):
+        tim = self.write('tim.sqlite', self.components)
+        self.assertSameTIM(self.components, tim)
+        self.assertEqual(['de', 'en'], list(tim.get('dn1')))
+        self.assertEqual('Ñāṇadassana', tim.get('dn1', 'de').author)
+        self.assertFalse(tim.get('dn2', 'de').author)
+        self.assertIsNone(tim.get('dn3', 'de'))
+        self.assertEqual({}, tim.get('mn1'))
+        self.assertNotIn('dn3', tim.get(lang_uid='de'))
+        self.assertFalse(tim.exists(lang_uid='fr'))
+        with self.assertRaises(KeyError):
+            tim.get(lang_uid='de')['dn3']
+        with self.assertRaises(ValueError):
+            tim.get()
+
+    def test_splice_one_language(self):
+        first = self.write('first.sqlite', self.components)
+        write_text(self.text_dir / 'de' / 'dn' / 'dn2.html', 'dn2', '2. Die Frucht',
+                   author='Ñāṇadassana')
+        write_text(self.text_dir / 'de' / 'dn' / 'dn3.html', 'dn3', '3. Ambaṭṭha')
+        self.components['de'] = self.build_language('de')
+        spliced = self.write('second.sqlite', {'de': self.components['de']},
+                             previous_file=first.file)
+        self.assertSameTIM(self.components, spliced)
+        self.assertEqual('Die Frucht', spliced.get('dn2', 'de').name)
+        self.assertEqual('Ñāṇadassana', spliced.get('dn2', 'de').author)
+        self.assertEqual({'en': 'en.pklz', 'de': 'de.pklz'},
+                         SqliteBackedTIM.read_languages(spliced.file))
+        # The previous database is unchanged
+        self.assertEqual('Die Früchte', first.get('dn2', 'de').name)
+
+    def test_removed_language(self):
+        first = self.write('first.sqlite', self.components)
+        del self.db_files['de']
+        spliced = self.write('second.sqlite', {}, previous_file=first.file)
+        self.assertSameTIM({'en': self.components['en']}, spliced)
+        self.assertIsNone(spliced.get('dn1', 'de'))
+        self.assertIsNone(spliced.get_codepoints_used('de'))
+
+
+class SpliceTest(TextDataTestCase):
+
+    def setUp(self):
+        super().setUp()
+        write_text(self.text_dir / 'de' / 'dn' / 'dn1.html', 'dn1', '1. Das Brahmajāla')
+        for patcher in (patch.dict(sc.config.app, {'tim_build_workers': 1}),
+                        patch.object(TIMManager, '_change_detectors', {}),
+                        patch.object(textdata.text_extracts, 'update')):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        # Record which language databases are loaded
+        self.loaded = []
+        load = sc.util.lz4_pickle_load
+        def record_load(file):
+            self.loaded.append(pathlib.Path(file).name.split('_')[0])
+            return load(file)
+        patcher = patch.object(sc.util, 'lz4_pickle_load', record_load)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.manager = TIMManager()
+        self.manager.load()
+
+    def rows(self, tim):
+        return {lang_uid: [(uid, textinfo.as_dict())
+                           for uid, textinfo in tim.get(lang_uid=lang_uid).items()]
+                for lang_uid in tim.languages()}
+
+    def test_first_load(self):
+        tim = self.manager.instance
+        self.assertEqual(['de', 'en'], tim.languages())
+        self.assertEqual('Das Brahmajāla', tim.get('dn1', 'de').name)
+
+    def test_unchanged(self):
+        tim = self.manager.instance
+        self.parsed.clear()
+        self.loaded.clear()
+        self.manager.load()
+        self.assertEqual([], self.parsed)
+        self.assertEqual([], self.loaded)
+        self.assertEqual(tim.file, self.manager.instance.file)
+
+    def test_one_language_changed(self):
+        self.parsed.clear()
+        self.loaded.clear()
+        write_text(self.text_dir / 'de' / 'dn' / 'dn2.html', 'dn2', '2. Die Früchte')
+        touch(self.text_dir / 'de' / 'dn')
+        self.manager.load()
+        self.assertEqual(['dn2'], self.parsed)
+        # Only the previous database of the changed language is loaded
+        self.assertEqual(['text-info-model-de'], self.loaded)
+        spliced = self.rows(self.manager.instance)
+        self.assertEqual('Die Früchte', self.manager.instance.get('dn2', 'de').name)
+        self.manager.load(force=True)
+        self.assertEqual(self.rows(self.manager.instance), spliced)
+
+    def test_language_removed(self):
+        shutil.rmtree(str(self.text_dir / 'de'))
+        self.loaded.clear()
+        self.manager.load()
+        self.assertEqual([], self.loaded)
+        self.assertEqual(['en'], self.manager.instance.languages())
+        self.assertIsNone(self.manager.instance.get_codepoints_used('de'))
+
+    def test_other_version(self):
+        self.parsed.clear()
+        self.loaded.clear()
+        write_text(self.text_dir / 'de' / 'dn' / 'dn2.html', 'dn2', '2. Die Früchte')
+        touch(self.text_dir / 'de' / 'dn')
+        with patch.object(SqliteBackedTIM, 'version', SqliteBackedTIM.version + 1):
+            self.manager.load()
+        self.assertEqual(['dn2'], self.parsed)
+        # Every language is spliced again, rather than into the old TIM
+        self.assertEqual(['text-info-model-de', 'text-info-model-en'], sorted(self.loaded))
+        self.assertEqual(['de', 'en'], self.manager.instance.languages())
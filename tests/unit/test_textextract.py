@@ -0,0 +1,213 @@
+import pathlib
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import sc
+from sc.codepoints import CodepointSet
+from sc.textdata import FileRecord, TextInfo, TextInfoModel
+from sc.tools import html
+
+
+def tree_parse_file(tim, htmlfile, lang_uid):
+    """ TextInfoModel._parse_file as it was before streaming, which parsed
+    the whole document (also in tasks/textdata.py) """
+    uid = htmlfile.stem
+    root = html.parse(str(htmlfile)).getroot()
+    record = FileRecord(uid=uid, path=htmlfile.relative_to(sc.text_dir))
+    codepoints = set()
+    bold_codepoints = set()
+    italic_codepoints = set()
+    stack = [root]
+    while stack:
+        e = stack.pop()
+        if tim.is_bold(lang_uid, e):
+            bold_codepoints.update(e.text_content())
+        elif tim.is_italic(lang_uid, e):
+            italic_codepoints.update(e.text_content())
+        else:
+            stack.extend(e)
+    codepoints.update(root.text_content())
+    record.codepoints = tuple(CodepointSet(chars) for chars
+                              in (codepoints, bold_codepoints, italic_codepoints))
+    record.prev_uid = root.get('data-prev')
+    record.next_uid = root.get('data-next')
+    for selector, attr in (('meta[author]', 'author'),
+                           ('meta[data-author]', 'data-author'),
+                           ('meta[name=description]', 'content')):
+        e = root.select_one(selector)
+        if e:
+            record.author = e.attrib[attr]
+            break
+    else:
+        e = root.select_one('#metaarea > .author')
+        if e:
+            record.author = e.text
+    if uid == 'metadata':
+        return tim._metadata_record(record, htmlfile)
+    metadata = root.select_one('#metaarea')
+    if metadata:
+        record.metaarea_author = tim._guess_author(metadata.text_content())
+    try:
+        record.name = tim._clean_name(root.select_one('.hgroup').select_one('h1').text_content())
+    except Exception:
+        record.name = ''
+    record.volpage = tree_volpage(tim, root, lang_uid)
+    record.embedded = [(child.uid, child.bookmark, child.name, child.volpage)
+                       for child in tree_embedded(tim, root, lang_uid, uid)]
+    record.set_dates(htmlfile)
+    return record
+
+
+def tree_volpage(tim, element, lang_uid):
+    selector = {'zh': '.t, .t-linehead', 'pi': '.ms'}.get(lang_uid)
+    if selector is None:
+        return None
+    e = element.next_in_order()
+    while e is not None:
+        if e.tag == 'a' and e.select_one(selector):
+            return tim._format_volpage(lang_uid, e.attrib['id'])
+        e = e.next_in_order()
+    return None
+
+
+def tree_embedded(tim, root, lang_uid, uid):
+    out = []
+    if '-pm' in uid:
+        for h4 in root.select('h4'):
+            a = h4.select_one('a[id]')
+            if a is not None:
+                out.append(TextInfo(uid='{}#{}'.format(uid, a.attrib['id']),
+                                    bookmark=a.attrib['id'], name=None,
+                                    volpage=tree_volpage(tim, h4, lang_uid)))
+    data_uid_seen = set()
+    for e in root.select('[data-uid]'):
+        if e.tag in {'h1', 'h2', 'h3', 'h4', 'h5', 'h6'}:
+            heading = e.text_content()
+            add = e.select_one('.add')
+            if add and add.text_content() == heading:
+                heading = '[' + heading + ']'
+        else:
+            heading = None
+        out.append(TextInfo(uid=e.get('data-uid'), name=heading, bookmark=e.get('id')))
+        data_uid_seen.add(e)
+    for e in root.select('.embeddedparallel'):
+        if 'data-uid' in e.attrib:
+            if e in data_uid_seen:
+                continue
+            new_uid = e.attrib['data-uid']
+        else:
+            new_uid = '{}#{}'.format(uid, e.attrib['id'])
+        out.append(TextInfo(uid=new_uid, bookmark=e.attrib['id']))
+    sections = root.select('section.sutta')
+    if len(sections) > 1:
+        for section in sections:
+            if section.attrib.get('data-uid'):
+                out.append(TextInfo(uid=section.attrib['data-uid'],
+                                    bookmark=section.attrib.get('id')))
+    return out
+
+
+samples = {
+    'en/dn/dn1.html': '''<!DOCTYPE html>
+<html data-prev="dn0" data-next="dn2"><head><meta charset="utf-8">
+<meta author="Bhikkhu Sujato"><title>DN 1</title></head>
+<body><div id="text" lang="en"><section class="sutta" id="dn1"><article>
+<div id="metaarea"><p>Translated by Bhikkhu Sujato. Released 2015.</p></div>
+<div class="hgroup"><p class="division">Long Discourses</p><h1>1. The <b>Prime</b> Net</h1></div>
+<p>Thus have I <em>heard</em>. At one <i>time</i> the <strong>Buddha</strong>…</p>
+<h2 data-uid="dn1.2" id="two"><span class="add">Two</span></h2>
+<h3 data-uid="dn1.3" id="three"><span class="add">Three</span></h3>
+<div class="embeddedparallel" id="ep1"></div>
+<div class="embeddedparallel" data-uid="dn1.4" id="ep2"></div>
+</article></section></div></body></html>
+''',
+    'en/mn/mn1.html': '''<!DOCTYPE html>
+<html><head><meta charset="utf-8"><meta name="description" content="Ñāṇamoli"></head>
+<body><div id="text"><section class="sutta" id="mn1a" data-uid="mn1a"><article>
+<div id="metaarea">No sentence here at all just words and more words and more</div>
+<p>No heading</p></article></section>
+<section class="sutta" id="mn1b" data-uid="mn1b"><p>Second</p></section>
+</div></body></html>
+''',
+    'en/sn/metadata.html': '''<!DOCTYPE html>
+<html><head><meta charset="utf-8"></head>
+<body><div id="metaarea"><span class="author">Bhikkhu Bodhi</span></div></body></html>
+''',
+    'zh/t/t1.html': '''<!DOCTYPE html>
+<html><head><meta charset="utf-8"><meta data-author="CBETA"></head>
+<body><div id="text" lang="zh"><section class="sutta" id="t1"><article>
+<div class="hgroup"><h1>長阿含經</h1></div>
+<p><a class="t" id="t1.1a1"></a>如是我聞</p>
+<h2 data-uid="t1.2">第二</h2><p><a id="t1.1b5"><span class="t-linehead"></span></a>一時</p>
+</article></section></div></body></html>
+''',
+    'pi/vi/pi-tv-bu-pm.html': '''<!DOCTYPE html>
+<html><head><meta charset="utf-8"></head>
+<body><div id="text" lang="pi"><section class="sutta" id="pm"><article>
+<div class="hgroup"><h1>Pātimokkha</h1></div>
+<p><a id="vin3.1"><span class="ms"></span></a>Suṇātu me</p>
+<h4><a id="pj1"></a>Pārājika 1</h4><p>Yo pana</p>
+<h4>No anchor</h4>
+<h4><a id="pj2"></a>Pārājika 2</h4><p><a id="vin3.2"><span class="ms"></span></a>Yo pana</p>
+</article></section></div></body></html>
+''',
+}
+
+
+class ExtractTextTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = pathlib.Path(tempfile.mkdtemp())
+        patcher = patch.object(sc, 'text_dir', self.dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # The volpages are compared as the ids of their anchors
+        for name, value in (('_format_volpage', lambda tim, lang_uid, anchor_id: anchor_id),
+                            ('_format_volpages', lambda tim, lang_uid, anchor_ids: list(anchor_ids))):
+            patcher = patch.object(TextInfoModel, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.tim = TextInfoModel()
+        for path, text in samples.items():
+            file = self.dir / path
+            file.parent.mkdir(parents=True, exist_ok=True)
+            file.write_text(text, encoding='utf-8')
+
+    def tearDown(self):
+        shutil.rmtree(str(self.dir))
+
+    def parse(self, path):
+        file = self.dir / path
+        lang_uid = path.split('/')[0]
+        return self.tim._parse_file(file, lang_uid), tree_parse_file(self.tim, file, lang_uid)
+
+    def assertSameRecord(self, path):
+        streamed, tree = self.parse(path)
+        for field in FileRecord.__slots__:
+            self.assertEqual(getattr(tree, field), getattr(streamed, field), (path, field))
+        return streamed
+
+    def test_same_as_tree(self):
+        for path in samples:
+            self.assertSameRecord(path)
+
+    def test_sample_values(self):
+        record = self.assertSameRecord('en/dn/dn1.html')
+        self.assertEqual(('dn0', 'dn2'), (record.prev_uid, record.next_uid))
+        self.assertEqual('The Prime Net', record.name)
+        self.assertEqual('Translated by Bhikkhu Sujato. Released 2015.', record.metaarea_author)
+        self.assertIn('P', record.codepoints[1])
+        self.assertNotIn('P', record.codepoints[2])
+        self.assertEqual(['dn1.2', 'dn1.3', 'dn1.4', 'dn1#ep1'],
+                         [child[0] for child in record.embedded])
+        self.assertEqual('[Two]', record.embedded[0][2])
+        record = self.assertSameRecord('zh/t/t1.html')
+        self.assertEqual('t1.1a1', record.volpage)
+        self.assertEqual(('t1.2', None, '第二', None), record.embedded[0])
+        record = self.assertSameRecord('pi/vi/pi-tv-bu-pm.html')
+        self.assertEqual([('pi-tv-bu-pm#pj1', 'pj1', None, 'vin3.2'),
+                          ('pi-tv-bu-pm#pj2', 'pj2', None, 'vin3.2')], record.embedded)
+        record = self.assertSameRecord('en/sn/metadata.html')
+        self.assertEqual('Bhikkhu Bodhi', record.author)
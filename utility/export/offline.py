@@ -4,7 +4,6 @@
 
 import argparse
 import pathlib
-import plumbum
 import tempfile
 
 import env
@@ -12,21 +11,12 @@ import env
 import sc
 
 from common import *
+from prerender import prerender
 
 index_html_path = export_code_dir / 'offline_index.html'
 readme_path = export_code_dir / 'offline_readme.txt'
 
-def crawl(host, out_dir, wait=0.0, quiet=False, omit=None):
-    cmd_path = sc.base_dir / 'utility' / 'crawl.py'
-    args = ['--wait', str(wait)]
-    if quiet:
-        args.append('--quiet')
-    if omit:
-        args.extend(['--omit', omit])
-    args += [host, out_dir]
-    plumbum.local[str(cmd_path)][tuple(args)] & plumbum.FG
-
-def generate(host, basestem, wait=0.0, force=False, quiet=False, omit=None):
+def generate(basestem, force=False, quiet=False, omit=None, processes=None):
     basename = '{}-{}'.format(basestem, export_file_date())
     output_zip = sc.exports_dir / (basename + '.zip')
     output_7z = sc.exports_dir / (basename + '.7z')
@@ -48,9 +38,11 @@ def generate(host, basestem, wait=0.0, force=False, quiet=False, omit=None):
         copy(readme_path, output_dir / 'README.txt')
         copy(license_path, output_dir / 'LICENSE.txt')
 
-        # Crawl website... (go get a cup of tea)
-        crawler_output_dir = output_dir / 'sc'
-        crawl(host, crawler_output_dir, wait=wait, quiet=quiet, omit=omit)
+        # Render the website
+        site_output_dir = output_dir / 'sc'
+        if prerender(site_output_dir, omit=omit, processes=processes, quiet=quiet) < 1:
+            sys.stderr.write('ERROR: nothing was rendered\n')
+            sys.exit(1)
 
         tmp_output_zip = tmp_dir / (basename + '.zip')
         tmp_output_7z = tmp_dir / (basename + '.7z')
@@ -71,18 +63,18 @@ def parse_args():
     parser = argparse.ArgumentParser(
         description='SuttaCentral Offline Export Generator',
         formatter_class=argparse.ArgumentDefaultsHelpFormatter)
-    parser.add_argument('host', type=str, help='the host to crawl')
     parser.add_argument('basestem', type=str, help='base filename')
-    parser.add_argument('-w', '--wait', type=float, default=0.0,
-        help='time to wait between crawl requests in seconds')
+    parser.add_argument('-p', '--processes', type=int, default=None,
+        help='number of processes rendering pages (default: one per core)')
     parser.add_argument('-f', '--force', action='store_true',
         help='overwrite existing output')
     parser.add_argument('--omit', type=str, default='',
-        help='do not crawl urls containing language codes (comma seperated)')
+        help='do not render urls containing language codes (comma seperated)')
     parser.add_argument('-q', '--quiet', action='store_true',
         help='suppress non-errors from output')
     return parser.parse_args()
 
 if __name__ == '__main__':
     args = parse_args()
-    generate(args.host, args.basestem, wait=args.wait, force=args.force, quiet=args.quiet, omit=args.omit)
+    generate(args.basestem, force=args.force, quiet=args.quiet, omit=args.omit,
+        processes=args.processes)
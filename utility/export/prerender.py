@@ -0,0 +1,319 @@
+#!/usr/bin/env python
+
+"""SuttaCentral Offline Pre-renderer
+
+Renders every page of SuttaCentral to a folder of HTML files and the
+assets they use, for the offline export.
+
+It used to be made by crawling a running server over HTTP (see
+utility/crawl.py), one page at a time. Here the pages are rendered in
+process, by the same views the server uses (sc.show), in a pool of
+worker processes forked once the TIM and IMM are loaded, so they share
+them. No server is needed.
+
+The pages are found from the IMM and TIM: the home page, static pages,
+pitakas, divisions, subdivisions, the parallels of each sutta, the
+language pages and every text. Each round renders the pages found so
+far, and any link of a rendered page to a page or asset which isn't
+exported yet is exported in the next round, as the crawler would have
+followed it.
+
+Links are rewritten to be relative, with .html added to pages, as the
+crawler did. Pages are rendered with the offline flag set, as the
+crawler's requests had the offline cookie.
+"""
+
+import argparse
+import json
+import multiprocessing
+import pathlib
+import shutil
+import sys
+import time
+import urllib.parse
+from http.cookies import SimpleCookie
+
+import cherrypy
+import regex
+from cherrypy.lib import httputil
+from lxml import html
+
+import env
+
+import sc
+
+# The first part of the paths of the site which aren't pages of the
+# offline export (they need the server).
+excluded_roots = {'admin', 'advanced_search', 'data', 'define', 'donate',
+                  'profiler', 'search', 'sht_lookup', 'sht-lookup',
+                  'sutta_info', 'tools'}
+
+# Redirects followed before giving up on a page
+max_redirects = 5
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='SuttaCentral Offline Pre-renderer',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('dir', type=str, help='output directory')
+    parser.add_argument('--omit', type=str, default='',
+        help='Do not render pages for these language codes, comma or space seperated')
+    parser.add_argument('-p', '--processes', type=int, default=None,
+        help='number of processes rendering pages (default: one per core)')
+    parser.add_argument('-q', '--quiet', action='store_true',
+        help='suppress non-errors from output')
+    return parser.parse_args()
+
+def fixurl(url):
+    """
+        /a/b/   -> /a/b
+        /a/b/#c -> /a/b
+        /a/b/?c=1 -> /a/b
+    """
+    return regex.sub(r'(.)/?([#?].*)?$', r'\1', url)
+
+def getending(url):
+    if '.' in url:
+        ending = url.split('.')[-1]
+        if regex.match(r'\d', ending):
+            ending = ''
+    else:
+        ending = ''
+    return ending
+
+def output_path(path):
+    """ Return the path of the file of path, relative to the output
+    directory """
+    new_url = fixurl(path)[1:]
+    if new_url == '':
+        new_url = 'index'
+    if not getending(path):
+        new_url += '.html'
+    return urllib.parse.unquote(new_url)
+
+def fixcss(text, depth, links):
+    """A hack that only works on sc.css."""
+    def callback(m):
+        url = m[2]
+        links.add(fixurl(url))
+        return 'url({}{}{}{})'.format(m[1] or '', '../' * depth, url[1:], m[3] or '')
+    return regex.sub(r'url\(([\'"])?(/[^\'")]+)([\'"])?\)', callback, text,
+        flags=regex.MULTILINE)
+
+def get_omit_rex(omit_codes):
+    extra_omit = {'sht-lookup'}
+    return regex.compile(r'\b({})\b(?!-)'.format('|'.join(omit_codes | extra_omit)))
+
+def enumerate_paths(omit_codes=frozenset()):
+    """ Yield the paths of the pages of the site """
+    from sc import scimm, show
+    imm = scimm.imm()
+    yield '/'
+    yield '/downloads'
+    for page in sorted(show.STATIC_PAGES):
+        yield '/' + page
+    for uid in imm.pitakas:
+        yield '/' + uid
+    for uid, division in imm.divisions.items():
+        yield '/' + uid
+        if division.has_subdivisions():
+            yield '/{}/full'.format(uid)
+    for uid in imm.subdivisions:
+        yield '/' + uid
+    for uid in imm.suttas:
+        yield '/' + uid
+    for lang_uid in imm.languages:
+        if lang_uid not in omit_codes:
+            yield '/' + lang_uid
+    for lang_uid in imm.tim.languages():
+        if lang_uid in omit_codes:
+            continue
+        for uid, textinfo in imm.tim.get(lang_uid=lang_uid).items():
+            # Other uids redirect to the text of their file
+            if textinfo.file_uid == uid:
+                yield '/{}/{}'.format(lang_uid, uid)
+    # Js files which are requested via AJAX thus lacking href or src
+    # references.
+    tomatch = ['zh', 'pi']
+    for file in sorted(sc.static_dir.glob('js/**/*.js')):
+        if any(string in file.name for string in tomatch):
+            yield '/' + str(file.relative_to(sc.static_dir))
+
+def _set_request():
+    """ Set up the request of this process as one of the crawler """
+    request = cherrypy._cprequest.Request(httputil.Host('127.0.0.1', 80, ''),
+                                          httputil.Host('127.0.0.1', 1111, ''))
+    response = cherrypy._cprequest.Response()
+    cherrypy.serving.load(request, response)
+    request.method = 'GET'
+    request.headers = httputil.HeaderMap()
+    request.params = {}
+    request.cookie = SimpleCookie()
+    request.cookie['offline'] = '1'
+    request.offline = True
+
+def render(path):
+    """ Return the content of path as the server would """
+    from sc import show
+    _set_request()
+    segments = [urllib.parse.unquote(segment) for segment in path.split('/') if segment]
+    if not segments:
+        return show.home()
+    if segments[0] in excluded_roots:
+        raise cherrypy.NotFound()
+    if segments == ['downloads']:
+        return show.downloads()
+    return show.default(*segments)
+
+# The state of the worker processes, set by _init_worker
+output_dir = None
+omit_codes = None
+omit_rex = None
+
+def _init_worker(_output_dir, _omit_codes):
+    global output_dir, omit_codes, omit_rex
+    output_dir = _output_dir
+    omit_codes = _omit_codes
+    omit_rex = get_omit_rex(omit_codes)
+    # Nothing is rendered twice
+    from sc.render_cache import render_cache
+    render_cache.max_chars = 0
+
+def export_path(path):
+    """ Write the page or asset of path to the output directory, return
+    (path, links, error) where links are the paths it links to """
+    links = set()
+    try:
+        _export(path, links)
+    except Exception as e:
+        return path, links, '{}: {}'.format(type(e).__name__, e)
+    return path, links, None
+
+def _export(path, links):
+    new_url = output_path(path)
+    outfile = output_dir / new_url
+    depth = len(new_url.split('/')) - 1
+    outfile.parent.mkdir(parents=True, exist_ok=True)
+    ending = getending(path)
+
+    static_file = sc.static_dir / urllib.parse.unquote(fixurl(path)[1:])
+    if path != '/' and static_file.is_file():
+        if ending == 'css':
+            text = static_file.read_text(encoding='utf8')
+            outfile.write_text(fixcss(text, depth, links), encoding='utf8')
+        else:
+            shutil.copyfile(str(static_file), str(outfile))
+        return
+
+    target = path
+    for i in range(max_redirects):
+        try:
+            content = render(target)
+            break
+        except cherrypy.HTTPRedirect as e:
+            target = urllib.parse.urlparse(e.urls[0]).path
+    else:
+        raise ValueError('Too many redirects')
+
+    if ending and ending != 'html':
+        outfile.write_text(content, encoding='utf8')
+        return
+
+    # We need to be very careful and explicit with lxml to handle utf8
+    # correctly. See http://stackoverflow.com/questions/15302125/html-encoding-and-lxml-parsing
+    parser = html.HTMLParser(encoding='utf8')
+    root = html.fromstring(content.encode('utf8'), parser=parser)
+
+    if omit_codes:
+        s = root.cssselect('script#sc_text_info')
+        if s:
+            text_info = s[0]
+            jso = json.loads(text_info.text)
+            jso["all_lang_codes"] = [code for code in jso["all_lang_codes"] if code not in omit_codes]
+            text_info.text = json.dumps(jso)
+
+    for a in root.cssselect('[href], [src]'):
+        attr = 'href'
+        if 'src' in a.attrib:
+            attr = 'src'
+        try:
+            href = a.attrib[attr]
+        except KeyError:
+            continue
+        # Links to omitted pages are made absolute and the pages aren't
+        # exported.
+        if omit_rex.search(href) or omit_rex.search(a.text_content()):
+            a.set(attr, urllib.parse.urljoin('http://suttacentral.net/', href))
+            continue
+        if not href or not href.startswith('/') or href.startswith('//'):
+            continue
+        links.add(fixurl(href))
+        new_href = fixurl(href)[1:]
+        if new_href == '':
+            new_href = 'index'
+        if depth > 0:
+            new_href = '../' * depth + new_href
+        if not getending(href):
+            new_href += '.html'
+        # Keep the bookmark
+        fragment = urllib.parse.urlparse(href).fragment
+        if fragment:
+            new_href += '#' + fragment
+
+        a.attrib[attr] = new_href
+
+    with outfile.open('wb') as f:
+        f.write(b'<!DOCTYPE html>\n')
+        f.write(html.tostring(root, encoding='utf8'))
+
+def prerender(out_dir, omit=None, processes=None, quiet=False):
+    """ Export the site to out_dir, return the number of pages and
+    assets written """
+    out_dir = pathlib.Path(str(out_dir)).resolve()
+    out_dir.mkdir(parents=True, exist_ok=True)
+    omit_codes = frozenset(s for s in regex.split(r'[ ,]', omit or '') if s != '')
+
+    # The workers are forked once the models are loaded.
+    import sc.textdata, sc.scimm, sc.text_image_index
+    sc.textdata.build()
+    sc.scimm.build()
+    sc.text_image_index.build()
+    omit_rex = get_omit_rex(omit_codes)
+    paths = [fixurl(path) for path in enumerate_paths(omit_codes)
+             if not omit_rex.search(path)]
+    seen = set(paths)
+
+    start = time.time()
+    count = 0
+    errors = 0
+    with multiprocessing.Pool(processes, initializer=_init_worker,
+                              initargs=(out_dir, omit_codes)) as pool:
+        while paths:
+            if not quiet:
+                print('Rendering {} pages and assets'.format(len(paths)))
+            new_paths = []
+            for path, links, error in pool.imap_unordered(export_path, paths, chunksize=16):
+                if error:
+                    errors += 1
+                    sys.stderr.write('{}: {}\n'.format(path, error))
+                else:
+                    count += 1
+                for link in links:
+                    first = link.strip('/').split('/')[0]
+                    if link not in seen and first not in excluded_roots:
+                        seen.add(link)
+                        new_paths.append(link)
+            paths = new_paths
+
+    total = time.time() - start
+    if not quiet:
+        print('{} pages and assets rendered in {:.0f} seconds, {} pages per second, {} errors.'.format(
+            count, total, round(count / max(total, 1)), errors))
+    return count
+
+if __name__ == '__main__':
+    args = parse_args()
+    count = prerender(args.dir, omit=args.omit, processes=args.processes,
+                      quiet=args.quiet)
+    if count < 1:
+        sys.exit(1)